@@ -0,0 +1,227 @@
+from dataclasses import dataclass, field
+import operator
+
+import numpy as np
+
+from block_store import time_to_slot_ceil
+from columns import sum_relay_shares
+
+
+# Dimensions misses can be attributed to. Builders are derived from fee
+# recipients, and depositors and Lido operators from proposer indices.
+FEE_RECIPIENT = "fee_recipient"
+PROPOSER_INDEX = "proposer_index"
+RELAY = "relay"
+DIMENSIONS = (FEE_RECIPIENT, PROPOSER_INDEX, RELAY)
+
+
+# Misses and blocks counted per key of a dimension. num_blocks is the market
+# share denominator: all blocks for fee recipients, proposed blocks for proposer
+# indices and slots with relay data for relays. Slots relayed by several relays
+# are split evenly between them.
+@dataclass
+class Tally:
+    misses: dict = field(default_factory=dict)
+    blocks: dict = field(default_factory=dict)
+    num_blocks: int = 0
+
+
+# Counts misses and blocks for all given dimensions of the dataset. The counts
+# are computed on the columnar form of the dataset (see columns.py), so each
+# dimension takes a few vectorized passes over the misses and blocks.
+def aggregate(dataset, dimensions=DIMENSIONS):
+    return aggregate_windows(dataset, dimensions, [None])[0]
+
+
+# Like aggregate, but returns the tallies of several windows that end at the end
+# of the dataset and start at the given times (None for the whole dataset). A
+# window only contains the blocks and relay data of slots after its start and
+# the misses of txs first missed after it. Since the windows are nested, the
+# counts of each window are those of the next smaller one plus the counts of the
+# elements between their starts, so every element is counted only once no
+# matter how many windows there are.
+def aggregate_windows(dataset, dimensions, window_froms):
+    for dimension in dimensions:
+        if dimension not in DIMENSIONS:
+            raise ValueError(f"unknown dimension {dimension}")
+    misses = dataset.miss_columns
+    window_tallies = [{} for _ in window_froms]
+    if FEE_RECIPIENT in dimensions:
+        tallies = count_by_fee_recipient(dataset.block_columns, misses, window_froms)
+        for window_tally, tally in zip(window_tallies, tallies):
+            window_tally[FEE_RECIPIENT] = tally
+    if PROPOSER_INDEX in dimensions:
+        tallies = count_by_proposer_index(dataset.block_columns, misses, window_froms)
+        for window_tally, tally in zip(window_tallies, tallies):
+            window_tally[PROPOSER_INDEX] = tally
+    if RELAY in dimensions:
+        tallies = count_by_relay(dataset.relay_columns, misses, window_froms)
+        for window_tally, tally in zip(window_tallies, tallies):
+            window_tally[RELAY] = tally
+    return window_tallies
+
+
+def count_by_fee_recipient(blocks, misses, window_froms):
+    num_fee_recipients = len(blocks.fee_recipients)
+    # misses may have a block index of -1 since a tx might have misses outside
+    # of the time range (only one of the misses needs to be in the time range
+    # for a tx to pass the filter)
+    valid = misses.block >= 0
+    miss_ids = blocks.fee_recipient[misses.block[valid]]
+    miss_counts = sum_in_windows(
+        misses.anchor_time[valid],
+        window_froms,
+        lambda i: count_ids(miss_ids, i, num_fee_recipients),
+        add_counts,
+    )
+    block_counts = sum_in_windows(
+        blocks.slot,
+        get_window_slots(window_froms),
+        lambda i: np.bincount(blocks.fee_recipient[i], minlength=num_fee_recipients),
+    )
+    return [
+        Tally(
+            misses=to_dict(blocks.fee_recipients, *window_miss_counts),
+            blocks=to_dict(blocks.fee_recipients, window_block_counts),
+            num_blocks=int(window_block_counts.sum()),
+        )
+        for window_miss_counts, window_block_counts in zip(miss_counts, block_counts)
+    ]
+
+
+def count_by_proposer_index(blocks, misses, window_froms):
+    valid = misses.block >= 0
+    miss_indices = blocks.proposer_index[misses.block[valid]]
+    miss_anchor_times = misses.anchor_time[valid]
+    miss_anchor_times = miss_anchor_times[miss_indices >= 0]
+    miss_indices = miss_indices[miss_indices >= 0]
+    proposed = ~blocks.missed
+    block_indices = blocks.proposer_index[proposed]
+    num_indices = max(
+        np.max(miss_indices, initial=-1) + 1, np.max(block_indices, initial=-1) + 1
+    )
+    miss_counts = sum_in_windows(
+        miss_anchor_times,
+        window_froms,
+        lambda i: count_ids(miss_indices, i, num_indices),
+        add_counts,
+    )
+    block_counts = sum_in_windows(
+        blocks.slot[proposed],
+        get_window_slots(window_froms),
+        lambda i: np.bincount(block_indices[i], minlength=num_indices),
+    )
+    return [
+        Tally(
+            misses=to_dict(None, *window_miss_counts),
+            blocks=to_dict(None, window_block_counts),
+            num_blocks=int(window_block_counts.sum()),
+        )
+        for window_miss_counts, window_block_counts in zip(miss_counts, block_counts)
+    ]
+
+
+def count_by_relay(relays, misses, window_froms):
+    num_relays = len(relays.relays)
+    with_relays = misses.relay_mask != 0
+    miss_masks = misses.relay_mask[with_relays]
+    miss_counts = sum_in_windows(
+        misses.anchor_time[with_relays],
+        window_froms,
+        lambda i: count_relays(miss_masks, i, num_relays),
+        add_counts,
+    )
+    window_slots = get_window_slots(window_froms)
+    block_counts = sum_in_windows(
+        relays.slot,
+        window_slots,
+        lambda i: sum_relay_shares(relays.mask[i], num_relays)[0],
+    )
+    num_slots = sum_in_windows(relays.slot, window_slots, len)
+    return [
+        Tally(
+            misses=to_dict(relays.relays, *window_miss_counts),
+            blocks=to_dict(relays.relays, window_block_counts),
+            num_blocks=window_num_slots,
+        )
+        for window_miss_counts, window_block_counts, window_num_slots in zip(
+            miss_counts, block_counts, num_slots
+        )
+    ]
+
+
+def get_window_slots(window_froms):
+    return [None if t is None else time_to_slot_ceil(t) for t in window_froms]
+
+
+# Returns for each start the sum of f over the elements whose time is at least
+# the start (or over all elements if the start is None). f is called with the
+# indices of a range of elements, in their original order, and the results of
+# adjacent ranges are combined with add.
+def sum_in_windows(times, starts, f, add=operator.add):
+    order = np.argsort(times, kind="stable")
+    sorted_times = times[order]
+    positions = [
+        0 if start is None else int(np.searchsorted(sorted_times, start))
+        for start in starts
+    ]
+    sums = [None for _ in starts]
+    total = None
+    end = len(times)
+    for i in sorted(range(len(starts)), key=lambda i: -positions[i]):
+        part = f(np.sort(order[positions[i] : end]))
+        total = part if total is None else add(total, part)
+        end = positions[i]
+        sums[i] = total
+    return sums
+
+
+# Returns the counts of the ids of the elements at the given indices and the
+# index of the first of them with each id, so that the misses of a window are
+# listed in the order in which they are seen in that window.
+def count_ids(ids, indices, num_ids):
+    counts = np.bincount(ids[indices], minlength=num_ids)
+    first_occurrences = get_first_occurrences(ids[indices], num_ids)
+    return counts, to_indices(first_occurrences, indices, len(ids))
+
+
+# Like count_ids, but for relay masks, splitting each evenly between its relays.
+def count_relays(masks, indices, num_relays):
+    shares, first_occurrences = sum_relay_shares(masks[indices], num_relays)
+    return shares, to_indices(first_occurrences, indices, len(masks))
+
+
+# Adds up the counts of two ranges of elements and keeps the earlier first
+# occurrences.
+def add_counts(a, b):
+    return a[0] + b[0], np.minimum(a[1], b[1])
+
+
+# Maps positions in the elements at the given indices to those indices. The
+# position past the last element, which stands for no occurrence, is mapped to
+# the number of all elements.
+def to_indices(positions, indices, num_elements):
+    return np.append(indices, num_elements)[positions]
+
+
+# Returns the position of the first occurrence of each id, or the number of ids
+# if it doesn't occur.
+def get_first_occurrences(ids, num_ids):
+    first_occurrences = np.full(num_ids, len(ids))
+    unique_ids, positions = np.unique(ids, return_index=True)
+    first_occurrences[unique_ids] = positions
+    return first_occurrences
+
+
+# Maps the keys to their counts, leaving out keys with a count of zero. If keys
+# is None, the keys are the indices of the counts. The dict is ordered by order
+# if given, so that misses are listed in the order in which they are seen.
+def to_dict(keys, counts, order=None):
+    nonzero = np.flatnonzero(counts)
+    if order is not None:
+        nonzero = nonzero[np.argsort(order[nonzero], kind="stable")]
+    if keys is None:
+        nonzero_keys = nonzero.tolist()
+    else:
+        nonzero_keys = [keys[i] for i in nonzero]
+    return dict(zip(nonzero_keys, counts[nonzero].tolist()))
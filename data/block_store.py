@@ -0,0 +1,313 @@
+import os
+import json
+import sqlite3
+import urllib.request
+
+
+GENESIS_TIME = 1606824023
+SECONDS_PER_SLOT = 12
+
+SQLITE_HEADER = b"SQLite format 3\x00"
+BLOCK_FIELDS = [
+    "slot",
+    "missed",
+    "block_number",
+    "block_hash",
+    "fee_recipient",
+    "proposer_index",
+]
+
+
+def time_to_slot_floor(t):
+    return (t - GENESIS_TIME) // SECONDS_PER_SLOT
+
+
+def time_to_slot_ceil(t):
+    return ((t - GENESIS_TIME) + SECONDS_PER_SLOT - 1) // SECONDS_PER_SLOT
+
+
+def slot_to_time(slot):
+    return GENESIS_TIME + slot * SECONDS_PER_SLOT
+
+
+# Slot-indexed store of blocks, backed by an SQLite database. Blocks are upserted
+# slot by slot, so extending or sliding the window only touches the slots that
+# have been added or expired. A store opened read-only expects the tables to
+# exist already.
+#
+# Each upsert bumps the version of the store and records it on the rows it
+# writes, so that readers keeping derived state can pick up the slots that
+# changed since they last looked, e.g. blocks replaced after a reorg.
+class BlockStore:
+    def __init__(self, connection, writable=True):
+        self.connection = connection
+        if not writable:
+            return
+        self.connection.execute(
+            """
+            CREATE TABLE IF NOT EXISTS blocks (
+                slot INTEGER PRIMARY KEY,
+                missed INTEGER NOT NULL,
+                block_number INTEGER,
+                block_hash TEXT,
+                fee_recipient TEXT,
+                proposer_index INTEGER,
+                version INTEGER NOT NULL DEFAULT 0
+            )
+            """
+        )
+        columns = [
+            row[1] for row in self.connection.execute("PRAGMA table_info(blocks)")
+        ]
+        if "version" not in columns:
+            # stores written by earlier versions
+            self.connection.execute(
+                "ALTER TABLE blocks ADD COLUMN version INTEGER NOT NULL DEFAULT 0"
+            )
+        self.connection.execute(
+            "CREATE INDEX IF NOT EXISTS blocks_by_version ON blocks (version)"
+        )
+        self.connection.execute(
+            """
+            CREATE TABLE IF NOT EXISTS meta (
+                key TEXT PRIMARY KEY,
+                value INTEGER
+            )
+            """
+        )
+        self.connection.commit()
+
+    def close(self):
+        self.connection.close()
+
+    def get_fetched_range(self):
+        rows = dict(self.connection.execute("SELECT key, value FROM meta"))
+        if "fetched_from" not in rows or "fetched_to" not in rows:
+            return None
+        return rows["fetched_from"], rows["fetched_to"]
+
+    def get_version(self):
+        row = self.connection.execute(
+            "SELECT value FROM meta WHERE key = 'version'"
+        ).fetchone()
+        return 0 if row is None else row[0]
+
+    def set_fetched_range(self, fetched_from, fetched_to):
+        self.connection.executemany(
+            "INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)",
+            [("fetched_from", fetched_from), ("fetched_to", fetched_to)],
+        )
+        self.connection.commit()
+
+    def get_slots(self, s0, s1):
+        rows = self.connection.execute(
+            "SELECT slot FROM blocks WHERE slot BETWEEN ? AND ?", (s0, s1)
+        )
+        return set(slot for (slot,) in rows)
+
+    def get_blocks(self, s0, s1):
+        rows = self.connection.execute(
+            f"SELECT {', '.join(BLOCK_FIELDS)} FROM blocks WHERE slot BETWEEN ? AND ? ORDER BY slot",
+            (s0, s1),
+        )
+        return [row_to_block(row) for row in rows]
+
+    # Returns the blocks in the slot range written after the given version.
+    def get_changed_blocks(self, version, s0, s1):
+        rows = self.connection.execute(
+            f"SELECT {', '.join(BLOCK_FIELDS)} FROM blocks WHERE version > ? AND slot BETWEEN ? AND ? ORDER BY slot",
+            (version, s0, s1),
+        )
+        return [row_to_block(row) for row in rows]
+
+    def count_slots(self, s0, s1):
+        (count,) = self.connection.execute(
+            "SELECT COUNT(*) FROM blocks WHERE slot BETWEEN ? AND ?", (s0, s1)
+        ).fetchone()
+        return count
+
+    def get_proposer_indices(self, s0, s1):
+        rows = self.connection.execute(
+            "SELECT DISTINCT proposer_index FROM blocks WHERE slot BETWEEN ? AND ? AND NOT missed",
+            (s0, s1),
+        )
+        return set(proposer_index for (proposer_index,) in rows)
+
+    def get_blocks_in_time_range(self, t0, t1):
+        return self.get_blocks(time_to_slot_ceil(t0), time_to_slot_floor(t1))
+
+    def upsert_blocks(self, blocks):
+        if len(blocks) == 0:
+            return
+        # the version is bumped in the same transaction as the rows are
+        # written, so concurrent writers such as stream_blocks.py and
+        # fetch_blocks.py never share a version
+        version = bump_version(self.connection)
+        self.connection.executemany(
+            f"INSERT OR REPLACE INTO blocks ({', '.join(BLOCK_FIELDS)}, version) VALUES ({', '.join('?' for _ in BLOCK_FIELDS)}, ?)",
+            [block_to_row(block) + (version,) for block in blocks],
+        )
+        self.connection.commit()
+
+    def delete_blocks_before(self, slot):
+        self.connection.execute("DELETE FROM blocks WHERE slot < ?", (slot,))
+        self.connection.commit()
+
+    def delete_blocks(self, s0, s1):
+        self.connection.execute(
+            "DELETE FROM blocks WHERE slot BETWEEN ? AND ?", (s0, s1)
+        )
+        self.connection.commit()
+
+    def get_last_slot(self):
+        (slot,) = self.connection.execute("SELECT MAX(slot) FROM blocks").fetchone()
+        return slot
+
+
+# Opens the block store at path. Only writers create the store or migrate a
+# blocks.json file written by earlier versions, readers open the database
+# read-only, so that reading never changes any files.
+def open_block_store(path, writable=False):
+    if is_legacy_json(path):
+        if not writable:
+            raise ValueError(
+                f"{path} is a blocks file of an earlier version, run fetch_blocks.py to migrate it"
+            )
+        migrate_legacy_json(path)
+    if writable:
+        return BlockStore(sqlite3.connect(path))
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"block store {path} does not exist")
+    return BlockStore(connect_read_only(path), writable=False)
+
+
+# Reads the blocks in the fetched range in the format of the former blocks.json
+# file, i.e., a dict with fetched_from, fetched_to and blocks. A blocks.json
+# file that hasn't been migrated yet is read as is.
+def read_blocks(path):
+    if is_legacy_json(path):
+        with open(path) as f:
+            return json.load(f)
+
+    store = open_block_store(path)
+    try:
+        fetched_range = store.get_fetched_range()
+        if fetched_range is None:
+            raise ValueError(f"block store {path} does not have a fetched range")
+        fetched_from, fetched_to = fetched_range
+        return {
+            "fetched_from": fetched_from,
+            "fetched_to": fetched_to,
+            "blocks": store.get_blocks_in_time_range(fetched_from, fetched_to),
+        }
+    finally:
+        store.close()
+
+
+# Reads the slots of the blocks in the fetched range as a dict with
+# fetched_from, fetched_to and slots.
+def read_slots(path):
+    if is_legacy_json(path):
+        with open(path) as f:
+            blocks = json.load(f)
+        return {
+            "fetched_from": blocks["fetched_from"],
+            "fetched_to": blocks["fetched_to"],
+            "slots": set(block["slot"] for block in blocks["blocks"]),
+        }
+
+    store = open_block_store(path)
+    try:
+        fetched_range = store.get_fetched_range()
+        if fetched_range is None:
+            raise ValueError(f"block store {path} does not have a fetched range")
+        fetched_from, fetched_to = fetched_range
+        return {
+            "fetched_from": fetched_from,
+            "fetched_to": fetched_to,
+            "slots": store.get_slots(
+                time_to_slot_ceil(fetched_from), time_to_slot_floor(fetched_to)
+            ),
+        }
+    finally:
+        store.close()
+
+
+# Reads the distinct proposers of the blocks in the fetched range.
+def read_proposer_indices(path):
+    if is_legacy_json(path):
+        with open(path) as f:
+            blocks = json.load(f)["blocks"]
+        return set(block["proposer_index"] for block in blocks if not block["missed"])
+
+    store = open_block_store(path)
+    try:
+        fetched_range = store.get_fetched_range()
+        if fetched_range is None:
+            return set()
+        fetched_from, fetched_to = fetched_range
+        return store.get_proposer_indices(
+            time_to_slot_ceil(fetched_from), time_to_slot_floor(fetched_to)
+        )
+    finally:
+        store.close()
+
+
+# Increments the version in the meta table of a store and returns it. Must be
+# called within the transaction that writes the versioned rows.
+def bump_version(connection):
+    connection.execute(
+        """
+        INSERT INTO meta (key, value) VALUES ('version', 1)
+        ON CONFLICT (key) DO UPDATE SET value = value + 1
+        """
+    )
+    (version,) = connection.execute(
+        "SELECT value FROM meta WHERE key = 'version'"
+    ).fetchone()
+    return version
+
+
+# Opens the SQLite database at path read-only.
+def connect_read_only(path):
+    uri = f"file:{urllib.request.pathname2url(os.path.abspath(path))}?mode=ro"
+    return sqlite3.connect(uri, uri=True)
+
+
+def is_legacy_json(path):
+    try:
+        with open(path, "rb") as f:
+            header = f.read(len(SQLITE_HEADER))
+    except FileNotFoundError:
+        return False
+    return len(header) > 0 and header != SQLITE_HEADER
+
+
+def migrate_legacy_json(path):
+    with open(path) as f:
+        legacy_blocks = json.load(f)
+    backup_path = path + ".bak"
+    os.replace(path, backup_path)
+    print(f"migrating blocks from {backup_path} to block store {path}")
+
+    store = BlockStore(sqlite3.connect(path))
+    try:
+        store.upsert_blocks(legacy_blocks["blocks"])
+        store.set_fetched_range(
+            legacy_blocks["fetched_from"], legacy_blocks["fetched_to"]
+        )
+    finally:
+        store.close()
+
+
+def block_to_row(block):
+    return tuple(
+        int(block[field]) if field == "missed" else block[field]
+        for field in BLOCK_FIELDS
+    )
+
+
+def row_to_block(row):
+    block = dict(zip(BLOCK_FIELDS, row))
+    block["missed"] = bool(block["missed"])
+    return block
@@ -0,0 +1,151 @@
+from dataclasses import dataclass
+
+import numpy as np
+
+
+# Relays are stored as bits of a 64 bit mask per slot.
+MAX_NUM_RELAYS = 64
+
+
+# Columnar form of the blocks. Fee recipients are interned, i.e. stored as ids
+# indexing into fee_recipients. The proposer index of missed blocks is -1.
+@dataclass
+class BlockColumns:
+    slot: np.ndarray
+    missed: np.ndarray
+    proposer_index: np.ndarray
+    fee_recipient: np.ndarray
+    fee_recipients: list
+
+
+# Columnar form of the relay data. Bit i of the mask of a slot is set if the
+# block in it was relayed by relays[i].
+@dataclass
+class RelayColumns:
+    slot: np.ndarray
+    mask: np.ndarray
+    relays: list
+
+
+# Columnar form of the misses of all txs. block is the index of the missing
+# block in the block columns or -1 if it's not known, and relay_mask is the
+# relay mask of its slot or 0 if there's no relay data for it. anchor_time is
+# the proposal time of the first miss of the tx, which decides if the tx is part
+# of a window.
+@dataclass
+class MissColumns:
+    slot: np.ndarray
+    anchor_time: np.ndarray
+    block: np.ndarray
+    relay_mask: np.ndarray
+
+
+class Interner:
+    def __init__(self):
+        self.values = []
+        self.ids = {}
+
+    def intern(self, value):
+        id = self.ids.get(value)
+        if id is None:
+            id = len(self.values)
+            self.ids[value] = id
+            self.values.append(value)
+        return id
+
+
+def get_block_columns(blocks):
+    fee_recipients = Interner()
+    return BlockColumns(
+        slot=np.fromiter((block["slot"] for block in blocks), np.int64, len(blocks)),
+        missed=np.fromiter((block["missed"] for block in blocks), bool, len(blocks)),
+        proposer_index=np.fromiter(
+            (
+                -1 if block["missed"] else int(block["proposer_index"])
+                for block in blocks
+            ),
+            np.int64,
+            len(blocks),
+        ),
+        fee_recipient=np.fromiter(
+            (fee_recipients.intern(block["fee_recipient"]) for block in blocks),
+            np.int64,
+            len(blocks),
+        ),
+        fee_recipients=fee_recipients.values,
+    )
+
+
+def get_relay_columns(relays_by_slot):
+    relays = Interner()
+    # relays are interned in the order of their names, which is the order in
+    # which the relays of a slot are stored, so that relays first seen in the
+    # same slot are listed in that order
+    for relay in sorted({relay for rs in relays_by_slot.values() for relay in rs}):
+        relays.intern(relay)
+    masks = []
+    for rs in relays_by_slot.values():
+        mask = 0
+        for relay in rs:
+            mask |= 1 << relays.intern(relay)
+        masks.append(mask)
+    if len(relays.values) > MAX_NUM_RELAYS:
+        raise ValueError(f"more than {MAX_NUM_RELAYS} relays")
+    return RelayColumns(
+        slot=np.fromiter(relays_by_slot.keys(), np.int64, len(relays_by_slot)),
+        mask=np.array(masks, dtype=np.uint64),
+        relays=relays.values,
+    )
+
+
+# Block and relay information of the misses is only looked up if the respective
+# mapping is given.
+def get_miss_columns(txs, block_index_by_hash=None, relay_mask_by_slot=None):
+    slots = []
+    anchor_times = []
+    block_indices = []
+    relay_masks = []
+    for tx in txs:
+        anchor_time = tx["misses"][0]["proposal_time"]
+        for miss in tx["misses"]:
+            slot = int(miss["slot"])
+            slots.append(slot)
+            anchor_times.append(anchor_time)
+            if block_index_by_hash is not None:
+                block_indices.append(block_index_by_hash.get(miss["block_hash"], -1))
+            if relay_mask_by_slot is not None:
+                relay_masks.append(relay_mask_by_slot.get(slot, 0))
+    num_misses = len(slots)
+    return MissColumns(
+        slot=np.array(slots, dtype=np.int64),
+        anchor_time=np.array(anchor_times, dtype=np.int64),
+        block=np.array(block_indices, dtype=np.int64)
+        if block_index_by_hash is not None
+        else np.full(num_misses, -1, dtype=np.int64),
+        relay_mask=np.array(relay_masks, dtype=np.uint64)
+        if relay_mask_by_slot is not None
+        else np.zeros(num_misses, dtype=np.uint64),
+    )
+
+
+# Returns for each relay the number of masks it's part of, with masks of n
+# relays counting 1/n for each of them, and the position of the first mask it's
+# part of.
+def sum_relay_shares(masks, num_relays):
+    if num_relays == 0:
+        return np.zeros(0), np.zeros(0, dtype=np.int64)
+    memberships = np.array(
+        [(masks >> np.uint64(i)) & np.uint64(1) == 1 for i in range(num_relays)]
+    )
+    num_members = memberships.sum(axis=0)
+    weights = np.divide(
+        1.0,
+        num_members,
+        out=np.zeros(len(masks)),
+        where=num_members > 0,
+    )
+    shares = np.array([weights[is_member].sum() for is_member in memberships])
+    first_occurrences = np.where(
+        memberships.any(axis=1), memberships.argmax(axis=1), len(masks)
+    )
+    return shares, first_occurrences
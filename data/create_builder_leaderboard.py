@@ -2,18 +2,23 @@ from dotenv import load_dotenv
 
 load_dotenv()
 
-from dataclasses import dataclass, fields
+from dataclasses import dataclass, fields, MISSING
 import os
 import json
 
+import aggregate
+from dataset import run_on_dataset
+from file_stats import write_json_atomically
+
 
 @dataclass
 class Config:
-    TXS_PATH: str
+    TXS_SEGMENTS_PATH: str
     BLOCKS_PATH: str
     BUILDERS_PATH: str
     BUILDER_LEADERBOARD_PATH: str
     MIN_BUILDER_MARKET_SHARE: float
+    LEADERBOARD_WINDOWS: str = ""
 
     @classmethod
     def load(cls):
@@ -21,47 +26,39 @@ class Config:
         for field in fields(cls):
             value = os.getenv(field.name)
             if value is None:
+                if field.default is not MISSING:
+                    continue
                 raise ValueError(f"environment variable {field.name} is not specified")
             values[field.name] = field.type(value)
         return cls(**values)
 
 
-def main():
+def main(dataset=None):
     config = Config.load()
-
-    txs = read_txs(config)
-    blocks = read_blocks(config)
-    builders = read_builders(config)
-
-    if (txs["fetched_from"], txs["fetched_to"]) != (
-        blocks["fetched_from"],
-        blocks["fetched_to"],
-    ):
-        raise ValueError("blocks and txs time range mismatch")
-
-    fetched_from = txs["fetched_from"]
-    fetched_to = txs["fetched_to"]
-    txs = txs["txs"]
-    blocks = blocks["blocks"]
-
-    misses_by_fee_recipient = count_misses_by_fee_recipient(txs, blocks)
-    misses_by_builder = aggregate_misses_by_builder(misses_by_fee_recipient, builders)
-    builder_market_shares = compute_builder_market_share(blocks, builders)
-
-    builder_leaderboard = create_builder_leaderboard(
-        config, misses_by_builder, builder_market_shares, fetched_from, fetched_to
+    run_on_dataset(
+        create_and_write_builder_leaderboard, config, [aggregate.FEE_RECIPIENT], dataset
     )
-    write_builder_leaderboard(config, builder_leaderboard)
 
 
-def read_txs(config):
-    with open(config.TXS_PATH) as f:
-        return json.load(f)
+def create_and_write_builder_leaderboard(config, dataset):
+    builders = read_builders(config)
 
+    for window in dataset.get_windows():
+        tally = window.tallies[aggregate.FEE_RECIPIENT]
 
-def read_blocks(config):
-    with open(config.BLOCKS_PATH) as f:
-        return json.load(f)
+        misses_by_builder = aggregate_misses_by_builder(tally.misses, builders)
+        builder_market_shares = compute_builder_market_share(tally, builders)
+
+        builder_leaderboard = create_builder_leaderboard(
+            config,
+            misses_by_builder,
+            builder_market_shares,
+            window.fetched_from,
+            window.fetched_to,
+        )
+        write_builder_leaderboard(
+            window.get_path(config.BUILDER_LEADERBOARD_PATH), builder_leaderboard
+        )
 
 
 def read_builders(config):
@@ -69,25 +66,6 @@ def read_builders(config):
         return json.load(f)
 
 
-def count_misses_by_fee_recipient(txs, blocks):
-    fee_recipient_by_block_hash = {
-        block["block_hash"]: block["fee_recipient"] for block in blocks
-    }
-
-    counts = {}
-    for tx in txs:
-        for block in tx["misses"]:
-            block_hash = block["block_hash"]
-            if block_hash not in fee_recipient_by_block_hash:
-                # this may happen since a tx might have misses outside of the
-                # time range (only one of the misses needs to be in the time
-                # range for a tx to pass the filter)
-                continue
-            fee_recipient = fee_recipient_by_block_hash[block["block_hash"]]
-            counts[fee_recipient] = counts.get(fee_recipient, 0) + 1
-    return counts
-
-
 def aggregate_misses_by_builder(misses_by_fee_recipient, builders):
     fee_recipient_to_builder = {}
     for builder in builders:
@@ -106,20 +84,19 @@ def aggregate_misses_by_builder(misses_by_fee_recipient, builders):
     return misses_by_builder
 
 
-def compute_builder_market_share(blocks, builders):
+def compute_builder_market_share(tally, builders):
     fee_recipient_to_builder = {}
     for builder in builders:
         for fee_recipient in builder["fee_recipients"]:
             fee_recipient_to_builder[fee_recipient.lower()] = builder["name"]
 
     blocks_by_builder = {}
-    for block in blocks:
-        fee_recipient = block["fee_recipient"]
+    for fee_recipient, num_blocks in tally.blocks.items():
         builder = fee_recipient_to_builder.get(fee_recipient, fee_recipient)
-        blocks_by_builder[builder] = blocks_by_builder.get(builder, 0) + 1
+        blocks_by_builder[builder] = blocks_by_builder.get(builder, 0) + num_blocks
 
     shares = {
-        builder: num_blocks / len(blocks)
+        builder: num_blocks / tally.num_blocks
         for builder, num_blocks in blocks_by_builder.items()
     }
     return shares
@@ -148,9 +125,8 @@ def create_builder_leaderboard(
     }
 
 
-def write_builder_leaderboard(config, leaderboard):
-    with open(config.BUILDER_LEADERBOARD_PATH, "w") as f:
-        json.dump(leaderboard, f)
+def write_builder_leaderboard(path, leaderboard):
+    write_json_atomically(path, leaderboard)
 
 
 if __name__ == "__main__":
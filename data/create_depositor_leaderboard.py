@@ -2,19 +2,24 @@ from dotenv import load_dotenv
 
 load_dotenv()
 
-from dataclasses import dataclass, fields
+from dataclasses import dataclass, fields, MISSING
 import os
 import json
 
+import aggregate
+from dataset import run_on_dataset
+from file_stats import write_json_atomically
+
 
 @dataclass
 class Config:
-    TXS_PATH: str
+    TXS_SEGMENTS_PATH: str
     BLOCKS_PATH: str
     VALIDATOR_PUBKEYS_PATH: str
     DEPOSITORS_PATH: str
     DEPOSITOR_LEADERBOARD_PATH: str
     MIN_DEPOSITOR_MARKET_SHARE: float
+    LEADERBOARD_WINDOWS: str = ""
 
     @classmethod
     def load(cls):
@@ -22,58 +27,47 @@ class Config:
         for field in fields(cls):
             value = os.getenv(field.name)
             if value is None:
+                if field.default is not MISSING:
+                    continue
                 raise ValueError(f"environment variable {field.name} is not specified")
             values[field.name] = field.type(value)
         return cls(**values)
 
 
-def main():
+def main(dataset=None):
     config = Config.load()
-
-    txs = read_txs(config)
-    blocks = read_blocks(config)
-    validator_pubkeys = read_validator_pubkeys(config)
-    depositors = read_depositors(config)
-
-    if (txs["fetched_from"], txs["fetched_to"]) != (
-        blocks["fetched_from"],
-        blocks["fetched_to"],
-    ):
-        raise ValueError("blocks and txs time range mismatch")
-
-    fetched_from = txs["fetched_from"]
-    fetched_to = txs["fetched_to"]
-    txs = txs["txs"]
-    blocks = blocks["blocks"]
-    validator_pubkeys = validator_pubkeys["pubkeys"]
-
-    misses_by_validator_index = count_misses_by_validator_index(txs, blocks)
-    misses_by_depositor = aggregate_misses_by_depositor(
-        misses_by_validator_index, validator_pubkeys, depositors
-    )
-
-    depositor_market_shares = compute_depositor_market_shares(
-        blocks, validator_pubkeys, depositors
+    run_on_dataset(
+        create_and_write_depositor_leaderboard,
+        config,
+        [aggregate.PROPOSER_INDEX],
+        dataset,
     )
-    depositor_leaderboard = create_depositor_leaderboard(
-        config, misses_by_depositor, depositor_market_shares, fetched_from, fetched_to
-    )
-    write_depositor_leaderboard(config, depositor_leaderboard)
-
-
-def read_txs(config):
-    with open(config.TXS_PATH) as f:
-        return json.load(f)
-
 
-def read_blocks(config):
-    with open(config.BLOCKS_PATH) as f:
-        return json.load(f)
 
-
-def read_validator_pubkeys(config):
-    with open(config.VALIDATOR_PUBKEYS_PATH) as f:
-        return json.load(f)
+def create_and_write_depositor_leaderboard(config, dataset):
+    depositors = read_depositors(config)
+    validator_pubkeys = dataset.validator_pubkeys
+
+    for window in dataset.get_windows():
+        tally = window.tallies[aggregate.PROPOSER_INDEX]
+
+        misses_by_depositor = aggregate_misses_by_depositor(
+            tally.misses, validator_pubkeys, depositors
+        )
+
+        depositor_market_shares = compute_depositor_market_shares(
+            tally, validator_pubkeys, depositors
+        )
+        depositor_leaderboard = create_depositor_leaderboard(
+            config,
+            misses_by_depositor,
+            depositor_market_shares,
+            window.fetched_from,
+            window.fetched_to,
+        )
+        write_depositor_leaderboard(
+            window.get_path(config.DEPOSITOR_LEADERBOARD_PATH), depositor_leaderboard
+        )
 
 
 def read_depositors(config):
@@ -81,65 +75,35 @@ def read_depositors(config):
         return json.load(f)
 
 
-def count_misses_by_validator_index(txs, blocks):
-    validator_index_by_block_hash = {
-        block["block_hash"]: block["proposer_index"] for block in blocks
-    }
-
-    counts = {}
-    for tx in txs:
-        for block in tx["misses"]:
-            block_hash = block["block_hash"]
-            if block_hash not in validator_index_by_block_hash:
-                # this may happen since a tx might have misses outside of the
-                # time range (only one of the misses needs to be in the time
-                # range for a tx to pass the filter)
-                continue
-            validator_index = validator_index_by_block_hash[block["block_hash"]]
-            counts[validator_index] = counts.get(validator_index, 0) + 1
-    return counts
-
-
 def aggregate_misses_by_depositor(
     misses_by_validator_index, validator_pubkeys, depositors
 ):
-    validator_index_to_depositor = {}
-    for index, pubkey in validator_pubkeys.items():
-        if pubkey in depositors:
-            validator_index_to_depositor[int(index)] = depositors[pubkey]
-
     misses_by_depositor = {}
     for validator_index, count in misses_by_validator_index.items():
-        try:
-            depositor = validator_index_to_depositor[validator_index]
-        except KeyError:
-            pass
-        else:
-            misses_by_depositor[depositor] = (
-                misses_by_depositor.get(depositor, 0) + count
-            )
+        pubkey = validator_pubkeys.get(validator_index)
+        if pubkey not in depositors:
+            continue
+        depositor = depositors[pubkey]
+        misses_by_depositor[depositor] = misses_by_depositor.get(depositor, 0) + count
 
     return misses_by_depositor
 
 
-def compute_depositor_market_shares(blocks, validator_pubkeys, depositors):
+def compute_depositor_market_shares(tally, validator_pubkeys, depositors):
     blocks_by_depositor = {}
-    num_missed = 0
-    for block in blocks:
-        if block["missed"]:
-            num_missed += 1
-            continue
-        proposer_index = int(block["proposer_index"])
-        if str(proposer_index) not in validator_pubkeys:
+    for proposer_index, num_blocks in tally.blocks.items():
+        proposer_pubkey = validator_pubkeys.get(proposer_index)
+        if proposer_pubkey is None:
             continue
-        proposer_pubkey = validator_pubkeys[str(proposer_index)]
         if proposer_pubkey not in depositors:
             continue
         depositor = depositors[proposer_pubkey]
-        blocks_by_depositor[depositor] = blocks_by_depositor.get(depositor, 0) + 1
+        blocks_by_depositor[depositor] = (
+            blocks_by_depositor.get(depositor, 0) + num_blocks
+        )
 
     shares = {
-        depositor: num_blocks / (len(blocks) - num_missed)
+        depositor: num_blocks / tally.num_blocks
         for depositor, num_blocks in blocks_by_depositor.items()
     }
     return shares
@@ -168,9 +132,8 @@ def create_depositor_leaderboard(
     }
 
 
-def write_depositor_leaderboard(config, leaderboard):
-    with open(config.DEPOSITOR_LEADERBOARD_PATH, "w") as f:
-        json.dump(leaderboard, f)
+def write_depositor_leaderboard(path, leaderboard):
+    write_json_atomically(path, leaderboard)
 
 
 if __name__ == "__main__":
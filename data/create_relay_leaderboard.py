@@ -2,17 +2,21 @@ from dotenv import load_dotenv
 
 load_dotenv()
 
-from dataclasses import dataclass, fields
+from dataclasses import dataclass, fields, MISSING
 import os
-import json
+
+import aggregate
+from dataset import run_on_dataset
+from file_stats import write_json_atomically
 
 
 @dataclass
 class Config:
-    TXS_PATH: str
+    TXS_SEGMENTS_PATH: str
     RELAYS_PATH: str
     RELAY_LEADERBOARD_PATH: str
     MIN_RELAY_MARKET_SHARE: float
+    LEADERBOARD_WINDOWS: str = ""
 
     @classmethod
     def load(cls):
@@ -20,66 +24,39 @@ class Config:
         for field in fields(cls):
             value = os.getenv(field.name)
             if value is None:
+                if field.default is not MISSING:
+                    continue
                 raise ValueError(f"environment variable {field.name} is not specified")
             values[field.name] = field.type(value)
         return cls(**values)
 
 
-def main():
+def main(dataset=None):
     config = Config.load()
-
-    txs = read_txs(config)
-    relays = read_relays(config)
-
-    if (txs["fetched_from"], txs["fetched_to"]) != (
-        relays["fetched_from"],
-        relays["fetched_to"],
-    ):
-        raise ValueError("txs and relays time range mismatch")
-
-    fetched_from = txs["fetched_from"]
-    fetched_to = txs["fetched_to"]
-    txs = txs["txs"]
-    relays = relays["relays"]
-
-    misses_by_relay = count_misses_by_relay(txs, relays)
-    relay_market_shares = compute_relay_market_shares(relays)
-
-    relay_leaderboard = create_relay_leaderboard(
-        config, misses_by_relay, relay_market_shares, fetched_from, fetched_to
+    run_on_dataset(
+        create_and_write_relay_leaderboard, config, [aggregate.RELAY], dataset
     )
-    write_relay_leaderboard(config, relay_leaderboard)
-
-
-def read_txs(config):
-    with open(config.TXS_PATH) as f:
-        return json.load(f)
-
 
-def read_relays(config):
-    with open(config.RELAYS_PATH) as f:
-        return json.load(f)
 
+def create_and_write_relay_leaderboard(config, dataset):
+    for window in dataset.get_windows():
+        tally = window.tallies[aggregate.RELAY]
+        relay_market_shares = compute_relay_market_shares(tally)
 
-def count_misses_by_relay(txs, relays):
-    counts = {}
-    for tx in txs:
-        for block in tx["misses"]:
-            try:
-                rs = relays[str(block["slot"])]
-                for relay in rs:
-                    counts[relay] = counts.get(relay, 0) + 1 / len(rs)
-            except KeyError:
-                pass
-    return counts
+        relay_leaderboard = create_relay_leaderboard(
+            config,
+            tally.misses,
+            relay_market_shares,
+            window.fetched_from,
+            window.fetched_to,
+        )
+        write_relay_leaderboard(
+            window.get_path(config.RELAY_LEADERBOARD_PATH), relay_leaderboard
+        )
 
 
-def compute_relay_market_shares(relays):
-    counts = {}
-    for _, rs in relays.items():
-        for relay in rs:
-            counts[relay] = counts.get(relay, 0) + 1 / len(rs)
-    return {relay: count / len(relays) for relay, count in counts.items()}
+def compute_relay_market_shares(tally):
+    return {relay: count / tally.num_blocks for relay, count in tally.blocks.items()}
 
 
 def create_relay_leaderboard(
@@ -105,9 +82,8 @@ def create_relay_leaderboard(
     }
 
 
-def write_relay_leaderboard(config, leaderboard):
-    with open(config.RELAY_LEADERBOARD_PATH, "w") as f:
-        json.dump(leaderboard, f)
+def write_relay_leaderboard(path, leaderboard):
+    write_json_atomically(path, leaderboard)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,104 @@
+from dotenv import load_dotenv
+
+load_dotenv()
+
+from dataclasses import dataclass, fields, MISSING
+import os
+import time
+
+import dataset
+import fetch_all
+import stream_blocks
+from block_store import GENESIS_TIME, SECONDS_PER_SLOT
+from scheduler import run_stages
+
+
+SLOTS_PER_EPOCH = 32
+TICK_DURATIONS = {
+    "slot": SECONDS_PER_SLOT,
+    "epoch": SLOTS_PER_EPOCH * SECONDS_PER_SLOT,
+}
+
+
+@dataclass
+class Config:
+    # the consensus node whose head decides whether a tick has anything to do
+    CONSENSUS_API_URL: str
+    # "slot" runs the pipeline once per slot, "epoch" once per epoch
+    DAEMON_TICK: str = "slot"
+    # seconds after the start of the slot or epoch at which the pipeline runs,
+    # so that the block of the slot has been propagated
+    DAEMON_TICK_OFFSET: int = 4
+    STAGE_STATE_PATH: str = ""
+
+    @classmethod
+    def load(cls):
+        values = {}
+        for field in fields(cls):
+            value = os.getenv(field.name)
+            if value is None:
+                if field.default is not MISSING:
+                    continue
+                raise ValueError(f"environment variable {field.name} is not specified")
+            values[field.name] = field.type(value)
+        return cls(**values)
+
+
+# Runs the same stages as fetch_all.py once per slot or epoch, in a single
+# process that is kept running. The fetch scripts only fetch what's new since
+# the last run anyway, and the dataset shared by the leaderboards is kept in
+# memory between runs, so only inputs whose files have changed are loaded
+# again. Combined with LEADERBOARD_STATE_PATH, a run only accounts for the new
+# and changed slots and misses, without it every run reloads the txs, blocks
+# and relays. A failed run is reported and retried in the next tick.
+def main():
+    config = Config.load()
+    tick_duration = TICK_DURATIONS.get(config.DAEMON_TICK)
+    if tick_duration is None:
+        raise ValueError(f"unknown daemon tick {config.DAEMON_TICK}")
+
+    dataset_config = dataset.Config.load()
+    if not dataset_config.LEADERBOARD_STATE_PATH:
+        print(
+            "warning: LEADERBOARD_STATE_PATH is not set, so each run reloads all txs, blocks and relays of the window"
+        )
+    shared_dataset = dataset.Dataset(
+        dataset_config,
+        windows=dataset.parse_windows(dataset_config.LEADERBOARD_WINDOWS),
+        state_path=dataset_config.LEADERBOARD_STATE_PATH or None,
+    )
+    stages = fetch_all.get_stages(dataset_config, shared_dataset)
+    with shared_dataset:
+        last_head_slot = None
+        while True:
+            wait_for_next_tick(tick_duration, config.DAEMON_TICK_OFFSET)
+            last_head_slot = run_tick(config, stages, last_head_slot)
+
+
+# Runs the stages unless the head is still at the slot of the last successful
+# run, which happens when the proposer of the slot missed it. Returns the head
+# slot of the last successful run.
+def run_tick(config, stages, last_head_slot):
+    t0 = time.time()
+    try:
+        head_slot = stream_blocks.fetch_head_slot(config)
+        if head_slot == last_head_slot:
+            print(f"head is still at slot {head_slot}, skipping run")
+            return last_head_slot
+        run_stages(stages, config.STAGE_STATE_PATH or None)
+    except Exception as e:
+        print(f"run failed: {e}")
+        return last_head_slot
+    print(f"run done in {time.time() - t0:.1f}s")
+    return head_slot
+
+
+def wait_for_next_tick(tick_duration, offset):
+    now = time.time()
+    t = now - GENESIS_TIME - offset
+    next_tick = GENESIS_TIME + offset + (t // tick_duration + 1) * tick_duration
+    time.sleep(next_tick - now)
+
+
+if __name__ == "__main__":
+    main()
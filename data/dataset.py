@@ -0,0 +1,330 @@
+from dotenv import load_dotenv
+
+load_dotenv()
+
+from dataclasses import dataclass, fields, MISSING
+from functools import cached_property
+import os
+import json
+import threading
+
+import aggregate
+import block_store
+import columns
+import leaderboard_state
+import relay_store
+from file_stats import stat_path
+from pubkey_table import open_pubkey_table
+from tx_store import TxStore
+
+
+@dataclass
+class Config:
+    TXS_SEGMENTS_PATH: str
+    BLOCKS_PATH: str
+    RELAYS_PATH: str
+    VALIDATOR_PUBKEYS_PATH: str
+    LIDO_OPERATOR_PUBKEYS_PATH: str
+    LEADERBOARD_STATE_PATH: str = ""
+    LEADERBOARD_WINDOWS: str = ""
+
+    @classmethod
+    def load(cls):
+        values = {}
+        for field in fields(cls):
+            value = os.getenv(field.name)
+            if value is None:
+                if field.default is not MISSING:
+                    continue
+                raise ValueError(f"environment variable {field.name} is not specified")
+            values[field.name] = field.type(value)
+        return cls(**values)
+
+
+# cached_property that computes the value only once even if the dataset is
+# accessed from several threads at once, as when fetch_all creates the
+# leaderboards concurrently. Once computed, the value is read from the instance
+# dict without locking.
+class locked_cached_property(cached_property):
+    def __get__(self, instance, owner=None):
+        if instance is None:
+            return self
+        with instance.lock:
+            return super().__get__(instance, owner)
+
+
+# The cached properties that depend on each input file, directly or indirectly.
+DEPENDENT_PROPERTIES = {
+    "TXS_SEGMENTS_PATH": ["tx_segments_meta", "txs", "miss_columns", "window_tallies"],
+    "BLOCKS_PATH": [
+        "blocks",
+        "block_by_hash",
+        "block_columns",
+        "miss_columns",
+        "window_tallies",
+    ],
+    "RELAYS_PATH": [
+        "relays",
+        "relays_by_slot",
+        "relay_columns",
+        "miss_columns",
+        "window_tallies",
+    ],
+    "VALIDATOR_PUBKEYS_PATH": ["validator_pubkeys"],
+    "LIDO_OPERATOR_PUBKEYS_PATH": ["operator_pubkeys"],
+}
+
+
+# The inputs shared by the leaderboard scripts. Each input is loaded on first
+# access only and then kept, so that running several leaderboards against the
+# same dataset reads and parses every file once. The config can be the config
+# of any script, only the paths of the inputs that are accessed are needed.
+# Misses are aggregated once for all given dimensions (see aggregate.py), based
+# on a columnar form of the inputs (see columns.py). If a state path is given,
+# the counts are instead maintained incrementally in the state at that path
+# (see leaderboard_state.py), which reads the txs and blocks from their stores
+# itself.
+#
+# Besides the whole fetched range, counts are computed for each of the given
+# windows, which are (label, duration) pairs of shorter ranges ending at the end
+# of the fetched range.
+#
+# A dataset can be kept across runs (see daemon.py). refresh drops the inputs
+# whose files have changed since they were loaded, so that they are loaded
+# again on next access, and keeps the others.
+class Dataset:
+    def __init__(
+        self,
+        config,
+        dimensions=aggregate.DIMENSIONS,
+        windows=(),
+        state_path=None,
+    ):
+        self.config = config
+        self.dimensions = dimensions
+        self.windows = windows
+        self.state_path = state_path
+        self.lock = threading.RLock()
+        # the size and modification time of each loaded input file when it was
+        # loaded
+        self.input_stats = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        if "validator_pubkeys" in self.__dict__:
+            self.validator_pubkeys.close()
+
+    # Returns the path of the input file of the given config field and records
+    # its current size and modification time. Files are written atomically, so
+    # if it changes while it's loaded, the change is detected by refresh.
+    def get_input_path(self, name):
+        path = getattr(self.config, name)
+        self.input_stats[name] = stat_path(path)
+        return path
+
+    # Drops all cached properties that depend on input files that have changed
+    # and returns the names of the changed inputs.
+    def refresh(self):
+        with self.lock:
+            changed = [
+                name
+                for name, stats in self.input_stats.items()
+                if stat_path(getattr(self.config, name)) != stats
+            ]
+            for name in changed:
+                del self.input_stats[name]
+                # a dropped pubkey table isn't closed since a leaderboard that
+                # is still running might use it. It's closed once it isn't
+                # referenced anymore.
+                for property in DEPENDENT_PROPERTIES[name]:
+                    self.__dict__.pop(property, None)
+            return changed
+
+    # The txs in the fetched range, read from the segments they are stored in.
+    @locked_cached_property
+    def txs(self):
+        store = TxStore(self.get_input_path("TXS_SEGMENTS_PATH"), writable=False)
+        return {
+            "fetched_from": self.fetched_from,
+            "fetched_to": self.fetched_to,
+            "txs": store.read_txs(self.fetched_from),
+        }
+
+    @locked_cached_property
+    def blocks(self):
+        blocks = block_store.read_blocks(self.get_input_path("BLOCKS_PATH"))
+        if self.get_fetched_range(blocks) != self.fetched_range:
+            raise ValueError("blocks and txs time range mismatch")
+        return blocks
+
+    @locked_cached_property
+    def relays(self):
+        relays = relay_store.read_relays(self.get_input_path("RELAYS_PATH"))
+        if self.get_fetched_range(relays) != self.fetched_range:
+            raise ValueError("txs and relays time range mismatch")
+        return relays
+
+    @locked_cached_property
+    def validator_pubkeys(self):
+        return open_pubkey_table(self.get_input_path("VALIDATOR_PUBKEYS_PATH"))
+
+    @locked_cached_property
+    def operator_pubkeys(self):
+        with open(self.get_input_path("LIDO_OPERATOR_PUBKEYS_PATH")) as f:
+            return json.load(f)
+
+    @locked_cached_property
+    def tx_segments_meta(self):
+        path = self.get_input_path("TXS_SEGMENTS_PATH")
+        meta = TxStore(path, writable=False).read_meta()
+        if meta is None:
+            raise ValueError(f"no txs in {self.config.TXS_SEGMENTS_PATH}")
+        return meta
+
+    @property
+    def fetched_range(self):
+        return self.get_fetched_range(self.tx_segments_meta)
+
+    @property
+    def fetched_from(self):
+        return self.fetched_range[0]
+
+    @property
+    def fetched_to(self):
+        return self.fetched_range[1]
+
+    @staticmethod
+    def get_fetched_range(data):
+        return (data["fetched_from"], data["fetched_to"])
+
+    @locked_cached_property
+    def block_by_hash(self):
+        return {block["block_hash"]: block for block in self.blocks["blocks"]}
+
+    @locked_cached_property
+    def relays_by_slot(self):
+        return {int(slot): rs for slot, rs in self.relays["relays"].items()}
+
+    @locked_cached_property
+    def block_columns(self):
+        return columns.get_block_columns(self.blocks["blocks"])
+
+    @locked_cached_property
+    def relay_columns(self):
+        return columns.get_relay_columns(self.relays_by_slot)
+
+    @locked_cached_property
+    def miss_columns(self):
+        block_index_by_hash = None
+        relay_mask_by_slot = None
+        if any(dimension != aggregate.RELAY for dimension in self.dimensions):
+            block_index_by_hash = {
+                block["block_hash"]: i for i, block in enumerate(self.blocks["blocks"])
+            }
+        if aggregate.RELAY in self.dimensions:
+            relay_mask_by_slot = dict(
+                zip(self.relay_columns.slot.tolist(), self.relay_columns.mask.tolist())
+            )
+        return columns.get_miss_columns(
+            self.txs["txs"], block_index_by_hash, relay_mask_by_slot
+        )
+
+    @property
+    def tallies(self):
+        return self.window_tallies[0]
+
+    # The tallies of the whole fetched range followed by those of the windows.
+    @locked_cached_property
+    def window_tallies(self):
+        window_froms = self.get_window_froms()
+        if self.state_path is not None:
+            # the state reads the block and relay stores itself, and only the
+            # slots that changed since its last update
+            self.get_input_path("BLOCKS_PATH")
+            self.get_input_path("RELAYS_PATH")
+            return leaderboard_state.update_tallies(
+                self.state_path, self.config, self.fetched_range, window_froms
+            )
+        return aggregate.aggregate_windows(self, self.dimensions, [None] + window_froms)
+
+    def get_window_froms(self):
+        window_froms = []
+        for label, duration in self.windows:
+            window_from = self.fetched_to - duration
+            if window_from < self.fetched_from:
+                raise ValueError(f"window {label} is longer than the fetched range")
+            window_froms.append(window_from)
+        return window_froms
+
+    # Returns the whole fetched range as a window without label, followed by the
+    # configured windows.
+    def get_windows(self):
+        labels = [None] + [label for label, _ in self.windows]
+        window_froms = [self.fetched_from] + self.get_window_froms()
+        return [
+            Window(label, window_from, self.fetched_to, tallies)
+            for label, window_from, tallies in zip(
+                labels, window_froms, self.window_tallies
+            )
+        ]
+
+
+# Runs create(config, dataset) to create the leaderboards of all windows of the
+# given dataset, e.g. the one fetch_all shares between the leaderboard scripts.
+# If there is none, a dataset is loaded from the paths in the config, with the
+# configured windows and only the given dimensions.
+def run_on_dataset(create, config, dimensions, dataset=None):
+    if dataset is not None:
+        return create(config, dataset)
+    windows = parse_windows(config.LEADERBOARD_WINDOWS)
+    with Dataset(config, dimensions, windows) as dataset:
+        return create(config, dataset)
+
+
+@dataclass
+class Window:
+    label: str
+    fetched_from: int
+    fetched_to: int
+    tallies: dict
+
+    # Returns the output path for this window, i.e., the given path with the
+    # label inserted before the extension.
+    def get_path(self, path):
+        return get_window_path(path, self.label)
+
+
+def get_window_path(path, label):
+    if label is None:
+        return path
+    root, ext = os.path.splitext(path)
+    return f"{root}.{label}{ext}"
+
+
+DURATION_UNITS = {
+    "s": 1,
+    "m": 60,
+    "h": 60 * 60,
+    "d": 24 * 60 * 60,
+    "w": 7 * 24 * 60 * 60,
+}
+
+
+# Parses a comma separated list of durations such as "1d,7d,30d" into (label,
+# duration in seconds) pairs.
+def parse_windows(text):
+    windows = []
+    for label in text.split(","):
+        label = label.strip()
+        if label == "":
+            continue
+        unit = DURATION_UNITS.get(label[-1])
+        if unit is None or not label[:-1].isdigit():
+            raise ValueError(f"invalid window {label}")
+        windows.append((label, int(label[:-1]) * unit))
+    return windows
@@ -0,0 +1,88 @@
+import http_client
+
+
+class JsonRpcError(ValueError):
+    def __init__(self, method, params, error):
+        super().__init__(f"{method} request with params {params} failed: {error}")
+        self.method = method
+        self.params = params
+        self.error = error
+
+
+# Minimal JSON-RPC client for execution nodes. Multiple calls can be sent in a
+# single batch request to save round trips.
+class ExecutionClient:
+    def __init__(self, url):
+        self.url = url
+
+    def call(self, method, params, cache=False):
+        result = self.batch([(method, params)], cache)[0]
+        if isinstance(result, JsonRpcError):
+            raise result
+        return result
+
+    # Sends a list of (method, params) calls in one request and returns their
+    # results in the same order. Failed calls are returned as JsonRpcError
+    # instead of raising, so that the caller can handle them individually.
+    #
+    # If cache is set, the response is cached (see http_client.py) unless a call
+    # failed or returned null, e.g. for a block that doesn't exist yet. It must
+    # only be set if the results are final.
+    def batch(self, calls, cache=False):
+        if len(calls) == 0:
+            return []
+        payload = [
+            {
+                "jsonrpc": "2.0",
+                "method": method,
+                "params": params,
+                "id": i,
+            }
+            for i, (method, params) in enumerate(calls)
+        ]
+        res = http_client.post(
+            self.url,
+            json=payload if len(payload) > 1 else payload[0],
+            cache=cache and (lambda res: is_complete_response(res, len(calls))),
+        )
+        res.raise_for_status()
+        data = res.json()
+
+        if isinstance(data, dict):
+            if len(payload) > 1 or "id" not in data:
+                # the node responds with a single error if it rejects the batch
+                # as a whole
+                error = data.get("error", data)
+                return [JsonRpcError(method, params, error) for method, params in calls]
+            data = [data]
+
+        # responses to batches may come in any order
+        responses_by_id = {response.get("id"): response for response in data}
+        results = []
+        for i, (method, params) in enumerate(calls):
+            response = responses_by_id.get(i)
+            if response is None:
+                results.append(JsonRpcError(method, params, "no response"))
+            elif "error" in response:
+                results.append(JsonRpcError(method, params, response["error"]))
+            else:
+                results.append(response["result"])
+        return results
+
+
+# Returns whether the response has a result for each call.
+def is_complete_response(res, num_calls):
+    if res.status_code != 200:
+        return False
+    try:
+        data = res.json()
+    except ValueError:
+        return False
+    if isinstance(data, dict):
+        data = [data]
+    return len(data) == num_calls and all(
+        isinstance(response, dict)
+        and "error" not in response
+        and response.get("result") is not None
+        for response in data
+    )
@@ -1,3 +1,10 @@
+from dotenv import load_dotenv
+
+load_dotenv()
+
+from dataclasses import dataclass, fields, asdict, MISSING
+import os
+
 import fetch_txs
 import fetch_blocks
 import fetch_relays
@@ -7,29 +14,178 @@ import create_depositor_leaderboard
 import create_builder_leaderboard
 import create_relay_leaderboard
 import create_lido_leaderboard
+import dataset
+from scheduler import Stage, run_stages
+
+
+@dataclass
+class Config:
+    # if set, stages whose inputs haven't changed since their last successful
+    # run are skipped (see scheduler.py)
+    STAGE_STATE_PATH: str = ""
+
+    @classmethod
+    def load(cls):
+        values = {}
+        for field in fields(cls):
+            value = os.getenv(field.name)
+            if value is None:
+                if field.default is not MISSING:
+                    continue
+                raise ValueError(f"environment variable {field.name} is not specified")
+            values[field.name] = field.type(value)
+        return cls(**values)
 
 
 def main():
-    print("fetching txs...")
-    fetch_txs.main()
-    print("fetching blocks...")
-    fetch_blocks.main()
-    print("fetching relays...")
-    fetch_relays.main()
-    print("fetching validator pubkeys...")
-    fetch_validator_pubkeys.main()
-    print("fetching lido...")
-    fetch_lido.main()
-    print("creating depositor leaderboard...")
-    create_depositor_leaderboard.main()
-    print("creating builder leaderboard...")
-    create_builder_leaderboard.main()
-    print("creating relay leaderboard...")
-    create_relay_leaderboard.main()
-    print("creating lido leaderboard...")
-    create_lido_leaderboard.main()
+    config = Config.load()
+    # the leaderboards share one dataset, so that each input is read only once
+    dataset_config = dataset.Config.load()
+    shared_dataset = dataset.Dataset(
+        dataset_config,
+        windows=dataset.parse_windows(dataset_config.LEADERBOARD_WINDOWS),
+        state_path=dataset_config.LEADERBOARD_STATE_PATH or None,
+    )
+    with shared_dataset:
+        run_stages(
+            get_stages(dataset_config, shared_dataset),
+            config.STAGE_STATE_PATH or None,
+        )
     print("done.")
 
 
+# Returns the stages of the pipeline. Their dependencies follow from their
+# inputs and outputs: validator pubkeys and Lido are fetched concurrently with
+# txs, blocks and relays, and the leaderboards are created concurrently once
+# their inputs exist.
+def get_stages(dataset_config, shared_dataset):
+    txs_config = fetch_txs.Config.load()
+    blocks_config = fetch_blocks.Config.load()
+    relays_config = fetch_relays.Config.load()
+    validator_pubkeys_config = fetch_validator_pubkeys.Config.load()
+    lido_config = fetch_lido.Config.load()
+    depositor_config = create_depositor_leaderboard.Config.load()
+    builder_config = create_builder_leaderboard.Config.load()
+    relay_config = create_relay_leaderboard.Config.load()
+    operator_config = create_lido_leaderboard.Config.load()
+
+    validator_pubkeys_inputs = []
+    if validator_pubkeys_config.VALIDATOR_PUBKEYS_MODE == "proposers":
+        validator_pubkeys_inputs.append(validator_pubkeys_config.BLOCKS_PATH)
+    # the shared dataset counts misses for all leaderboards at once, so each of
+    # them depends on all of its inputs
+    dataset_inputs = [
+        dataset_config.TXS_SEGMENTS_PATH,
+        dataset_config.BLOCKS_PATH,
+        dataset_config.RELAYS_PATH,
+    ]
+    windows = dataset.parse_windows(dataset_config.LEADERBOARD_WINDOWS)
+
+    return [
+        Stage(
+            name="fetch_txs",
+            run=fetch_txs.main,
+            outputs=[txs_config.TXS_SEGMENTS_PATH],
+            params=asdict(txs_config),
+            external=True,
+        ),
+        Stage(
+            name="fetch_blocks",
+            run=fetch_blocks.main,
+            inputs=[blocks_config.TXS_SEGMENTS_PATH],
+            outputs=[blocks_config.BLOCKS_PATH],
+            params=asdict(blocks_config),
+            # blocks come from the beacon node, so they may change even if the txs
+            # haven't
+            external=True,
+        ),
+        Stage(
+            name="fetch_relays",
+            run=fetch_relays.main,
+            inputs=[relays_config.BLOCKS_PATH, relays_config.RELAY_APIS_PATH],
+            outputs=[relays_config.RELAYS_PATH],
+            params=asdict(relays_config),
+            # slots relays haven't confirmed yet are retried
+            external=True,
+        ),
+        Stage(
+            name="fetch_validator_pubkeys",
+            run=fetch_validator_pubkeys.main,
+            inputs=validator_pubkeys_inputs,
+            outputs=[validator_pubkeys_config.VALIDATOR_PUBKEYS_PATH],
+            params=asdict(validator_pubkeys_config),
+            external=True,
+        ),
+        Stage(
+            name="fetch_lido",
+            run=fetch_lido.main,
+            outputs=[
+                lido_config.LIDO_OPERATOR_PUBKEYS_PATH,
+                lido_config.LIDO_SIGNING_KEY_LOG_PATH,
+            ],
+            params=asdict(lido_config),
+            external=True,
+        ),
+        Stage(
+            name="create_depositor_leaderboard",
+            run=create_leaderboard(create_depositor_leaderboard, shared_dataset),
+            inputs=dataset_inputs
+            + [
+                depositor_config.VALIDATOR_PUBKEYS_PATH,
+                depositor_config.DEPOSITORS_PATH,
+            ],
+            outputs=get_leaderboard_paths(
+                depositor_config.DEPOSITOR_LEADERBOARD_PATH, windows
+            ),
+            params=asdict(depositor_config),
+        ),
+        Stage(
+            name="create_builder_leaderboard",
+            run=create_leaderboard(create_builder_leaderboard, shared_dataset),
+            inputs=dataset_inputs + [builder_config.BUILDERS_PATH],
+            outputs=get_leaderboard_paths(
+                builder_config.BUILDER_LEADERBOARD_PATH, windows
+            ),
+            params=asdict(builder_config),
+        ),
+        Stage(
+            name="create_relay_leaderboard",
+            run=create_leaderboard(create_relay_leaderboard, shared_dataset),
+            inputs=dataset_inputs,
+            outputs=get_leaderboard_paths(relay_config.RELAY_LEADERBOARD_PATH, windows),
+            params=asdict(relay_config),
+        ),
+        Stage(
+            name="create_lido_leaderboard",
+            run=create_leaderboard(create_lido_leaderboard, shared_dataset),
+            inputs=dataset_inputs
+            + [
+                operator_config.VALIDATOR_PUBKEYS_PATH,
+                operator_config.LIDO_OPERATOR_PUBKEYS_PATH,
+                operator_config.LIDO_OPERATOR_NAMES_PATH,
+            ],
+            outputs=get_leaderboard_paths(
+                operator_config.LIDO_LEADERBOARD_PATH, windows
+            ),
+            params=asdict(operator_config),
+        ),
+    ]
+
+
+# Returns a function creating a leaderboard from the shared dataset. Inputs that
+# have changed since the dataset loaded them are dropped first, which only
+# happens if the dataset is kept between runs (see daemon.py).
+def create_leaderboard(module, shared_dataset):
+    def run():
+        shared_dataset.refresh()
+        module.main(shared_dataset)
+
+    return run
+
+
+def get_leaderboard_paths(path, windows):
+    return [path] + [dataset.get_window_path(path, label) for label, _ in windows]
+
+
 if __name__ == "__main__":
     main()
@@ -2,21 +2,37 @@ from dotenv import load_dotenv
 
 load_dotenv()
 
-from dataclasses import dataclass, fields
+from dataclasses import dataclass, fields, MISSING
+from concurrent.futures import ThreadPoolExecutor
 import os
-import json
 import urllib.parse
-import requests
 
+import http_client
+from block_store import open_block_store, time_to_slot_floor, time_to_slot_ceil
+from execution_client import ExecutionClient
+from slot_ranges import SlotRanges
+from tx_store import TxStore
 
-GENESIS_TIME = 1606824023
+
+NUM_BLOCKS_PER_COMMIT = 1000
+SLOTS_PER_EPOCH = 32
+NUM_EXECUTION_BLOCKS_PER_BATCH = 100
+FINALIZED_HEADER_PATH = "/eth/v1/beacon/headers/finalized"
 
 
 @dataclass
 class Config:
-    TXS_PATH: str
+    TXS_SEGMENTS_PATH: str
     BLOCKS_PATH: str
     CONSENSUS_API_URL: str
+    NUM_BLOCK_FETCH_WORKERS: int = 1
+    NUM_BLOCK_FETCH_RETRIES: int = 3
+    # "full" fetches full blocks as JSON, "blinded" blinded blocks as JSON,
+    # "ssz" blinded blocks as SSZ, and "duties" the proposers of each epoch
+    # from the consensus node and the blocks from the execution node at
+    # EXECUTION_API_URL
+    BLOCK_FETCH_MODE: str = "full"
+    EXECUTION_API_URL: str = ""
 
     @classmethod
     def load(cls):
@@ -24,6 +40,8 @@ class Config:
         for field in fields(cls):
             value = os.getenv(field.name)
             if value is None:
+                if field.default is not MISSING:
+                    continue
                 raise ValueError(f"environment variable {field.name} is not specified")
             values[field.name] = field.type(value)
         return cls(**values)
@@ -32,123 +50,343 @@ class Config:
 def main():
     config = Config.load()
 
-    txs = read_txs(config)
-    last_blocks = read_blocks(config)
-
-    if txs is None:
-        delete_blocks(config)
+    meta = read_txs_meta(config)
+    if meta is None:
         return
 
-    t0 = txs["fetched_from"]
-    t1 = txs["fetched_to"]
-    blocks = fetch_blocks(config, t0, t1, last_blocks)
-    write_blocks(
-        config,
-        {
-            "fetched_from": t0,
-            "fetched_to": t1,
-            "blocks": blocks,
-        },
-    )
-
-
-def read_txs(config):
+    t0 = meta["fetched_from"]
+    t1 = meta["fetched_to"]
+    store = open_block_store(config.BLOCKS_PATH, writable=True)
     try:
-        with open(config.TXS_PATH) as f:
-            return json.load(f)
-    except IOError:
-        return None
-
+        fetch_blocks(config, store, t0, t1)
+        store.set_fetched_range(t0, t1)
+    finally:
+        store.close()
 
-def read_blocks(config):
-    try:
-        with open(config.BLOCKS_PATH) as f:
-            return json.load(f)
-    except IOError:
-        return None
 
+# Returns the meta of the tx segments, which has the fetched range, without
+# reading the txs themselves.
+def read_txs_meta(config):
+    return TxStore(config.TXS_SEGMENTS_PATH, writable=False).read_meta()
 
-def delete_blocks(config):
-    try:
-        os.remove(config.BLOCKS_PATH)
-    except FileNotFoundError:
-        pass
 
-
-def write_blocks(config, blocks):
-    with open(config.BLOCKS_PATH, "w") as f:
-        json.dump(blocks, f)
-
-
-def fetch_blocks(config, t0, t1, last_blocks):
+def fetch_blocks(config, store, t0, t1):
     s0 = time_to_slot_ceil(t0)
     s1 = time_to_slot_floor(t1)
 
-    if last_blocks is not None:
-        last_blocks_by_slot = {block["slot"]: block for block in last_blocks["blocks"]}
-    else:
-        last_blocks_by_slot = {}
-
-    slots = list(range(s0, s1 + 1))
-    blocks_by_slot = {}
-    uncached_slots = []
-    for slot in slots:
-        if slot in last_blocks_by_slot:
-            blocks_by_slot[slot] = last_blocks_by_slot[slot]
-        else:
-            uncached_slots.append(slot)
+    # blocks in the store are never fetched again, blocks before the window are
+    # expired
+    store.delete_blocks_before(s0)
+    cached_slots = store.get_slots(s0, s1)
+    uncached_slots = [slot for slot in range(s0, s1 + 1) if slot not in cached_slots]
 
     print(
-        f"looking for blocks for between {s0} and {s1}, {len(blocks_by_slot)} cached, {len(uncached_slots)} to fetch"
+        f"looking for blocks for between {s0} and {s1}, {len(cached_slots)} cached, {len(uncached_slots)} to fetch"
     )
-    for i, slot in enumerate(uncached_slots):
-        print(f"fetching block for slot {slot} ({i / len(uncached_slots) * 100:.1f}%)")
-        res = fetch_block_by_slot(config, slot)
-        if res is not None:
-            msg = res["data"]["message"]
-            exec = msg["body"]["execution_payload"]
-            block = {
-                "slot": slot,
-                "missed": False,
-                "block_number": int(exec["block_number"]),
-                "block_hash": exec["block_hash"],
-                "fee_recipient": exec["fee_recipient"],
-                "proposer_index": int(msg["proposer_index"]),
-            }
-        else:
-            block = {
-                "slot": slot,
-                "missed": True,
-                "block_number": None,
-                "block_hash": None,
-                "fee_recipient": None,
-                "proposer_index": None,
-            }
-        blocks_by_slot[slot] = block
+    if config.BLOCK_FETCH_MODE == "duties":
+        fetch_slots_from_duties(config, store, uncached_slots)
+    else:
+        fetch_slots(config, store, uncached_slots)
     print("done")
 
-    blocks = sorted(blocks_by_slot.values(), key=lambda b: b["slot"])
-    return blocks
+
+# Fetches the blocks of the given slots and upserts them into the store.
+def fetch_slots(config, store, slots):
+    # the blocks of finalized slots never change, so their responses are cached
+    finalized_slot = -1
+    if http_client.is_caching() and len(slots) > 0:
+        finalized_slot = fetch_finalized_slot(config)
+    # results are yielded in slot order, so the output is the same as when
+    # fetching one slot after another
+    executor = ThreadPoolExecutor(max_workers=config.NUM_BLOCK_FETCH_WORKERS)
+    try:
+        results = executor.map(
+            lambda slot: fetch_block_by_slot(
+                config, slot, cache=slot <= finalized_slot
+            ),
+            slots,
+        )
+        new_blocks = []
+        for i, (slot, block) in enumerate(zip(slots, results)):
+            print(f"fetched block for slot {slot} ({(i + 1) / len(slots) * 100:.1f}%)")
+            new_blocks.append(block)
+            if len(new_blocks) >= NUM_BLOCKS_PER_COMMIT:
+                store.upsert_blocks(new_blocks)
+                new_blocks = []
+        store.upsert_blocks(new_blocks)
+    finally:
+        executor.shutdown(cancel_futures=True)
+
+
+def fetch_block_by_slot(config, slot, cache=False):
+    return fetch_block(config, slot, slot, cache)
+
+
+# Fetches the block with the given id, i.e., a slot or a block root, that is
+# expected to be at the given slot. If cache is set, the block is cached, which
+# is only correct if the slot is finalized. 404s aren't cached even then: a node
+# that pruned the block returns them as well, so missed slots are asked again.
+#
+# Proposer duties only pay off for ranges of slots, so single blocks are
+# fetched as blinded blocks in the duties mode.
+def fetch_block(config, slot, block_id, cache=False):
+    if config.BLOCK_FETCH_MODE == "full":
+        path = f"/eth/v2/beacon/blocks/{block_id}"
+        headers = {}
+    elif config.BLOCK_FETCH_MODE in ("blinded", "duties"):
+        path = f"/eth/v1/beacon/blinded_blocks/{block_id}"
+        headers = {}
+    elif config.BLOCK_FETCH_MODE == "ssz":
+        path = f"/eth/v1/beacon/blinded_blocks/{block_id}"
+        headers = {"Accept": "application/octet-stream"}
+    else:
+        raise ValueError(f"unknown block fetch mode {config.BLOCK_FETCH_MODE}")
+
+    url = urllib.parse.urljoin(config.CONSENSUS_API_URL, path)
+    res = http_client.get(
+        url,
+        headers=headers,
+        num_retries=config.NUM_BLOCK_FETCH_RETRIES,
+        cache=cache,
+    )
+    if res.status_code == 404:
+        return missed_block(slot)
+    res.raise_for_status()
+    if config.BLOCK_FETCH_MODE == "ssz":
+        return parse_ssz_block(slot, res.content)
+    else:
+        return parse_json_block(slot, res.json())
 
 
-def time_to_slot_floor(t):
-    return (t - GENESIS_TIME) // 12
+def fetch_finalized_slot(config):
+    url = urllib.parse.urljoin(config.CONSENSUS_API_URL, FINALIZED_HEADER_PATH)
+    res = http_client.get(url)
+    res.raise_for_status()
+    return int(res.json()["data"]["header"]["message"]["slot"])
 
 
-def time_to_slot_ceil(t):
-    return ((t - GENESIS_TIME) + 12 - 1) // 12
+def missed_block(slot):
+    return {
+        "slot": slot,
+        "missed": True,
+        "block_number": None,
+        "block_hash": None,
+        "fee_recipient": None,
+        "proposer_index": None,
+    }
 
 
-def fetch_block_by_slot(config, slot):
+def parse_json_block(slot, data):
+    msg = data["data"]["message"]
+    body = msg["body"]
+    if "execution_payload" in body:
+        exec = body["execution_payload"]
+    else:
+        exec = body["execution_payload_header"]
+    return {
+        "slot": slot,
+        "missed": False,
+        "block_number": int(exec["block_number"]),
+        "block_hash": exec["block_hash"],
+        "fee_recipient": exec["fee_recipient"],
+        "proposer_index": int(msg["proposer_index"]),
+    }
+
+
+# Byte offsets into the SSZ encoding of a signed (blinded) beacon block. Only
+# the fixed-size parts leading up to the fields we need are relied upon. They
+# are the same for all forks since Bellatrix, for full and blinded blocks alike.
+SSZ_OFFSET_SIZE = 4
+SSZ_BLOCK_SLOT = 0
+SSZ_BLOCK_PROPOSER_INDEX = 8
+SSZ_BLOCK_BODY = 80
+SSZ_BODY_EXECUTION_PAYLOAD = 380
+SSZ_PAYLOAD_FEE_RECIPIENT = 32
+SSZ_PAYLOAD_BLOCK_NUMBER = 404
+SSZ_PAYLOAD_BLOCK_HASH = 472
+
+
+def parse_ssz_block(slot, data):
+    msg = read_ssz_offset(data, 0)
+    body = msg + read_ssz_offset(data, msg + SSZ_BLOCK_BODY)
+    exec = body + read_ssz_offset(data, body + SSZ_BODY_EXECUTION_PAYLOAD)
+
+    block_slot = read_ssz_uint64(data, msg + SSZ_BLOCK_SLOT)
+    if block_slot != slot:
+        raise ValueError(f"requested block at slot {slot}, got {block_slot}")
+    return {
+        "slot": slot,
+        "missed": False,
+        "block_number": read_ssz_uint64(data, exec + SSZ_PAYLOAD_BLOCK_NUMBER),
+        "block_hash": read_ssz_bytes(data, exec + SSZ_PAYLOAD_BLOCK_HASH, 32),
+        "fee_recipient": read_ssz_bytes(data, exec + SSZ_PAYLOAD_FEE_RECIPIENT, 20),
+        "proposer_index": read_ssz_uint64(data, msg + SSZ_BLOCK_PROPOSER_INDEX),
+    }
+
+
+def read_ssz_offset(data, position):
+    return int.from_bytes(read_ssz(data, position, SSZ_OFFSET_SIZE), "little")
+
+
+def read_ssz_uint64(data, position):
+    return int.from_bytes(read_ssz(data, position, 8), "little")
+
+
+def read_ssz_bytes(data, position, length):
+    return "0x" + read_ssz(data, position, length).hex()
+
+
+def read_ssz(data, position, length):
+    if position + length > len(data):
+        raise ValueError("unexpected end of SSZ data")
+    return data[position : position + length]
+
+
+# Fetches the blocks of the given slots without downloading beacon blocks. The
+# proposer of each slot comes from the proposer duties of its epoch, and the
+# execution block of each slot is found by its timestamp. Since every beacon
+# block since the merge has exactly one execution block at the time of its
+# slot, slots without an execution block are missed.
+#
+# Duties of finalized epochs and finalized execution blocks never change, so
+# their responses are cached.
+def fetch_slots_from_duties(config, store, slots):
+    client = ExecutionClient(config.EXECUTION_API_URL)
+    head = client.call("eth_getBlockByNumber", ["latest", False])
+    head_number = int(head["number"], 16)
+    head_slot = get_execution_block_slot(head)
+    finalized_number = -1
+    finalized_slot = -1
+    if http_client.is_caching() and len(slots) > 0:
+        finalized = client.call("eth_getBlockByNumber", ["finalized", False])
+        finalized_number = int(finalized["number"], 16)
+        finalized_slot = get_execution_block_slot(finalized)
+    slot_ranges = SlotRanges.from_slots(slots)
+    if slot_ranges and slot_ranges.max() > head_slot:
+        raise ValueError(
+            f"execution node is at slot {head_slot}, fetching blocks up to {slot_ranges.max()}"
+        )
+
+    epochs = sorted(set(slot // SLOTS_PER_EPOCH for slot in slots))
+    proposer_indices = {}
+    with ThreadPoolExecutor(max_workers=config.NUM_BLOCK_FETCH_WORKERS) as executor:
+        for duties in executor.map(
+            lambda epoch: fetch_proposer_duties(
+                config, epoch, cache=epoch * SLOTS_PER_EPOCH <= finalized_slot
+            ),
+            epochs,
+        ):
+            proposer_indices.update(duties)
+
+    # the last execution block fetched, which bounds the search for the first
+    # block of the next range
+    previous_block = None
+    for first, last in slot_ranges.to_list():
+        block_number = find_execution_block_number(
+            client, first, head_number, head_slot, previous_block, finalized_number
+        )
+        # there are at most as many blocks in the range as there are slots
+        max_num_blocks = last - first + 1
+        execution_blocks = {}
+        while block_number <= head_number and max_num_blocks > 0:
+            num_blocks = min(
+                max_num_blocks,
+                NUM_EXECUTION_BLOCKS_PER_BATCH,
+                head_number - block_number + 1,
+            )
+            batch = get_execution_blocks(
+                client, range(block_number, block_number + num_blocks), finalized_number
+            )
+            for block in batch:
+                execution_blocks[get_execution_block_slot(block)] = block
+            previous_block = batch[-1]
+            block_number += num_blocks
+            max_num_blocks = last - get_execution_block_slot(batch[-1])
+
+        new_blocks = []
+        for slot in range(first, last + 1):
+            block = execution_blocks.get(slot)
+            if block is None:
+                new_blocks.append(missed_block(slot))
+                continue
+            new_blocks.append(
+                {
+                    "slot": slot,
+                    "missed": False,
+                    "block_number": int(block["number"], 16),
+                    "block_hash": block["hash"],
+                    "fee_recipient": block["miner"],
+                    "proposer_index": proposer_indices[slot],
+                }
+            )
+        store.upsert_blocks(new_blocks)
+        print(f"fetched blocks for slots {first} to {last}")
+
+
+# Returns the proposer index of each slot of the epoch.
+def fetch_proposer_duties(config, epoch, cache=False):
     url = urllib.parse.urljoin(
-        config.CONSENSUS_API_URL, f"/eth/v2/beacon/blocks/{slot}"
+        config.CONSENSUS_API_URL, f"/eth/v1/validator/duties/proposer/{epoch}"
     )
-    res = requests.get(url)
-    if res.status_code == 404:
-        return None
-    else:
-        res.raise_for_status()
-        return res.json()
+    res = http_client.get(url, num_retries=config.NUM_BLOCK_FETCH_RETRIES, cache=cache)
+    res.raise_for_status()
+    duties = res.json()["data"]
+    return {int(duty["slot"]): int(duty["validator_index"]) for duty in duties}
+
+
+# Returns the number of the first execution block at or after the slot. There
+# is at most one block per slot, so the number of blocks between two blocks is
+# at most the number of slots between them. Counting back from the head gives a
+# lower bound, and counting forward from a block before the slot an upper
+# bound. The block is searched for between them, and once few enough blocks
+# are left, they are fetched in a single batch.
+def find_execution_block_number(
+    client, slot, head_number, head_slot, previous_block, finalized_number=-1
+):
+    low = max(head_number - (head_slot - slot), 0)
+    if previous_block is None:
+        previous_block = get_execution_blocks(client, [low], finalized_number)[0]
+        if get_execution_block_slot(previous_block) >= slot:
+            return low
+    previous_number = int(previous_block["number"], 16)
+    low = max(low, previous_number + 1)
+    high = min(
+        previous_number + slot - get_execution_block_slot(previous_block),
+        head_number,
+    )
+    while high - low + 1 > NUM_EXECUTION_BLOCKS_PER_BATCH:
+        middle = (low + high) // 2
+        block = get_execution_blocks(client, [middle], finalized_number)[0]
+        if get_execution_block_slot(block) >= slot:
+            high = middle
+        else:
+            low = middle + 1
+    for block in get_execution_blocks(client, range(low, high), finalized_number):
+        if get_execution_block_slot(block) >= slot:
+            return int(block["number"], 16)
+    return high
+
+
+# Returns the execution blocks with the given numbers. Responses are cached if
+# all of them are at most finalized_number.
+def get_execution_blocks(client, block_numbers, finalized_number=-1):
+    results = client.batch(
+        [
+            ("eth_getBlockByNumber", [f"0x{block_number:x}", False])
+            for block_number in block_numbers
+        ],
+        cache=all(block_number <= finalized_number for block_number in block_numbers),
+    )
+    for result in results:
+        if isinstance(result, Exception):
+            raise result
+        if result is None:
+            raise ValueError("execution block not found")
+    return results
+
+
+def get_execution_block_slot(block):
+    return time_to_slot_floor(int(block["timestamp"], 16))
 
 
 if __name__ == "__main__":
@@ -7,10 +7,15 @@ import json
 import itertools
 from datetime import datetime, timezone, timedelta
 import urllib.parse
-import requests
-from dataclasses import dataclass, fields
+from dataclasses import dataclass, fields, MISSING
+from concurrent.futures import ThreadPoolExecutor
 import time
 
+import http_client
+from execution_client import ExecutionClient, JsonRpcError
+from file_stats import write_json_atomically
+from signing_key_log import SigningKeyLog
+
 
 NODE_OPERATOR_REGISTRY_ADDRESS = "0x55032650b14df07b85bf18a3a3ec8e0af2e028d5"
 SIGNING_KEY_ADDED_TOPIC = (
@@ -18,13 +23,34 @@ SIGNING_KEY_ADDED_TOPIC = (
 )
 NODE_OPERATORS_REGISTRY_DEPLOY_BLOCK = 11473216
 REORG_DELAY = 10
+NUM_BLOCKS_PER_CHECKPOINT = 100000
+NUM_CHECKPOINTS_PER_VERIFICATION = 16
+# ranges are widened while they return fewer logs than this
+NUM_LOGS_PER_SPARSE_RANGE = 1000
+# eth_getLogs errors of nodes that limit the block range or the number of
+# results of a request, identified by the EIP-1474 "limit exceeded" code or by
+# their message, e.g. "block range too large" or "query returned more than 10000
+# results"
+LOGS_LIMIT_ERROR_CODES = {-32005}
+LOGS_LIMIT_ERROR_MESSAGES = [
+    "range",
+    "more than",
+    "too many",
+    "too large",
+    "limit",
+    "exceed",
+    "size",
+]
 
 
 @dataclass
 class Config:
     LIDO_OPERATOR_PUBKEYS_PATH: str
+    LIDO_SIGNING_KEY_LOG_PATH: str
     EXECUTION_API_URL: str
     NUM_BLOCKS_PER_LOGS_REQUEST: int
+    NUM_LOGS_REQUEST_WORKERS: int = 1
+    NUM_LOGS_REQUESTS_PER_BATCH: int = 1
 
     @classmethod
     def load(cls):
@@ -32,6 +58,8 @@ class Config:
         for field in fields(cls):
             value = os.getenv(field.name)
             if value is None:
+                if field.default is not MISSING:
+                    continue
                 raise ValueError(f"environment variable {field.name} is not specified")
             values[field.name] = field.type(value)
         return cls(**values)
@@ -39,17 +67,38 @@ class Config:
 
 def main():
     config = Config.load()
-    old_node_operators = read_node_operators(config)
-    fetch_range = get_fetch_range(config, old_node_operators)
-    new_node_operators = fetch_node_operators(config, fetch_range)
-    all_node_operators = merge_node_operators(old_node_operators, new_node_operators)
-    write_node_operators(
-        config,
-        {
-            "operator_pubkeys": all_node_operators,
-            "fetched_until_block": fetch_range[1],
-        },
-    )
+    client = ExecutionClient(config.EXECUTION_API_URL)
+    log = SigningKeyLog(config.LIDO_SIGNING_KEY_LOG_PATH)
+    node_operators = read_node_operators(config)
+    if log.get_last_checkpoint() is None and node_operators is not None:
+        # operator pubkeys written by earlier versions may be incomplete, so the
+        # event log is built from scratch once
+        print("no signing key log found, fetching all signing keys again")
+        node_operators = None
+
+    from_block = roll_back_to_canonical_checkpoint(client, log)
+    if node_operators is None or node_operators["fetched_until_block"] != from_block:
+        node_operators = build_node_operators(log)
+
+    fetch_range = get_fetch_range(client, from_block)
+    # the checkpoints are taken before the logs are fetched and checked against
+    # them afterwards, so the log never pairs events with hashes of another fork
+    checkpoints = get_checkpoints(client, fetch_range)
+    finalized_block = get_finalized_block(client) if http_client.is_caching() else -1
+    logs = fetch_signing_key_added_logs(config, fetch_range, finalized_block)
+    events = [parse_event(log) for log in logs]
+    check_events_are_canonical(client, events, checkpoints)
+    log.append(events, checkpoints)
+    # the checkpoint at the end of the previous run is superseded by the new one
+    log.compact(is_boundary_checkpoint)
+
+    node_operators = {
+        "operator_pubkeys": add_events_to_operator_pubkeys(
+            node_operators["operator_pubkeys"], events
+        ),
+        "fetched_until_block": fetch_range[1],
+    }
+    write_node_operators(config, node_operators)
 
 
 def read_node_operators(config):
@@ -61,43 +110,154 @@ def read_node_operators(config):
 
 
 def write_node_operators(config, node_operators):
-    with open(config.LIDO_OPERATOR_PUBKEYS_PATH, "w") as f:
-        json.dump(node_operators, f)
+    write_json_atomically(config.LIDO_OPERATOR_PUBKEYS_PATH, node_operators)
 
 
-def get_fetch_range(config, old_node_operators):
-    if old_node_operators is None:
-        from_block = NODE_OPERATORS_REGISTRY_DEPLOY_BLOCK
-    else:
-        from_block = old_node_operators["fetched_until_block"]
-    to_block = get_current_block(config) + 1 - REORG_DELAY
-    return (from_block, max(to_block, from_block))
+# Checks the most recent checkpoints of the log against the chain and rolls the
+# log back to the latest one that is still canonical. Returns the block from
+# which on logs have to be fetched.
+def roll_back_to_canonical_checkpoint(client, log):
+    checkpoints = list(reversed(log.checkpoints))
+    for i in range(0, len(checkpoints), NUM_CHECKPOINTS_PER_VERIFICATION):
+        batch = checkpoints[i : i + NUM_CHECKPOINTS_PER_VERIFICATION]
+        block_hashes = get_block_hashes(
+            client, [checkpoint["block_number"] - 1 for checkpoint in batch]
+        )
+        for checkpoint, block_hash in zip(batch, block_hashes):
+            if checkpoint["block_hash"] == block_hash:
+                if checkpoint is not log.get_last_checkpoint():
+                    print(
+                        f"signing key log is not canonical after block {checkpoint['block_number']}, rolling back"
+                    )
+                    log.rollback(checkpoint)
+                return checkpoint["block_number"]
+    if len(checkpoints) > 0:
+        print("no canonical checkpoint in signing key log, rolling back everything")
+        log.rollback(None)
+    return NODE_OPERATORS_REGISTRY_DEPLOY_BLOCK
+
+
+def build_node_operators(log):
+    checkpoint = log.get_last_checkpoint()
+    if checkpoint is None:
+        return {
+            "operator_pubkeys": {},
+            "fetched_until_block": NODE_OPERATORS_REGISTRY_DEPLOY_BLOCK,
+        }
+    print("rebuilding operator pubkeys from signing key log")
+    return {
+        "operator_pubkeys": add_events_to_operator_pubkeys({}, log.read_events()),
+        "fetched_until_block": checkpoint["block_number"],
+    }
 
 
-def get_current_block(config):
-    params = {
-        "jsonrpc": "2.0",
-        "method": "eth_blockNumber",
-        "params": [],
-        "id": 1,
+def add_events_to_operator_pubkeys(operator_pubkeys, events):
+    operator_pubkeys = {
+        operator_id: set(pubkeys) for operator_id, pubkeys in operator_pubkeys.items()
     }
-    res = requests.post(config.EXECUTION_API_URL, json=params)
-    res.raise_for_status()
-    data = res.json()
-    return int(data["result"], 16)
-
-
-def fetch_node_operators(config, fetch_range):
-    logs = fetch_signing_key_added_logs(config, fetch_range)
-    operator_ids_to_pubkeys = {}
-    for log in logs:
-        operator_id, pubkey = parse_log(log)
-        if operator_id not in operator_ids_to_pubkeys:
-            operator_ids_to_pubkeys[operator_id] = set()
-        operator_ids_to_pubkeys[operator_id].add(pubkey)
+    for event in events:
+        operator_id = str(event["operator_id"])
+        if operator_id not in operator_pubkeys:
+            operator_pubkeys[operator_id] = set()
+        operator_pubkeys[operator_id].add(event["pubkey"])
     return {
         operator_id: sorted(pubkeys)
-        for operator_id, pubkeys in operator_ids_to_pubkeys.items()
+        for operator_id, pubkeys in operator_pubkeys.items()
+    }
+
+
+def get_fetch_range(client, from_block):
+    to_block = get_current_block(client) + 1 - REORG_DELAY
+    return (from_block, max(to_block, from_block))
+
+
+def get_current_block(client):
+    return int(client.call("eth_blockNumber", []), 16)
+
+
+def get_finalized_block(client):
+    block = client.call("eth_getBlockByNumber", ["finalized", False])
+    return int(block["number"], 16)
+
+
+# Returns a checkpoint at the end of the fetch range and at every multiple of
+# NUM_BLOCKS_PER_CHECKPOINT in it. Only the latter are kept once the log has
+# grown past them, so the number of checkpoints is bounded by the number of
+# blocks instead of the number of runs.
+def get_checkpoints(client, fetch_range):
+    if fetch_range[0] == fetch_range[1]:
+        return []
+    first = fetch_range[0] - fetch_range[0] % NUM_BLOCKS_PER_CHECKPOINT
+    block_numbers = [
+        block_number
+        for block_number in range(
+            first + NUM_BLOCKS_PER_CHECKPOINT, fetch_range[1], NUM_BLOCKS_PER_CHECKPOINT
+        )
+    ] + [fetch_range[1]]
+    block_hashes = []
+    for i in range(0, len(block_numbers), NUM_CHECKPOINTS_PER_VERIFICATION):
+        batch = block_numbers[i : i + NUM_CHECKPOINTS_PER_VERIFICATION]
+        block_hashes += get_block_hashes(
+            client, [block_number - 1 for block_number in batch]
+        )
+    return [
+        {"block_number": block_number, "block_hash": block_hash}
+        for block_number, block_hash in zip(block_numbers, block_hashes)
+    ]
+
+
+# Raises if an event is from another block than a checkpoint at the same height,
+# or if the last checkpoint is no longer canonical, i.e. the chain reorganized
+# below the end of the fetch range while the logs were fetched. Nothing is
+# written then, and the next run starts from the last canonical checkpoint.
+def check_events_are_canonical(client, events, checkpoints):
+    if len(checkpoints) == 0:
+        return
+    block_hashes = {
+        checkpoint["block_number"] - 1: checkpoint["block_hash"]
+        for checkpoint in checkpoints
+    }
+    for event in events:
+        block_hash = block_hashes.get(event["block_number"], event["block_hash"])
+        if event["block_hash"] != block_hash:
+            raise ValueError(
+                f"signing key log in block {event['block_number']} is not on the checkpointed chain"
+            )
+    last_checkpoint = checkpoints[-1]
+    [block_hash] = get_block_hashes(client, [last_checkpoint["block_number"] - 1])
+    if block_hash != last_checkpoint["block_hash"]:
+        raise ValueError(
+            f"chain reorganized below block {last_checkpoint['block_number']} while fetching signing key logs"
+        )
+
+
+def is_boundary_checkpoint(checkpoint):
+    return checkpoint["block_number"] % NUM_BLOCKS_PER_CHECKPOINT == 0
+
+
+def get_block_hashes(client, block_numbers):
+    results = client.batch(
+        [
+            ("eth_getBlockByNumber", [f"0x{block_number:x}", False])
+            for block_number in block_numbers
+        ]
+    )
+    block_hashes = []
+    for result in results:
+        if isinstance(result, Exception):
+            raise result
+        block_hashes.append(result["hash"] if result is not None else None)
+    return block_hashes
+
+
+def parse_event(log):
+    operator_id, pubkey = parse_log(log)
+    return {
+        "block_number": int(log["blockNumber"], 16),
+        "log_index": int(log["logIndex"], 16),
+        "block_hash": log["blockHash"],
+        "operator_id": operator_id,
+        "pubkey": pubkey,
     }
 
 
@@ -124,48 +284,126 @@ def parse_pubkey(pubkey):
     return pubkey_hex
 
 
-def fetch_signing_key_added_logs(config, fetch_range):
+# Fetches logs in the half-open block range fetch_range. The range is split into
+# chunks of adaptive size: NUM_BLOCKS_PER_LOGS_REQUEST is only the initial size,
+# chunks the node rejects for their size are bisected and chunks in sparse
+# stretches are widened. Any other error is raised right away. Up to
+# NUM_LOGS_REQUEST_WORKERS batch requests of NUM_LOGS_REQUESTS_PER_BATCH chunks
+# each are in flight at a time.
+#
+# Responses for chunks up to finalized_block are cached. Chunks that are only
+# REORG_DELAY blocks old aren't, since the log is fetched again after a reorg.
+def fetch_signing_key_added_logs(config, fetch_range, finalized_block=-1):
+    client = ExecutionClient(config.EXECUTION_API_URL)
     num_blocks = fetch_range[1] - fetch_range[0]
     print(
         f"fetching signing key logs in {num_blocks} blocks from {fetch_range[0]} to {fetch_range[1]}..."
     )
-    logs = []
-    for from_block in range(
-        fetch_range[0], fetch_range[1], config.NUM_BLOCKS_PER_LOGS_REQUEST
-    ):
-        to_block = min(
-            from_block + config.NUM_BLOCKS_PER_LOGS_REQUEST, fetch_range[1] - 1
-        )
-        params = {
-            "jsonrpc": "2.0",
-            "method": "eth_getLogs",
-            "params": [
+    logs_by_range = {}
+    num_fetched_blocks = 0
+    next_block = fetch_range[0]
+    chunk_size = config.NUM_BLOCKS_PER_LOGS_REQUEST
+    max_chunk_size = num_blocks
+    split_ranges = []
+    num_ranges_per_round = (
+        config.NUM_LOGS_REQUEST_WORKERS * config.NUM_LOGS_REQUESTS_PER_BATCH
+    )
+    with ThreadPoolExecutor(max_workers=config.NUM_LOGS_REQUEST_WORKERS) as executor:
+        while len(split_ranges) > 0 or next_block < fetch_range[1]:
+            ranges = []
+            while len(ranges) < num_ranges_per_round:
+                if len(split_ranges) > 0:
+                    ranges.append(split_ranges.pop())
+                elif next_block < fetch_range[1]:
+                    to_block = min(next_block + chunk_size, fetch_range[1])
+                    ranges.append((next_block, to_block))
+                    next_block = to_block
+                else:
+                    break
+
+            batches = [
+                ranges[i : i + config.NUM_LOGS_REQUESTS_PER_BATCH]
+                for i in range(0, len(ranges), config.NUM_LOGS_REQUESTS_PER_BATCH)
+            ]
+            results = [
+                result
+                for batch_results in executor.map(
+                    lambda batch: try_fetch_logs(client, batch, finalized_block),
+                    batches,
+                )
+                for result in batch_results
+            ]
+            for r, result in zip(ranges, results):
+                range_size = r[1] - r[0]
+                if isinstance(result, Exception):
+                    if range_size <= 1 or not is_logs_limit_error(result):
+                        raise result
+                    middle = r[0] + range_size // 2
+                    print(
+                        f"request for blocks {r[0]} to {r[1]} failed ({result}), splitting at {middle}"
+                    )
+                    split_ranges.extend([(middle, r[1]), (r[0], middle)])
+                    max_chunk_size = min(max_chunk_size, range_size // 2)
+                    chunk_size = min(chunk_size, max_chunk_size)
+                    continue
+                logs_by_range[r] = result
+                num_fetched_blocks += range_size
+                if len(result) < NUM_LOGS_PER_SPARSE_RANGE:
+                    # the limit is relaxed again gradually, so that a dense
+                    # stretch doesn't slow down the rest of the range
+                    max_chunk_size += max(max_chunk_size // 4, 1)
+                    chunk_size = min(max(chunk_size, range_size * 2), max_chunk_size)
+
+            num_logs = sum(len(logs) for logs in logs_by_range.values())
+            progress = num_fetched_blocks / num_blocks
+            print(
+                f"{progress * 100:.1f}% (got {num_logs} logs so far, requesting {chunk_size} blocks at a time)"
+            )
+    return [log for r in sorted(logs_by_range) for log in logs_by_range[r]]
+
+
+# Fetches the logs of all given block ranges in one batch request. For each
+# range, either the logs or the JSON-RPC error is returned. Errors of the request
+# as a whole are raised.
+def try_fetch_logs(client, block_ranges, finalized_block=-1):
+    calls = [
+        (
+            "eth_getLogs",
+            [
                 {
-                    "fromBlock": f"0x{from_block:x}",
-                    "toBlock": f"0x{to_block:x}",
+                    "fromBlock": f"0x{block_range[0]:x}",
+                    "toBlock": f"0x{block_range[1] - 1:x}",
                     "address": NODE_OPERATOR_REGISTRY_ADDRESS,
                     "topics": [SIGNING_KEY_ADDED_TOPIC],
                 }
             ],
-            "id": 1,
-        }
-        res = requests.post(config.EXECUTION_API_URL, json=params)
-        res.raise_for_status()
-        data = res.json()
-        if "error" in data:
-            raise ValueError(
-                f"request with params {params['params']} failed: {data['error']}"
-            )
-        logs.extend(data["result"])
-        progress = (to_block - fetch_range[0]) / num_blocks
-        print(f"{progress * 100:.1f}% (got {len(logs)} logs so far)")
-    return logs
+        )
+        for block_range in block_ranges
+    ]
+    return client.batch(
+        calls,
+        cache=all(
+            block_range[1] - 1 <= finalized_block for block_range in block_ranges
+        ),
+    )
 
 
-def merge_node_operators(old_node_operators, new_node_operators):
-    if old_node_operators is None:
-        return new_node_operators
-    return {**old_node_operators["operator_pubkeys"], **new_node_operators}
+# Returns whether a range failed because the node limits the size of eth_getLogs
+# requests, so that it may succeed when split. A batch the node rejects as a
+# whole fails the same way for smaller ranges.
+def is_logs_limit_error(error):
+    if not isinstance(error, JsonRpcError):
+        return False
+    if isinstance(error.error, dict):
+        if error.error.get("code") in LOGS_LIMIT_ERROR_CODES:
+            return True
+        message = str(error.error.get("message", ""))
+    else:
+        message = str(error.error)
+    message = message.lower()
+    return "batch" not in message and any(
+        pattern in message for pattern in LOGS_LIMIT_ERROR_MESSAGES
+    )
 
 
 if __name__ == "__main__":
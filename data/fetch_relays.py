@@ -3,10 +3,22 @@ from dotenv import load_dotenv
 load_dotenv()
 
 from dataclasses import dataclass, fields
+from concurrent.futures import ThreadPoolExecutor
 import os
 import json
+import time
 import urllib.parse
-import requests
+
+import block_store
+import http_client
+import relay_store
+from slot_ranges import SlotRanges
+
+
+RELAY_REQUEST_TIMEOUT = 60
+# relays record payloads as they deliver them, so a page of payloads up to a
+# slot further in the past than this doesn't change anymore and is cached
+RELAY_PAGE_CACHE_DELAY = 60 * 60
 
 
 @dataclass
@@ -30,30 +42,22 @@ def main():
     config = Config.load()
 
     blocks = read_blocks(config)
-    old_relays = read_relays(config)
     relay_apis = read_relay_apis(config)
 
-    relays = fetch_relays(
-        blocks["blocks"],
-        relay_apis,
-        old_relays["relays"] if old_relays is not None else {},
-        blocks["fetched_from"],
-        blocks["fetched_to"],
-    )
-    write_relays(config, relays)
+    if relay_store.is_legacy_json(config.RELAYS_PATH):
+        relay_store.migrate_legacy_json(
+            config.RELAYS_PATH, [api["name"] for api in relay_apis]
+        )
+    store = relay_store.open_relay_store(config.RELAYS_PATH, writable=True)
+    try:
+        fetch_relays(store, blocks["slots"], relay_apis)
+        store.set_fetched_range(blocks["fetched_from"], blocks["fetched_to"])
+    finally:
+        store.close()
 
 
 def read_blocks(config):
-    with open(config.BLOCKS_PATH) as f:
-        return json.load(f)
-
-
-def read_relays(config):
-    try:
-        with open(config.RELAYS_PATH) as f:
-            return json.load(f)
-    except FileNotFoundError:
-        return None
+    return block_store.read_slots(config.BLOCKS_PATH)
 
 
 def read_relay_apis(config):
@@ -61,67 +65,136 @@ def read_relay_apis(config):
         return json.load(f)
 
 
-def fetch_relays(blocks, relay_apis, old_relays, fetched_from, fetched_to):
-    all_slots = [block["slot"] for block in blocks]
-    relays = {}
-    for slot in all_slots:
-        if str(slot) in old_relays:
-            relays[str(slot)] = old_relays[str(slot)]
-        else:
-            relays[str(slot)] = set()
-
-    slots_to_fetch = [slot for slot in all_slots if str(slot) not in old_relays]
-    print(f"fetching {len(slots_to_fetch)} slots for {len(relay_apis)} relays")
+# Brings the relay store to the given block slots and records the relays of the
+# slots not confirmed with each relay yet. Only slots whose relays changed are
+# written.
+def fetch_relays(store, slots, relay_apis):
+    slots = set(slots)
+    all_slots = SlotRanges.from_slots(slots)
+    stored_slots = store.get_slots()
+    store.delete_relays(sorted(stored_slots - slots))
+    store.upsert_relays({slot: [] for slot in sorted(slots - stored_slots)})
+
+    # coverage is the set of slots per relay that have been confirmed with the
+    # relay. Only slots outside of it are fetched, so failed or partial scrapes
+    # are retried in the next run.
+    old_coverage = store.get_coverage()
+    coverage = {}
+    slots_to_fetch = {}
     for api in relay_apis:
-        slots = fetch_slots_for_relay(api, slots_to_fetch)
+        relay_coverage = SlotRanges(old_coverage.get(api["name"], []))
+        if all_slots:
+            relay_coverage = relay_coverage.clip(all_slots.min(), all_slots.max())
+        coverage[api["name"]] = relay_coverage
+        slots_to_fetch[api["name"]] = all_slots.difference(relay_coverage)
+    print(
+        f"fetching {sum(len(slots) for slots in slots_to_fetch.values())} slots for {len(relay_apis)} relays"
+    )
+
+    # relays are scraped concurrently, so the total time is the time of the
+    # slowest relay
+    with ThreadPoolExecutor(max_workers=max(len(relay_apis), 1)) as executor:
+        results = list(
+            executor.map(
+                lambda api: try_fetch_slots_for_relay(api, slots_to_fetch[api["name"]]),
+                relay_apis,
+            )
+        )
+
+    delivered_slots = set(slot for slots, _ in results for slot in slots)
+    if delivered_slots:
+        old_relays = store.get_relays(min(delivered_slots), max(delivered_slots))
+    else:
+        old_relays = {}
+    relays = {}
+    for api, (slots, fetched_slots) in zip(relay_apis, results):
         for slot in slots:
-            assert str(slot) in relays
-            relays[str(slot)].add(api["name"])
+            rs = relays.setdefault(slot, set(old_relays[slot]))
+            rs.add(api["name"])
+        relay_coverage = coverage[api["name"]].union(fetched_slots)
+        if all_slots:
+            relay_coverage = relay_coverage.clip(all_slots.min(), all_slots.max())
+        coverage[api["name"]] = relay_coverage
+    store.upsert_relays(
+        {
+            slot: rs
+            for slot, rs in relays.items()
+            if sorted(rs) != sorted(old_relays[slot])
+        }
+    )
+    store.set_coverage(
+        {name: relay_coverage.to_list() for name, relay_coverage in coverage.items()}
+    )
+
 
-    return {
-        "fetched_from": fetched_from,
-        "fetched_to": fetched_to,
-        "relays": {s: sorted(rs) for s, rs in relays.items()},
-    }
+# Returns the slots delivered by the relay and the slots confirmed by it. If
+# scraping fails midway, the pages fetched up to then are kept.
+def try_fetch_slots_for_relay(relay, slots_to_fetch):
+    slots = []
+    fetched_slots = SlotRanges()
+    try:
+        for page_slots, page_first, page_last in fetch_slots_for_relay(
+            relay, slots_to_fetch
+        ):
+            slots.extend(page_slots)
+            fetched_slots.add(page_first, page_last)
+    except Exception as e:
+        print(f'failed to fetch slots for relay {relay["name"]}: {e!r}')
+    return sorted(set(slots)), fetched_slots
 
 
 def fetch_slots_for_relay(relay, slots_to_fetch):
-    all_slots_to_fetch = set(slots_to_fetch)
-    remaining_slots_to_fetch = set(slots_to_fetch)
-    fetched_slots = set()
+    remaining_slots_to_fetch = slots_to_fetch.copy()
+    if not remaining_slots_to_fetch:
+        return
 
-    print(f'fetching {len(all_slots_to_fetch)} slots for relay {relay["name"]}')
-    while len(remaining_slots_to_fetch) > 0:
+    print(f'fetching {len(slots_to_fetch)} slots for relay {relay["name"]}')
+    while remaining_slots_to_fetch:
         url_with_path = urllib.parse.urljoin(
             relay["url"], "/relay/v1/data/bidtraces/proposer_payload_delivered"
         )
         params = {
-            "cursor": max(remaining_slots_to_fetch),
+            "cursor": remaining_slots_to_fetch.max(),
         }
-        progress = 1 - (len(remaining_slots_to_fetch) / len(all_slots_to_fetch))
-        print(f"requesting from slot {params['cursor']} ({progress * 100:.1f}%)")
-        res = requests.get(url_with_path, params=params)
+        progress = 1 - (len(remaining_slots_to_fetch) / len(slots_to_fetch))
+        print(
+            f"requesting from slot {params['cursor']} from relay {relay['name']} ({progress * 100:.1f}%)"
+        )
+        cache = (
+            block_store.slot_to_time(params["cursor"])
+            < time.time() - RELAY_PAGE_CACHE_DELAY
+            and is_complete_page
+        )
+        res = http_client.get(
+            url_with_path, params=params, timeout=RELAY_REQUEST_TIMEOUT, cache=cache
+        )
         res.raise_for_status()
         data = res.json()
 
         slots_by_relay = set(int(block["slot"]) for block in data)
-        slot_range = set(range(min(slots_by_relay), params["cursor"] + 1))
-        slots_not_by_relay = slot_range - slots_by_relay
-
-        remaining_slots_to_fetch -= slot_range
-        fetched_slots |= slots_by_relay
-
-        if len(slots_by_relay) == 0 and len(remaining_slots_to_fetch) > 0:
+        if len(slots_by_relay) == 0:
             print(
-                "empty response from relay {relay['url']}, but some slots still missing"
+                f"empty response from relay {relay['url']}, but some slots still missing"
             )
             break
-    return sorted(fetched_slots & all_slots_to_fetch)
+
+        remaining_slots_to_fetch.remove(min(slots_by_relay), params["cursor"])
+        yield (
+            sorted(slot for slot in slots_by_relay if slot in slots_to_fetch),
+            min(slots_by_relay),
+            params["cursor"],
+        )
 
 
-def write_relays(config, relays):
-    with open(config.RELAYS_PATH, "w") as f:
-        json.dump(relays, f)
+# Empty pages aren't cached, since relays that have lost or not yet indexed
+# older payloads respond with them as well.
+def is_complete_page(res):
+    if res.status_code != 200:
+        return False
+    try:
+        return len(res.json()) > 0
+    except ValueError:
+        return False
 
 
 if __name__ == "__main__":
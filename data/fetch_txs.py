@@ -7,10 +7,13 @@ import json
 import itertools
 from datetime import datetime, timezone, timedelta
 import urllib.parse
-import requests
-from dataclasses import dataclass, fields
+from dataclasses import dataclass, fields, MISSING
+from concurrent.futures import ThreadPoolExecutor
 import time
 
+import http_client
+from tx_store import TxStore
+
 
 @dataclass
 class Config:
@@ -18,8 +21,12 @@ class Config:
     DELAY: int
     MIN_NUM_MISSES: int
     PROPAGATION_TIME: int
-    TXS_PATH: str
+    TXS_SEGMENTS_PATH: str
     INTERVAL: int
+    NUM_TX_FETCH_SHARDS: int = 1
+    # txs file written by earlier versions, which is migrated to the segments
+    # if there are none yet
+    TXS_PATH: str = ""
 
     @classmethod
     def load(cls):
@@ -27,6 +34,8 @@ class Config:
         for field in fields(cls):
             value = os.getenv(field.name)
             if value is None:
+                if field.default is not MISSING:
+                    continue
                 raise ValueError(f"environment variable {field.name} is not specified")
             values[field.name] = field.type(value)
         return cls(**values)
@@ -37,11 +46,14 @@ def main():
     interval_to = now() - config.DELAY
     interval_from = interval_to - config.INTERVAL
 
-    last_output = read_last_output(config)
+    store = TxStore(config.TXS_SEGMENTS_PATH)
+    last_meta = store.read_meta()
+    if last_meta is None:
+        last_meta = migrate_last_output(config, store)
 
-    if last_output is not None:
-        last_fetched_from = last_output["fetched_from"]
-        last_fetched_to = last_output["fetched_to"]
+    if last_meta is not None:
+        last_fetched_from = last_meta["fetched_from"]
+        last_fetched_to = last_meta["fetched_to"]
         if not (
             last_fetched_from <= last_fetched_from
             or last_fetched_from <= interval_from
@@ -50,26 +62,26 @@ def main():
             raise ValueError("unexpected last fetch range")
         fetch_from = max(interval_from, last_fetched_to)
         fetch_to = interval_to
-
-        old_txs = last_output["txs"]
     else:
         fetch_from = interval_from
         fetch_to = interval_to
-        old_txs = []
 
     new_txs = fetch_txs(config, fetch_from, fetch_to)
-    txs = filter_txs(merge_txs(new_txs, old_txs), interval_from)
-    output = {
-        "fetched_from": interval_from,
-        "fetched_to": interval_to,
-        "txs": txs,
-        "propagation_time": config.PROPAGATION_TIME,
-        "min_num_misses": config.MIN_NUM_MISSES,
-    }
-    write_output(config, output)
+    store.add_txs(new_txs, merge_txs)
+    store.expire(interval_from)
+    store.write_meta(
+        {
+            "fetched_from": interval_from,
+            "fetched_to": interval_to,
+            "propagation_time": config.PROPAGATION_TIME,
+            "min_num_misses": config.MIN_NUM_MISSES,
+        }
+    )
 
 
 def read_last_output(config):
+    if config.TXS_PATH == "":
+        return None
     try:
         with open(config.TXS_PATH) as f:
             return json.load(f)
@@ -77,9 +89,18 @@ def read_last_output(config):
         return None
 
 
-def write_output(config, output):
-    with open(config.TXS_PATH, "w") as f:
-        json.dump(output, f)
+def migrate_last_output(config, store):
+    last_output = read_last_output(config)
+    if last_output is None:
+        return None
+    print(f"migrating txs from {config.TXS_PATH} to {config.TXS_SEGMENTS_PATH}")
+    store.add_txs(last_output["txs"], merge_txs)
+    meta = {
+        "fetched_from": last_output["fetched_from"],
+        "fetched_to": last_output["fetched_to"],
+    }
+    store.write_meta(meta)
+    return meta
 
 
 def now():
@@ -107,6 +128,33 @@ def cmp_query_bounds(b1, b2):
 
 
 def fetch_txs(config, fetch_from, fetch_to):
+    shards = split_fetch_range(fetch_from, fetch_to, config.NUM_TX_FETCH_SHARDS)
+    if len(shards) == 0:
+        return []
+    with ThreadPoolExecutor(max_workers=len(shards)) as executor:
+        shard_txs = list(
+            executor.map(lambda shard: fetch_txs_in_range(config, *shard), shards)
+        )
+    # a tx may be returned by two neighboring shards if it's at their boundary
+    txs = merge_txs(itertools.chain.from_iterable(shard_txs), [])
+    print(f"fetched {len(txs)} txs in total")
+    return txs
+
+
+def split_fetch_range(fetch_from, fetch_to, num_shards):
+    t0 = get_timestamp_from_query_bound(fetch_from)
+    t1 = get_timestamp_from_query_bound(fetch_to)
+    if t1 <= t0:
+        return []
+    num_shards = max(1, min(num_shards, t1 - t0))
+    bounds = [t0 + (t1 - t0) * i // num_shards for i in range(num_shards + 1)]
+    # keep the original bounds as they may be cursors instead of plain timestamps
+    bounds[0] = fetch_from
+    bounds[-1] = fetch_to
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def fetch_txs_in_range(config, fetch_from, fetch_to):
     fetch_from_datetime = get_datetime_from_query_bound(fetch_from)
     fetch_to_datetime = get_datetime_from_query_bound(fetch_to)
     fetch_interval = fetch_to_datetime - fetch_from_datetime
@@ -119,7 +167,7 @@ def fetch_txs(config, fetch_from, fetch_to):
         f"fetching txs in {fetch_interval} from {fetch_from_datetime} to {fetch_to_datetime}..."
     )
     while True:
-        res = requests.get(
+        res = http_client.get(
             url,
             params={
                 "min_num_misses": config.MIN_NUM_MISSES,
@@ -142,8 +190,10 @@ def fetch_txs(config, fetch_from, fetch_to):
             )
         progress = 1 - (fetch_to_datetime - next_fetch_from_datetime) / fetch_interval
         fetch_from = next_fetch_from
-        print(f"{progress * 100:.1f}% ({len(txs)} txs)...")
-    print(f"fetched {len(txs)} txs")
+        print(
+            f"{progress * 100:.1f}% of {fetch_from_datetime} to {fetch_to_datetime} ({len(txs)} txs)..."
+        )
+    print(f"fetched {len(txs)} txs from {fetch_from_datetime} to {fetch_to_datetime}")
     return txs
 
 
@@ -158,9 +208,5 @@ def merge_txs(txs1, txs2):
     return txs
 
 
-def filter_txs(txs, low_cutoff):
-    return [tx for tx in txs if tx["misses"][0]["proposal_time"] >= low_cutoff]
-
-
 if __name__ == "__main__":
     main()
@@ -2,12 +2,14 @@ from dotenv import load_dotenv
 
 load_dotenv()
 
-from dataclasses import dataclass, fields
+from dataclasses import dataclass, fields, MISSING
+from concurrent.futures import ThreadPoolExecutor
 import os
-import json
-import copy
 import urllib.parse
-import requests
+
+import block_store
+import http_client
+from pubkey_table import open_pubkey_table
 
 
 @dataclass
@@ -15,6 +17,14 @@ class Config:
     CONSENSUS_API_URL: str
     VALIDATOR_PUBKEYS_PATH: str
     NUM_VALIDATORS_PER_REQUEST: int
+    # "get" passes the validator ids in the query string, "post" in the request
+    # body, which allows for much larger batches
+    VALIDATOR_FETCH_METHOD: str = "get"
+    NUM_VALIDATOR_FETCH_WORKERS: int = 1
+    # "all" fetches the whole validator set, "proposers" only the validators
+    # that proposed one of the blocks in the block store at BLOCKS_PATH
+    VALIDATOR_PUBKEYS_MODE: str = "all"
+    BLOCKS_PATH: str = ""
 
     @classmethod
     def load(cls):
@@ -22,6 +32,8 @@ class Config:
         for field in fields(cls):
             value = os.getenv(field.name)
             if value is None:
+                if field.default is not MISSING:
+                    continue
                 raise ValueError(f"environment variable {field.name} is not specified")
             values[field.name] = field.type(value)
         return cls(**values)
@@ -30,46 +42,74 @@ class Config:
 def main():
     config = Config.load()
 
-    old_pubkeys = read_pubkeys(config)
-    pubkeys = fetch_pubkeys(config, old_pubkeys)
-    write_pubkeys(config, pubkeys)
-
-
-def read_pubkeys(config):
+    table = open_pubkey_table(config.VALIDATOR_PUBKEYS_PATH, writable=True)
     try:
-        with open(config.VALIDATOR_PUBKEYS_PATH) as f:
-            return json.load(f)
-    except IOError:
-        return None
-
-
-def write_pubkeys(config, pubkeys):
-    with open(config.VALIDATOR_PUBKEYS_PATH, "w") as f:
-        json.dump(pubkeys, f)
-
-
-def fetch_pubkeys(config, old_pubkeys):
+        if config.VALIDATOR_PUBKEYS_MODE == "all":
+            fetch_pubkeys(config, table)
+        elif config.VALIDATOR_PUBKEYS_MODE == "proposers":
+            fetch_proposer_pubkeys(config, table)
+        else:
+            raise ValueError(
+                f"unknown validator pubkeys mode {config.VALIDATOR_PUBKEYS_MODE}"
+            )
+    finally:
+        table.close()
+
+
+def fetch_pubkeys(config, table):
     slot = fetch_current_slot(config)
-    if old_pubkeys is not None:
-        if slot <= int(old_pubkeys["fetched_at_slot"]):
-            raise ValueError("old pubkeys have been fetched in the future")
-        old_pubkeys = old_pubkeys["pubkeys"]
-    else:
-        old_pubkeys = {}
-    next_validator_index = max(map(int, old_pubkeys.keys()), default=0)
+    if slot < table.fetched_at_slot:
+        raise ValueError("old pubkeys have been fetched in the future")
+    if slot == table.fetched_at_slot:
+        # the head hasn't moved since the last run, e.g. after a missed slot
+        print(f"pubkeys have been fetched at slot {slot} already")
+        return
+    # validators are never removed, so only the ones after the last known index
+    # have to be fetched
+    next_validator_index = table.first_missing_index()
     new_pubkeys = fetch_pubkeys_from(config, slot, next_validator_index)
-    return {
-        "fetched_at_slot": slot,
-        "pubkeys": {
-            **old_pubkeys,
-            **new_pubkeys,
-        },
-    }
+    table.put(new_pubkeys)
+    table.set_fetched_at_slot(slot)
+
+
+# Fetches only the pubkeys of proposers that are not known yet. Since pubkeys
+# never change, they are kept in the table for good. The table is left sparse,
+# so fetched_at_slot isn't touched: it marks the slot at which the whole set was
+# fetched, and an "all" run at that slot would otherwise skip the gaps.
+def fetch_proposer_pubkeys(config, table):
+    if config.BLOCKS_PATH == "":
+        raise ValueError("environment variable BLOCKS_PATH is not specified")
+    proposer_indices = block_store.read_proposer_indices(config.BLOCKS_PATH)
+    unknown_indices = sorted(i for i in proposer_indices if table.get(i) is None)
+    print(
+        f"{len(proposer_indices)} proposers, {len(unknown_indices)} with unknown pubkeys"
+    )
+    if len(unknown_indices) == 0:
+        return
+
+    slot = fetch_current_slot(config)
+    url = urllib.parse.urljoin(
+        config.CONSENSUS_API_URL, f"/eth/v1/beacon/states/{slot}/validators"
+    )
+    batch_size = config.NUM_VALIDATORS_PER_REQUEST
+    batches = [
+        unknown_indices[i : i + batch_size]
+        for i in range(0, len(unknown_indices), batch_size)
+    ]
+    with ThreadPoolExecutor(max_workers=config.NUM_VALIDATOR_FETCH_WORKERS) as executor:
+        results = executor.map(
+            lambda indices: fetch_validator_batch(config, url, indices), batches
+        )
+        pubkeys = {}
+        for batch_pubkeys in results:
+            pubkeys.update(batch_pubkeys)
+    print(f"fetched {len(pubkeys)} pubkeys")
+    table.put(pubkeys)
 
 
 def fetch_current_slot(config):
     url = urllib.parse.urljoin(config.CONSENSUS_API_URL, "/eth/v1/beacon/headers/head")
-    res = requests.get(url)
+    res = http_client.get(url)
     res.raise_for_status()
     data = res.json()
     return int(data["data"]["header"]["message"]["slot"])
@@ -81,25 +121,56 @@ def fetch_pubkeys_from(config, slot, validator_index):
     )
     pubkeys = {}
     i = validator_index
-    while True:
-        indices = list(range(i, i + config.NUM_VALIDATORS_PER_REQUEST))
-        print(f"requesting validators from index {indices[0]} to {indices[-1]}")
-        params = {
-            "id": indices,
-        }
-        res = requests.get(url, params)
-        res.raise_for_status()
-        data = res.json()
-        for v in data["data"]:
-            pubkeys[int(v["index"])] = v["validator"]["pubkey"]
-        if len(data["data"]) < len(indices):
-            break
-        i = max(pubkeys.keys()) + 1
-    print(
-        f"fetched validators from index {min(pubkeys.keys())} to {max(pubkeys.keys())}"
-    )
+    batch_size = config.NUM_VALIDATORS_PER_REQUEST
+    # batches are requested in rounds of one batch per worker until a batch
+    # comes back incomplete, i.e., the end of the validator set is reached
+    with ThreadPoolExecutor(max_workers=config.NUM_VALIDATOR_FETCH_WORKERS) as executor:
+        while True:
+            batches = [
+                list(range(start, start + batch_size))
+                for start in range(
+                    i, i + config.NUM_VALIDATOR_FETCH_WORKERS * batch_size, batch_size
+                )
+            ]
+            print(
+                f"requesting validators from index {batches[0][0]} to {batches[-1][-1]}"
+            )
+            results = list(
+                executor.map(
+                    lambda indices: fetch_validator_batch(config, url, indices),
+                    batches,
+                )
+            )
+            for batch_pubkeys in results:
+                pubkeys.update(batch_pubkeys)
+            if any(
+                len(batch_pubkeys) < len(indices)
+                for indices, batch_pubkeys in zip(batches, results)
+            ):
+                break
+            i = batches[-1][-1] + 1
+    if len(pubkeys) > 0:
+        print(
+            f"fetched validators from index {min(pubkeys.keys())} to {max(pubkeys.keys())}"
+        )
+    else:
+        print("no new validators")
     return pubkeys
 
 
+def fetch_validator_batch(config, url, indices):
+    if config.VALIDATOR_FETCH_METHOD == "get":
+        res = http_client.get(url, params={"id": indices})
+    elif config.VALIDATOR_FETCH_METHOD == "post":
+        res = http_client.post(url, json={"ids": [str(i) for i in indices]})
+    else:
+        raise ValueError(
+            f"unknown validator fetch method {config.VALIDATOR_FETCH_METHOD}"
+        )
+    res.raise_for_status()
+    data = res.json()
+    return {int(v["index"]): v["validator"]["pubkey"] for v in data["data"]}
+
+
 if __name__ == "__main__":
     main()
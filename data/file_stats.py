@@ -0,0 +1,33 @@
+import os
+import json
+
+
+# Returns the size and modification time of a file, those of all files in a
+# directory, or None if the path doesn't exist. Used to tell whether a file has
+# changed since it was last read.
+def stat_path(path):
+    if os.path.isdir(path):
+        stats = []
+        for root, _, filenames in os.walk(path):
+            for filename in filenames:
+                file_path = os.path.join(root, filename)
+                stat = os.stat(file_path)
+                stats.append(
+                    [os.path.relpath(file_path, path), stat.st_size, stat.st_mtime_ns]
+                )
+        return sorted(stats)
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+# Writes data as JSON to a temporary file next to path and then moves it into
+# place, so that readers see either the old or the new file, never a partial
+# one, and stat_path sees a change.
+def write_json_atomically(path, data):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(data, f)
+    os.replace(tmp_path, path)
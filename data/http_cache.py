@@ -0,0 +1,164 @@
+import hashlib
+import http.client
+import json
+import sqlite3
+import threading
+import time
+import urllib.parse
+import zlib
+
+import requests
+from requests.structures import CaseInsensitiveDict
+
+
+# request headers that select the representation of the response and are thus
+# part of the key
+KEY_HEADERS = ["Accept"]
+# once the cache exceeds its maximum size, least recently used responses are
+# evicted until it's down to this fraction of it, so that eviction doesn't run
+# on every insert
+EVICTION_TARGET = 0.9
+
+
+# On-disk cache of responses that never change, e.g. blocks of finalized slots.
+# Responses are stored compressed in an SQLite database, keyed by a hash of the
+# normalized request, i.e., its method, URL with sorted query parameters,
+# representation headers and body. Whether a response may be cached is up to
+# the caller, since only it knows whether the requested data is final.
+#
+# The total size of the stored responses is bounded. If it's exceeded, the
+# least recently used responses are evicted. The database may be shared by
+# several processes.
+class ResponseCache:
+    def __init__(self, path, max_size):
+        self.max_size = max_size
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute(
+            """
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                status_code INTEGER NOT NULL,
+                content_type TEXT,
+                content BLOB NOT NULL,
+                size INTEGER NOT NULL,
+                used_at REAL NOT NULL
+            )
+            """
+        )
+        self.connection.execute(
+            "CREATE INDEX IF NOT EXISTS responses_used_at ON responses (used_at)"
+        )
+        self.connection.commit()
+        (self.size,) = self.connection.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM responses"
+        ).fetchone()
+        self.lock = threading.Lock()
+
+    def close(self):
+        self.connection.close()
+
+    # Returns the cached response with the given key as a requests.Response, or
+    # None if there is none.
+    def get(self, key, url):
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT status_code, content_type, content FROM responses WHERE key = ?",
+                (key,),
+            ).fetchone()
+            if row is None:
+                return None
+            self.connection.execute(
+                "UPDATE responses SET used_at = ? WHERE key = ?", (time.time(), key)
+            )
+            self.connection.commit()
+        status_code, content_type, content = row
+        return make_response(url, status_code, content_type, zlib.decompress(content))
+
+    def put(self, key, res):
+        content = zlib.compress(res.content)
+        with self.lock:
+            old_row = self.connection.execute(
+                "SELECT size FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            self.connection.execute(
+                "INSERT OR REPLACE INTO responses (key, status_code, content_type, content, size, used_at) VALUES (?, ?, ?, ?, ?, ?)",
+                (
+                    key,
+                    res.status_code,
+                    res.headers.get("Content-Type"),
+                    content,
+                    len(content),
+                    time.time(),
+                ),
+            )
+            self.connection.commit()
+            self.size += len(content) - (old_row[0] if old_row is not None else 0)
+            if self.size > self.max_size:
+                self.evict()
+
+    def evict(self):
+        # other processes may have added responses in the meantime
+        (self.size,) = self.connection.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM responses"
+        ).fetchone()
+        target_size = self.max_size * EVICTION_TARGET
+        keys = []
+        for key, size in self.connection.execute(
+            "SELECT key, size FROM responses ORDER BY used_at"
+        ):
+            if self.size <= target_size:
+                break
+            keys.append((key,))
+            self.size -= size
+        self.connection.executemany("DELETE FROM responses WHERE key = ?", keys)
+        self.connection.commit()
+        print(f"evicted {len(keys)} responses from the HTTP cache")
+
+
+# Returns the key of a request made with the given requests arguments.
+def get_key(method, url, params=None, headers=None, data=None, json=None):
+    req = requests.Request(method, url, params=params, data=data).prepare()
+    parts = urllib.parse.urlsplit(req.url)
+    query = sorted(urllib.parse.parse_qsl(parts.query, keep_blank_values=True))
+    normalized_url = urllib.parse.urlunsplit(
+        (
+            parts.scheme.lower(),
+            parts.netloc.lower(),
+            parts.path,
+            urllib.parse.urlencode(query),
+            "",
+        )
+    )
+    headers = CaseInsensitiveDict(headers or {})
+    if json is not None:
+        body = dump_canonical_json(json)
+    elif isinstance(req.body, str):
+        body = req.body
+    elif req.body is not None:
+        body = req.body.hex()
+    else:
+        body = None
+    normalized_request = [
+        req.method,
+        normalized_url,
+        [headers.get(name) for name in KEY_HEADERS],
+        body,
+    ]
+    return hashlib.sha256(dump_canonical_json(normalized_request).encode()).hexdigest()
+
+
+def dump_canonical_json(data):
+    return json.dumps(data, sort_keys=True, separators=(",", ":"))
+
+
+def make_response(url, status_code, content_type, content):
+    res = requests.Response()
+    res.url = url
+    res.status_code = status_code
+    res.reason = http.client.responses.get(status_code)
+    if content_type is not None:
+        res.headers["Content-Type"] = content_type
+    res.encoding = requests.utils.get_encoding_from_headers(res.headers)
+    res._content = content
+    res._content_consumed = True
+    return res
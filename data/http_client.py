@@ -0,0 +1,250 @@
+from dataclasses import dataclass, fields, MISSING
+from datetime import datetime, timezone
+import email.utils
+import os
+import random
+import threading
+import time
+import urllib.parse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from http_cache import ResponseCache, get_key
+
+
+# responses with these status codes are considered transient and retried
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+@dataclass
+class Config:
+    HTTP_NUM_RETRIES: int = 3
+    # the delay before the nth retry is around HTTP_BACKOFF * 2^n seconds, but
+    # at most HTTP_MAX_BACKOFF. Servers asking to retry later than
+    # HTTP_MAX_BACKOFF aren't retried.
+    HTTP_BACKOFF: float = 1.0
+    HTTP_MAX_BACKOFF: float = 60.0
+    HTTP_TIMEOUT: float = 60.0
+    # maximum number of connections kept open per host
+    HTTP_POOL_SIZE: int = 32
+    # comma separated host=requests per second pairs, e.g.
+    # "boost-relay.flashbots.net=2,bloxroute.max-profit.blxrbdn.com=0.5"
+    HTTP_RATE_LIMITS: str = ""
+    # if set, responses the fetchers know to be final are cached in an SQLite
+    # database at this path (see http_cache.py), up to HTTP_CACHE_MAX_SIZE bytes
+    # of compressed responses
+    HTTP_CACHE_PATH: str = ""
+    HTTP_CACHE_MAX_SIZE: int = 4 * 1024**3
+
+    @classmethod
+    def load(cls):
+        values = {}
+        for field in fields(cls):
+            value = os.getenv(field.name)
+            if value is None:
+                if field.default is not MISSING:
+                    continue
+                raise ValueError(f"environment variable {field.name} is not specified")
+            values[field.name] = field.type(value)
+        return cls(**values)
+
+
+# Token bucket limiting the rate of requests to a host. A bucket without a rate
+# doesn't limit requests, but can still be paused if the host asks to retry
+# later.
+class TokenBucket:
+    def __init__(self, rate=None):
+        self.rate = rate
+        self.capacity = max(rate, 1) if rate is not None else None
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+        self.paused_until = 0
+        self.lock = threading.Lock()
+
+    # Blocks until a request may be sent.
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                wait = self.paused_until - now
+                if wait <= 0:
+                    if self.rate is None:
+                        return
+                    self.tokens = min(
+                        self.capacity, self.tokens + (now - self.updated_at) * self.rate
+                    )
+                    self.updated_at = now
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        return
+                    wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def pause(self, duration):
+        with self.lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + duration)
+
+
+# HTTP client shared by all fetchers. Connections are kept alive in a pool per
+# host, so that consecutive requests to the same node don't need a new TCP and
+# TLS handshake. Connection errors, timeouts and transient status codes are
+# retried with jittered exponential backoff, or after the delay the server asks
+# for with Retry-After, during which no other requests are sent to that host
+# either. Other errors and the last failed response are returned or raised as
+# with requests, so callers still call raise_for_status.
+#
+# All requests are retried regardless of their method, which is fine since the
+# fetchers only read data, also with POST requests.
+#
+# Requests made with cache set are served from the response cache if one is
+# configured. cache is True if successful responses never change, or a function
+# that tells so from the response, e.g. to leave out JSON-RPC errors or to keep
+# a 404 as well.
+class HttpClient:
+    def __init__(self, config):
+        self.config = config
+        self.session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=config.HTTP_POOL_SIZE, pool_maxsize=config.HTTP_POOL_SIZE
+        )
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.buckets = {
+            host: TokenBucket(rate)
+            for host, rate in parse_rate_limits(config.HTTP_RATE_LIMITS).items()
+        }
+        self.lock = threading.Lock()
+        self.cache = None
+        if config.HTTP_CACHE_PATH != "":
+            self.cache = ResponseCache(
+                config.HTTP_CACHE_PATH, config.HTTP_CACHE_MAX_SIZE
+            )
+
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request("POST", url, **kwargs)
+
+    def request(self, method, url, num_retries=None, cache=False, **kwargs):
+        if not cache or self.cache is None or kwargs.get("stream", False):
+            return self.send(method, url, num_retries, **kwargs)
+        key = get_key(
+            method,
+            url,
+            params=kwargs.get("params"),
+            headers=kwargs.get("headers"),
+            data=kwargs.get("data"),
+            json=kwargs.get("json"),
+        )
+        res = self.cache.get(key, url)
+        if res is not None:
+            return res
+        res = self.send(method, url, num_retries, **kwargs)
+        if res.status_code == 200 if cache is True else cache(res):
+            self.cache.put(key, res)
+        return res
+
+    def send(self, method, url, num_retries, **kwargs):
+        if num_retries is None:
+            num_retries = self.config.HTTP_NUM_RETRIES
+        kwargs.setdefault("timeout", self.config.HTTP_TIMEOUT)
+        bucket = self.get_bucket(url)
+        for attempt in range(num_retries + 1):
+            bucket.acquire()
+            try:
+                res = self.session.request(method, url, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                if attempt >= num_retries:
+                    raise
+                delay = self.get_backoff(attempt)
+                reason = repr(e)
+            else:
+                if res.status_code not in RETRY_STATUS_CODES or attempt >= num_retries:
+                    return res
+                retry_after = get_retry_after(res)
+                if retry_after is None:
+                    delay = self.get_backoff(attempt)
+                elif retry_after > self.config.HTTP_MAX_BACKOFF:
+                    return res
+                else:
+                    delay = retry_after
+                    bucket.pause(retry_after)
+                reason = f"status {res.status_code}"
+                res.close()
+            print(f"{method} {url} failed ({reason}), retrying in {delay:.1f}s...")
+            time.sleep(delay)
+
+    def get_bucket(self, url):
+        host = urllib.parse.urlsplit(url).hostname
+        with self.lock:
+            bucket = self.buckets.get(host)
+            if bucket is None:
+                bucket = TokenBucket()
+                self.buckets[host] = bucket
+            return bucket
+
+    # Half of the delay is fixed and half random, so that concurrent requests
+    # failing at the same time don't retry at the same time again.
+    def get_backoff(self, attempt):
+        delay = min(
+            self.config.HTTP_BACKOFF * 2**attempt, self.config.HTTP_MAX_BACKOFF
+        )
+        return delay / 2 + random.uniform(0, delay / 2)
+
+
+def parse_rate_limits(text):
+    rate_limits = {}
+    for item in text.split(","):
+        item = item.strip()
+        if item == "":
+            continue
+        host, _, rate = item.partition("=")
+        rate_limits[host.strip()] = float(rate)
+    return rate_limits
+
+
+# Returns the number of seconds a response asks to wait before retrying, or None
+# if it doesn't.
+def get_retry_after(res):
+    value = res.headers.get("Retry-After")
+    if value is None:
+        return None
+    try:
+        return max(float(value), 0)
+    except ValueError:
+        pass
+    try:
+        retry_at = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max((retry_at - datetime.now(timezone.utc)).total_seconds(), 0)
+
+
+client = None
+client_lock = threading.Lock()
+
+
+# Returns the client shared by all fetchers in this process, creating it from
+# the environment on first use.
+def get_client():
+    global client
+    with client_lock:
+        if client is None:
+            client = HttpClient(Config.load())
+        return client
+
+
+# Returns whether responses are cached, so that fetchers can skip looking up
+# which data is final otherwise.
+def is_caching():
+    return get_client().cache is not None
+
+
+def get(url, **kwargs):
+    return get_client().get(url, **kwargs)
+
+
+def post(url, **kwargs):
+    return get_client().post(url, **kwargs)
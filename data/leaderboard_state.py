@@ -0,0 +1,635 @@
+import os
+import json
+import math
+import sqlite3
+
+import aggregate
+from aggregate import Tally, FEE_RECIPIENT, PROPOSER_INDEX, RELAY
+from block_store import (
+    open_block_store,
+    slot_to_time,
+    time_to_slot_ceil,
+    time_to_slot_floor,
+)
+from relay_store import open_relay_store
+from tx_store import TxStore
+
+
+# bumped whenever the way contributions are accounted changes, so that states
+# written by earlier versions are rebuilt
+STATE_VERSION = 4
+
+# Misses are ordered like the dataset reads them, by segment and by their
+# position in it. Positions are counted from the end of a segment, since new txs
+# are added at its start, so that stored misses keep their position.
+MAX_MISSES_PER_SEGMENT = 2**24
+
+
+# Persistent per-slot accounting of the leaderboard counts. The state keeps the
+# blocks, relays and misses of the current window together with the totals they
+# contribute to, so that moving the window only requires adding the
+# contributions of new slots and misses and subtracting those of expired ones.
+# Slots already in the window are accounted again when the block or relay store
+# rewrote them since the last update, which is tracked by the versions of the
+# stores.
+#
+# Totals are kept per window, dimension, key and n, where n is the number of
+# relays a slot is split between (1 for the other dimensions). This keeps all
+# stored counts integers, so they don't drift no matter how often they are
+# updated. Window 0 is the whole fetched range, the others are the trailing
+# windows. Every change is counted in each window it falls into, and when a
+# window moves on, the rows between its old and new start are subtracted from
+# its totals, so no window is ever aggregated from scratch.
+#
+# Each total also keeps the sequence number of its first miss, so that the
+# misses of a tally are listed in the order in which aggregate.py sees them.
+# It's only looked up again when that miss is removed.
+class LeaderboardState:
+    def __init__(self, connection):
+        self.connection = connection
+        self.create_tables()
+        self.deltas = {}
+        # the (from, to) time ranges in which changes are counted for each
+        # window, with to None for the end of the window
+        self.window_ranges = []
+
+    def create_tables(self):
+        self.connection.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS meta (
+                key TEXT PRIMARY KEY,
+                value TEXT
+            );
+            CREATE TABLE IF NOT EXISTS slots (
+                slot INTEGER PRIMARY KEY,
+                missed INTEGER NOT NULL,
+                block_hash TEXT,
+                fee_recipient TEXT,
+                proposer_index INTEGER
+            );
+            CREATE TABLE IF NOT EXISTS relays (
+                slot INTEGER PRIMARY KEY,
+                relays TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS slots_by_fee_recipient ON slots (fee_recipient);
+            CREATE INDEX IF NOT EXISTS slots_by_proposer_index ON slots (proposer_index);
+            CREATE TABLE IF NOT EXISTS misses (
+                tx_hash TEXT NOT NULL,
+                slot INTEGER NOT NULL,
+                block_hash TEXT,
+                anchor_time INTEGER NOT NULL,
+                segment_start INTEGER NOT NULL,
+                seq INTEGER NOT NULL,
+                PRIMARY KEY (tx_hash, slot)
+            );
+            CREATE INDEX IF NOT EXISTS misses_by_slot ON misses (slot);
+            CREATE INDEX IF NOT EXISTS misses_by_anchor_time ON misses (anchor_time);
+            CREATE INDEX IF NOT EXISTS misses_by_segment ON misses (segment_start);
+            CREATE TABLE IF NOT EXISTS segments (
+                segment_start INTEGER PRIMARY KEY,
+                mtime_ns INTEGER NOT NULL,
+                size INTEGER NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS totals (
+                window INTEGER NOT NULL,
+                dimension TEXT NOT NULL,
+                key TEXT NOT NULL,
+                n INTEGER NOT NULL,
+                misses INTEGER NOT NULL,
+                blocks INTEGER NOT NULL,
+                first_miss INTEGER,
+                PRIMARY KEY (window, dimension, key, n)
+            );
+            """
+        )
+        self.connection.commit()
+
+    def close(self):
+        self.connection.close()
+
+    def get_meta(self, key):
+        row = self.connection.execute(
+            "SELECT value FROM meta WHERE key = ?", (key,)
+        ).fetchone()
+        return None if row is None else json.loads(row[0])
+
+    def set_meta(self, key, value):
+        self.connection.execute(
+            "INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)",
+            (key, json.dumps(value)),
+        )
+
+    # Drops all tables, since states of earlier versions may have another
+    # schema.
+    def reset(self):
+        for table in ["meta", "slots", "relays", "misses", "segments", "totals"]:
+            self.connection.execute(f"DROP TABLE IF EXISTS {table}")
+        self.create_tables()
+
+    # Brings the state to the window fetched_range and the trailing windows
+    # starting at window_froms. The windows may only move forward, otherwise (or
+    # if the fingerprint of the inputs changed or a store was recreated) the
+    # state is rebuilt from scratch. The fingerprint includes the durations of
+    # the windows, so changing them rebuilds the state as well.
+    def update(
+        self,
+        fingerprint,
+        fetched_range,
+        window_froms,
+        tx_store,
+        block_store,
+        relay_store,
+    ):
+        fetched_from, fetched_to = fetched_range
+        # the versions are read before the rows, so rows written in between
+        # are only accounted again in the next update
+        blocks_version = block_store.get_version()
+        relays_version = relay_store.get_version()
+        last_fetched_range = self.get_meta("fetched_range")
+        if (
+            self.get_meta("fingerprint") != fingerprint
+            or last_fetched_range is None
+            or fetched_from < last_fetched_range[0]
+            or fetched_to < last_fetched_range[1]
+            or blocks_version < self.get_meta("blocks_version")
+            or relays_version < self.get_meta("relays_version")
+        ):
+            print("rebuilding leaderboard state")
+            self.reset()
+            self.set_meta("fingerprint", fingerprint)
+            self.set_meta("blocks_version", 0)
+            self.set_meta("relays_version", 0)
+            last_fetched_range = None
+
+        s0 = time_to_slot_ceil(fetched_from)
+        s1 = time_to_slot_floor(fetched_to)
+        window_froms = [fetched_from] + list(window_froms)
+        if last_fetched_range is None:
+            first_new_slot = s0
+        else:
+            first_new_slot = max(time_to_slot_floor(last_fetched_range[1]) + 1, s0)
+            # the windows have the same durations as in the last update
+            last_window_froms = [
+                window_from - fetched_to + last_fetched_range[1]
+                for window_from in window_froms
+            ]
+            last_window_froms[0] = last_fetched_range[0]
+            self.move_windows(last_window_froms, window_froms)
+        self.window_ranges = [(window_from, None) for window_from in window_froms]
+
+        # only txs first missed in the window are part of it
+        expired_misses = self.connection.execute(
+            "SELECT tx_hash, slot, block_hash, anchor_time, seq FROM misses WHERE anchor_time < ?",
+            (fetched_from,),
+        ).fetchall()
+        for miss in expired_misses:
+            self.remove_miss(*miss)
+        expired_blocks = self.connection.execute(
+            "SELECT slot, missed, block_hash, fee_recipient, proposer_index FROM slots WHERE slot < ?",
+            (s0,),
+        ).fetchall()
+        for row in expired_blocks:
+            self.remove_block(row_to_block(row))
+        expired_relays = self.connection.execute(
+            "SELECT slot, relays FROM relays WHERE slot < ?", (s0,)
+        ).fetchall()
+        for slot, rs in expired_relays:
+            self.remove_relay_slot(slot, json.loads(rs))
+        num_changed_blocks = self.update_blocks(
+            block_store, blocks_version, s0, first_new_slot, s1
+        )
+        num_changed_relays = self.update_relays(
+            relay_store, relays_version, s0, first_new_slot, s1
+        )
+        self.update_misses(tx_store, fetched_from)
+
+        self.flush_deltas()
+        self.set_meta("fetched_range", [fetched_from, fetched_to])
+        self.connection.commit()
+        print(
+            f"updated leaderboard state: {len(expired_blocks)} slots expired, {s1 - first_new_slot + 1} slots added, {num_changed_blocks} blocks and {num_changed_relays} relay slots changed, {len(expired_misses)} misses expired"
+        )
+
+    # Subtracts the rows between the last and the new start of each window from
+    # the totals of the window. The rows themselves are kept, the ones before
+    # the start of the whole fetched range are removed by the update.
+    def move_windows(self, last_window_froms, window_froms):
+        self.window_ranges = list(zip(last_window_froms, window_froms))
+        t0 = min(last_window_froms)
+        t1 = max(window_froms)
+        rows = self.connection.execute(
+            "SELECT slot, block_hash, anchor_time, seq FROM misses WHERE anchor_time >= ? AND anchor_time < ?",
+            (t0, t1),
+        ).fetchall()
+        for slot, block_hash, anchor_time, seq in rows:
+            self.count_miss(slot, block_hash, -1, anchor_time, seq)
+        s0 = time_to_slot_ceil(t0)
+        s1 = time_to_slot_ceil(t1) - 1
+        rows = self.connection.execute(
+            "SELECT slot, missed, block_hash, fee_recipient, proposer_index FROM slots WHERE slot BETWEEN ? AND ?",
+            (s0, s1),
+        ).fetchall()
+        for row in rows:
+            self.count_block(row_to_block(row), -1)
+        rows = self.connection.execute(
+            "SELECT slot, relays FROM relays WHERE slot BETWEEN ? AND ?", (s0, s1)
+        ).fetchall()
+        for slot, rs in rows:
+            self.count_relay_slot(slot, json.loads(rs), -1)
+
+    # Accounts the blocks of the new slots and those of earlier slots that were
+    # written to the block store after the last update, e.g. after a reorg.
+    # Returns the number of earlier slots that changed.
+    def update_blocks(self, block_store, version, s0, first_new_slot, s1):
+        changed_blocks = block_store.get_changed_blocks(
+            self.get_meta("blocks_version"), s0, first_new_slot - 1
+        )
+        for block in changed_blocks:
+            old_block = self.get_block(block["slot"])
+            if old_block is not None:
+                self.remove_block(old_block)
+            self.add_block(block)
+        for block in block_store.get_blocks(first_new_slot, s1):
+            self.add_block(block)
+
+        # deleted slots don't leave a version behind, but since all other slots
+        # of the store are accounted now, they show in the number of slots
+        if self.count_slots("slots", s0, s1) != block_store.count_slots(s0, s1):
+            stored_slots = block_store.get_slots(s0, s1)
+            rows = self.connection.execute(
+                "SELECT slot, missed, block_hash, fee_recipient, proposer_index FROM slots"
+            ).fetchall()
+            for row in rows:
+                if row[0] not in stored_slots:
+                    self.remove_block(row_to_block(row))
+        self.set_meta("blocks_version", version)
+        return len(changed_blocks)
+
+    # Like update_blocks, for the relays of the slots.
+    def update_relays(self, relay_store, version, s0, first_new_slot, s1):
+        changed_relays = relay_store.get_changed_relays(
+            self.get_meta("relays_version"), s0, first_new_slot - 1
+        )
+        for slot, rs in changed_relays.items():
+            old_rs = self.get_relays(slot)
+            if old_rs is not None:
+                self.remove_relay_slot(slot, old_rs)
+            self.add_relay_slot(slot, rs)
+        for slot, rs in relay_store.get_relays(first_new_slot, s1).items():
+            self.add_relay_slot(slot, rs)
+
+        if self.count_slots("relays", s0, s1) != relay_store.count_slots(s0, s1):
+            stored_slots = relay_store.get_slots()
+            rows = self.connection.execute("SELECT slot, relays FROM relays").fetchall()
+            for slot, rs in rows:
+                if slot not in stored_slots:
+                    self.remove_relay_slot(slot, json.loads(rs))
+        self.set_meta("relays_version", version)
+        return len(changed_relays)
+
+    def count_slots(self, table, s0, s1):
+        (count,) = self.connection.execute(
+            f"SELECT COUNT(*) FROM {table} WHERE slot BETWEEN ? AND ?", (s0, s1)
+        ).fetchone()
+        return count
+
+    def get_block(self, slot):
+        row = self.connection.execute(
+            "SELECT slot, missed, block_hash, fee_recipient, proposer_index FROM slots WHERE slot = ?",
+            (slot,),
+        ).fetchone()
+        return None if row is None else row_to_block(row)
+
+    def get_relays(self, slot):
+        row = self.connection.execute(
+            "SELECT relays FROM relays WHERE slot = ?", (slot,)
+        ).fetchone()
+        return None if row is None else json.loads(row[0])
+
+    # Accounts the misses of all tx segments written since the last update.
+    def update_misses(self, tx_store, fetched_from):
+        segments = {}
+        for segment_start in tx_store.get_segment_starts():
+            stat = os.stat(tx_store.get_segment_path(segment_start))
+            segments[segment_start] = (stat.st_mtime_ns, stat.st_size)
+        last_segments = {
+            segment_start: (mtime_ns, size)
+            for segment_start, mtime_ns, size in self.connection.execute(
+                "SELECT segment_start, mtime_ns, size FROM segments"
+            )
+        }
+
+        for segment_start in sorted(set(segments) | set(last_segments)):
+            if segments.get(segment_start) == last_segments.get(segment_start):
+                continue
+            # misses that moved within the segment are accounted again, which
+            # is mostly not the case since new txs are added at its start
+            old_misses = {
+                (tx_hash, slot): (block_hash, anchor_time, seq)
+                for tx_hash, slot, block_hash, anchor_time, seq in self.connection.execute(
+                    "SELECT tx_hash, slot, block_hash, anchor_time, seq FROM misses WHERE segment_start = ?",
+                    (segment_start,),
+                )
+            }
+            new_misses = {}
+            if segment_start in segments:
+                txs = tx_store.read_segment(segment_start)
+                position = sum(len(tx["misses"]) for tx in txs)
+                for tx in txs:
+                    anchor_time = tx["misses"][0]["proposal_time"]
+                    for miss in tx["misses"]:
+                        position -= 1
+                        if anchor_time < fetched_from:
+                            continue
+                        key = (tx["tx_hash"], int(miss["slot"]))
+                        seq = segment_start * MAX_MISSES_PER_SEGMENT - position
+                        new_misses[key] = (miss["block_hash"], anchor_time, seq)
+
+            for key, miss in old_misses.items():
+                if new_misses.get(key) != miss:
+                    self.remove_miss(*key, *miss)
+            for key, miss in new_misses.items():
+                if old_misses.get(key) != miss:
+                    self.add_miss(*key, *miss, segment_start)
+
+            if segment_start in segments:
+                self.connection.execute(
+                    "INSERT OR REPLACE INTO segments (segment_start, mtime_ns, size) VALUES (?, ?, ?)",
+                    (segment_start, *segments[segment_start]),
+                )
+            else:
+                self.connection.execute(
+                    "DELETE FROM segments WHERE segment_start = ?", (segment_start,)
+                )
+
+    def add_block(self, block):
+        self.connection.execute(
+            "INSERT INTO slots (slot, missed, block_hash, fee_recipient, proposer_index) VALUES (?, ?, ?, ?, ?)",
+            (
+                block["slot"],
+                int(block["missed"]),
+                block["block_hash"],
+                block["fee_recipient"],
+                block["proposer_index"],
+            ),
+        )
+        self.count_block(block, 1)
+        for block_hash, anchor_time, seq in self.get_misses_in_slot(block["slot"]):
+            if block_hash == block["block_hash"]:
+                self.count_block_miss(block, 1, anchor_time, seq)
+
+    def remove_block(self, block):
+        self.connection.execute("DELETE FROM slots WHERE slot = ?", (block["slot"],))
+        self.count_block(block, -1)
+        for block_hash, anchor_time, seq in self.get_misses_in_slot(block["slot"]):
+            if block_hash == block["block_hash"]:
+                self.count_block_miss(block, -1, anchor_time, seq)
+
+    def add_relay_slot(self, slot, rs):
+        self.connection.execute(
+            "INSERT INTO relays (slot, relays) VALUES (?, ?)", (slot, json.dumps(rs))
+        )
+        self.count_relay_slot(slot, rs, 1)
+        for _, anchor_time, seq in self.get_misses_in_slot(slot):
+            self.count_relay_miss(rs, 1, anchor_time, seq)
+
+    def remove_relay_slot(self, slot, rs):
+        self.connection.execute("DELETE FROM relays WHERE slot = ?", (slot,))
+        self.count_relay_slot(slot, rs, -1)
+        for _, anchor_time, seq in self.get_misses_in_slot(slot):
+            self.count_relay_miss(rs, -1, anchor_time, seq)
+
+    def add_miss(self, tx_hash, slot, block_hash, anchor_time, seq, segment_start):
+        self.connection.execute(
+            "INSERT INTO misses (tx_hash, slot, block_hash, anchor_time, segment_start, seq) VALUES (?, ?, ?, ?, ?, ?)",
+            (tx_hash, slot, block_hash, anchor_time, segment_start, seq),
+        )
+        self.count_miss(slot, block_hash, 1, anchor_time, seq)
+
+    def remove_miss(self, tx_hash, slot, block_hash, anchor_time, seq):
+        self.connection.execute(
+            "DELETE FROM misses WHERE tx_hash = ? AND slot = ?", (tx_hash, slot)
+        )
+        self.count_miss(slot, block_hash, -1, anchor_time, seq)
+
+    def get_misses_in_slot(self, slot):
+        return self.connection.execute(
+            "SELECT block_hash, anchor_time, seq FROM misses WHERE slot = ?", (slot,)
+        ).fetchall()
+
+    # Misses count in the windows their anchor time falls into, blocks and
+    # relay slots in those their slot falls into.
+    def count_miss(self, slot, block_hash, sign, anchor_time, seq):
+        block = self.get_block(slot)
+        if block is not None and block["block_hash"] == block_hash:
+            self.count_block_miss(block, sign, anchor_time, seq)
+        rs = self.get_relays(slot)
+        if rs is not None:
+            self.count_relay_miss(rs, sign, anchor_time, seq)
+
+    def count_block(self, block, sign):
+        t = slot_to_time(block["slot"])
+        self.add_delta(FEE_RECIPIENT, block["fee_recipient"], 1, 0, sign, t)
+        self.add_delta(FEE_RECIPIENT, None, 0, 0, sign, t)
+        if not block["missed"]:
+            self.add_delta(PROPOSER_INDEX, block["proposer_index"], 1, 0, sign, t)
+            self.add_delta(PROPOSER_INDEX, None, 0, 0, sign, t)
+
+    def count_block_miss(self, block, sign, anchor_time, seq):
+        t = anchor_time
+        self.add_delta(FEE_RECIPIENT, block["fee_recipient"], 1, sign, 0, t, seq)
+        if not block["missed"]:
+            key = block["proposer_index"]
+            self.add_delta(PROPOSER_INDEX, key, 1, sign, 0, t, seq)
+
+    def count_relay_slot(self, slot, rs, sign):
+        t = slot_to_time(slot)
+        for relay in rs:
+            self.add_delta(RELAY, relay, len(rs), 0, sign, t)
+        self.add_delta(RELAY, None, 0, 0, sign, t)
+
+    def count_relay_miss(self, rs, sign, anchor_time, seq):
+        for relay in rs:
+            self.add_delta(RELAY, relay, len(rs), sign, 0, anchor_time, seq)
+
+    # Collects changes of the totals of the windows whose range contains t in
+    # memory, together with the first sequence numbers of the misses added to
+    # and removed from them. The number of blocks of a dimension is stored as
+    # the total of key None with n = 0.
+    def add_delta(self, dimension, key, n, misses, blocks, t, seq=None):
+        for window, (t0, t1) in enumerate(self.window_ranges):
+            if t < t0 or (t1 is not None and t >= t1):
+                continue
+            delta = self.deltas.setdefault(
+                (window, dimension, json.dumps(key), n), [0, 0, None, None]
+            )
+            delta[0] += misses
+            delta[1] += blocks
+            if misses != 0:
+                i = 2 if misses > 0 else 3
+                delta[i] = seq if delta[i] is None else min(delta[i], seq)
+
+    def flush_deltas(self):
+        self.connection.executemany(
+            """
+            INSERT INTO totals (window, dimension, key, n, misses, blocks, first_miss)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (window, dimension, key, n) DO UPDATE SET
+                misses = misses + excluded.misses,
+                blocks = blocks + excluded.blocks,
+                first_miss = MIN(
+                    COALESCE(first_miss, excluded.first_miss),
+                    COALESCE(excluded.first_miss, first_miss)
+                )
+            """,
+            [
+                (window, dimension, key, n, misses, blocks, first_added)
+                for (window, dimension, key, n), (
+                    misses,
+                    blocks,
+                    first_added,
+                    _,
+                ) in self.deltas.items()
+            ],
+        )
+        # a total whose first miss might have been removed looks it up again
+        for (window, dimension, key, n), delta in self.deltas.items():
+            first_removed = delta[3]
+            if first_removed is None:
+                continue
+            row = self.connection.execute(
+                "SELECT first_miss FROM totals WHERE window = ? AND dimension = ? AND key = ? AND n = ?",
+                (window, dimension, key, n),
+            ).fetchone()
+            if row[0] is not None and first_removed <= row[0]:
+                first_miss = self.find_first_miss(
+                    self.window_ranges[window][0], dimension, json.loads(key), n
+                )
+                self.connection.execute(
+                    "UPDATE totals SET first_miss = ? WHERE window = ? AND dimension = ? AND key = ? AND n = ?",
+                    (first_miss, window, dimension, key, n),
+                )
+        self.connection.execute("DELETE FROM totals WHERE misses = 0 AND blocks = 0")
+        self.deltas = {}
+
+    # Returns the sequence number of the first miss counted for the total of
+    # the given dimension, key and n in the window starting at window_from, or
+    # None if there is none.
+    def find_first_miss(self, window_from, dimension, key, n):
+        if dimension == FEE_RECIPIENT:
+            query = """
+                SELECT MIN(m.seq) FROM slots s
+                JOIN misses m ON m.slot = s.slot AND m.block_hash = s.block_hash
+                WHERE s.fee_recipient = ? AND m.anchor_time >= ?
+            """
+        elif dimension == PROPOSER_INDEX:
+            query = """
+                SELECT MIN(m.seq) FROM slots s
+                JOIN misses m ON m.slot = s.slot AND m.block_hash = s.block_hash
+                WHERE s.proposer_index = ? AND NOT s.missed AND m.anchor_time >= ?
+            """
+        else:
+            query = f"""
+                SELECT MIN(m.seq) FROM relays r JOIN misses m ON m.slot = r.slot
+                WHERE EXISTS (SELECT 1 FROM json_each(r.relays) WHERE value = ?)
+                AND json_array_length(r.relays) = {int(n)} AND m.anchor_time >= ?
+            """
+        (first_miss,) = self.connection.execute(query, (key, window_from)).fetchone()
+        return first_miss
+
+    # Returns the tallies of a window. Misses are listed in the order of their
+    # first miss in the window like in aggregate.py, relays first missed in the
+    # same slot by their name.
+    def get_tallies(self, window=0):
+        tallies = {dimension: Tally() for dimension in aggregate.DIMENSIONS}
+        first_misses = {dimension: {} for dimension in aggregate.DIMENSIONS}
+        rows = self.connection.execute(
+            "SELECT dimension, key, n, misses, blocks, first_miss FROM totals WHERE window = ? ORDER BY key, n",
+            (window,),
+        )
+        relay_misses = {}
+        relay_blocks = {}
+        for dimension, key, n, misses, blocks, first_miss in rows:
+            tally = tallies[dimension]
+            if n == 0:
+                tally.num_blocks = blocks
+                continue
+            key = json.loads(key)
+            if misses != 0:
+                first_misses[dimension][key] = min(
+                    first_misses[dimension].get(key, first_miss), first_miss
+                )
+            if dimension == RELAY:
+                if misses != 0:
+                    relay_misses.setdefault(key, []).append(misses / n)
+                if blocks != 0:
+                    relay_blocks.setdefault(key, []).append(blocks / n)
+                continue
+            if misses != 0:
+                tally.misses[key] = misses
+            if blocks != 0:
+                tally.blocks[key] = blocks
+        # the shares of a relay in slots split between different numbers of
+        # relays are added up exactly rounded, so that the result doesn't depend
+        # on the order of the rows
+        tallies[RELAY].misses = {
+            relay: math.fsum(shares) for relay, shares in relay_misses.items()
+        }
+        tallies[RELAY].blocks = {
+            relay: math.fsum(shares) for relay, shares in relay_blocks.items()
+        }
+        for dimension, tally in tallies.items():
+            order = sorted(
+                tally.misses, key=lambda key: (first_misses[dimension][key], key)
+            )
+            tally.misses = {key: tally.misses[key] for key in order}
+        return tallies
+
+
+def row_to_block(row):
+    slot, missed, block_hash, fee_recipient, proposer_index = row
+    return {
+        "slot": slot,
+        "missed": bool(missed),
+        "block_hash": block_hash,
+        "fee_recipient": fee_recipient,
+        "proposer_index": proposer_index,
+    }
+
+
+# Updates the state at path to the window of the tx store and returns the
+# tallies of all dimensions, followed by those of the windows starting at the
+# given times.
+def update_tallies(path, config, fetched_range, window_froms=()):
+    fingerprint = {
+        "version": STATE_VERSION,
+        "dimensions": list(aggregate.DIMENSIONS),
+        "txs_segments_path": os.path.abspath(config.TXS_SEGMENTS_PATH),
+        "blocks_path": os.path.abspath(config.BLOCKS_PATH),
+        "relays_path": os.path.abspath(config.RELAYS_PATH),
+        "window_durations": [
+            fetched_range[1] - window_from for window_from in window_froms
+        ],
+    }
+    tx_store = TxStore(config.TXS_SEGMENTS_PATH, writable=False)
+    block_store = open_block_store(config.BLOCKS_PATH)
+    relay_store = open_relay_store(config.RELAYS_PATH)
+    state = LeaderboardState(sqlite3.connect(path))
+    try:
+        if block_store.get_fetched_range() != tuple(fetched_range):
+            raise ValueError("blocks and txs time range mismatch")
+        if relay_store.get_fetched_range() != tuple(fetched_range):
+            raise ValueError("txs and relays time range mismatch")
+        state.update(
+            fingerprint,
+            fetched_range,
+            window_froms,
+            tx_store,
+            block_store,
+            relay_store,
+        )
+        return [state.get_tallies(window) for window in range(len(window_froms) + 1)]
+    finally:
+        state.close()
+        relay_store.close()
+        block_store.close()
@@ -0,0 +1,145 @@
+import os
+import json
+import mmap
+
+
+MAGIC = b"VALPUBKS"
+HEADER_SIZE = 16
+PUBKEY_SIZE = 48
+EMPTY_PUBKEY = bytes(PUBKEY_SIZE)
+
+
+# Table of validator pubkeys addressed by validator index. The file starts with
+# a header holding a magic value and the slot the whole validator set has last
+# been fetched at, followed by one 48 byte record per validator index. The file
+# is memory-mapped, so lookups don't require parsing anything. Records of
+# unknown validators are all zero.
+class PubkeyTable:
+    def __init__(self, path, writable):
+        self.path = path
+        self.writable = writable
+        self.file = open(path, "r+b" if writable else "rb")
+        self.map = None
+        self._remap()
+        if self.map[: len(MAGIC)] != MAGIC:
+            raise ValueError(f"{path} is not a validator pubkey table")
+
+    def close(self):
+        self.map.close()
+        self.file.close()
+
+    def _remap(self):
+        if self.map is not None:
+            self.map.close()
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    @property
+    def fetched_at_slot(self):
+        return int.from_bytes(self.map[len(MAGIC) : HEADER_SIZE], "little")
+
+    def set_fetched_at_slot(self, slot):
+        self.file.seek(len(MAGIC))
+        self.file.write(slot.to_bytes(HEADER_SIZE - len(MAGIC), "little"))
+        self.file.flush()
+
+    def __len__(self):
+        return (len(self.map) - HEADER_SIZE) // PUBKEY_SIZE
+
+    def get(self, index):
+        if index < 0 or index >= len(self):
+            return None
+        position = HEADER_SIZE + index * PUBKEY_SIZE
+        pubkey = self.map[position : position + PUBKEY_SIZE]
+        if pubkey == EMPTY_PUBKEY:
+            return None
+        return "0x" + pubkey.hex()
+
+    # Returns the lowest validator index whose pubkey is unknown.
+    def first_missing_index(self):
+        position = HEADER_SIZE
+        while True:
+            position = self.map.find(EMPTY_PUBKEY, position)
+            if position == -1:
+                return len(self)
+            offset = (position - HEADER_SIZE) % PUBKEY_SIZE
+            if offset == 0:
+                return (position - HEADER_SIZE) // PUBKEY_SIZE
+            position += PUBKEY_SIZE - offset
+
+    def items(self):
+        for index in range(len(self)):
+            pubkey = self.get(index)
+            if pubkey is not None:
+                yield index, pubkey
+
+    # Writes pubkeys given as a dict from validator index to hex string. Pubkeys
+    # of consecutive new validators are simply appended to the file. Pubkeys
+    # can also be written beyond the end, the gap is filled with unknown ones.
+    def put(self, pubkeys):
+        if not self.writable:
+            raise ValueError("pubkey table is not writable")
+        run_start = None
+        run = []
+        for index, pubkey in sorted(pubkeys.items()):
+            pubkey_bytes = bytes.fromhex(pubkey[2:])
+            if len(pubkey_bytes) != PUBKEY_SIZE:
+                raise ValueError(f"invalid pubkey {pubkey} of validator {index}")
+            if run_start is not None and index != run_start + len(run):
+                self._write_run(run_start, run)
+                run = []
+            if len(run) == 0:
+                run_start = index
+            run.append(pubkey_bytes)
+        if len(run) > 0:
+            self._write_run(run_start, run)
+        self.file.flush()
+        self._remap()
+
+    def _write_run(self, start_index, pubkeys):
+        self.file.seek(HEADER_SIZE + start_index * PUBKEY_SIZE)
+        self.file.write(b"".join(pubkeys))
+
+
+# Opens the table at path. Only writers create the table or migrate a JSON file
+# written by earlier versions, so that reading never changes any files.
+def open_pubkey_table(path, writable=False):
+    if not os.path.exists(path):
+        if not writable:
+            raise FileNotFoundError(f"validator pubkey table {path} does not exist")
+        create_pubkey_table(path)
+    elif is_legacy_json(path):
+        if not writable:
+            raise ValueError(
+                f"{path} is a JSON file of an earlier version, run fetch_validator_pubkeys.py to migrate it"
+            )
+        migrate_legacy_json(path)
+    return PubkeyTable(path, writable)
+
+
+def create_pubkey_table(path, fetched_at_slot=0):
+    with open(path, "wb") as f:
+        f.write(MAGIC)
+        f.write(fetched_at_slot.to_bytes(HEADER_SIZE - len(MAGIC), "little"))
+
+
+def is_legacy_json(path):
+    with open(path, "rb") as f:
+        header = f.read(len(MAGIC))
+    return header[:1] == b"{"
+
+
+def migrate_legacy_json(path):
+    with open(path) as f:
+        legacy_pubkeys = json.load(f)
+    backup_path = path + ".bak"
+    os.replace(path, backup_path)
+    print(f"migrating validator pubkeys from {backup_path} to {path}")
+
+    create_pubkey_table(path, int(legacy_pubkeys["fetched_at_slot"]))
+    table = PubkeyTable(path, writable=True)
+    try:
+        table.put(
+            {int(index): pubkey for index, pubkey in legacy_pubkeys["pubkeys"].items()}
+        )
+    finally:
+        table.close()
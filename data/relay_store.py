@@ -0,0 +1,197 @@
+import os
+import json
+import sqlite3
+
+from block_store import (
+    bump_version,
+    connect_read_only,
+    is_legacy_json,
+    time_to_slot_ceil,
+    time_to_slot_floor,
+)
+from slot_ranges import SlotRanges
+
+
+# Slot-indexed store of the relays that relayed each block, together with the
+# slots each relay has been scraped for, backed by an SQLite database. Every slot
+# of the block store has a row, with an empty list if no relay delivered its
+# block. Like the block store, each write records a new version on the rows it
+# touches, so a run only writes the slots whose relays changed and readers can
+# pick up just those.
+class RelayStore:
+    def __init__(self, connection, writable=True):
+        self.connection = connection
+        if not writable:
+            return
+        self.connection.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS relays (
+                slot INTEGER PRIMARY KEY,
+                relays TEXT NOT NULL,
+                version INTEGER NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS relays_by_version ON relays (version);
+            CREATE TABLE IF NOT EXISTS coverage (
+                relay TEXT PRIMARY KEY,
+                ranges TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS meta (
+                key TEXT PRIMARY KEY,
+                value INTEGER
+            );
+            """
+        )
+        self.connection.commit()
+
+    def close(self):
+        self.connection.close()
+
+    def get_fetched_range(self):
+        rows = dict(self.connection.execute("SELECT key, value FROM meta"))
+        if "fetched_from" not in rows or "fetched_to" not in rows:
+            return None
+        return rows["fetched_from"], rows["fetched_to"]
+
+    def set_fetched_range(self, fetched_from, fetched_to):
+        self.connection.executemany(
+            "INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)",
+            [("fetched_from", fetched_from), ("fetched_to", fetched_to)],
+        )
+        self.connection.commit()
+
+    def get_version(self):
+        row = self.connection.execute(
+            "SELECT value FROM meta WHERE key = 'version'"
+        ).fetchone()
+        return 0 if row is None else row[0]
+
+    def get_slots(self):
+        return set(
+            slot for (slot,) in self.connection.execute("SELECT slot FROM relays")
+        )
+
+    def count_slots(self, s0, s1):
+        (count,) = self.connection.execute(
+            "SELECT COUNT(*) FROM relays WHERE slot BETWEEN ? AND ?", (s0, s1)
+        ).fetchone()
+        return count
+
+    # Returns a dict from slot to relay names.
+    def get_relays(self, s0, s1):
+        rows = self.connection.execute(
+            "SELECT slot, relays FROM relays WHERE slot BETWEEN ? AND ? ORDER BY slot",
+            (s0, s1),
+        )
+        return {slot: json.loads(rs) for slot, rs in rows}
+
+    # Returns the relays of the slots in the range written after the given
+    # version.
+    def get_changed_relays(self, version, s0, s1):
+        rows = self.connection.execute(
+            "SELECT slot, relays FROM relays WHERE version > ? AND slot BETWEEN ? AND ? ORDER BY slot",
+            (version, s0, s1),
+        )
+        return {slot: json.loads(rs) for slot, rs in rows}
+
+    def upsert_relays(self, relays):
+        if len(relays) == 0:
+            return
+        version = bump_version(self.connection)
+        self.connection.executemany(
+            "INSERT OR REPLACE INTO relays (slot, relays, version) VALUES (?, ?, ?)",
+            [(slot, json.dumps(sorted(rs)), version) for slot, rs in relays.items()],
+        )
+        self.connection.commit()
+
+    def delete_relays(self, slots):
+        self.connection.executemany(
+            "DELETE FROM relays WHERE slot = ?", [(slot,) for slot in slots]
+        )
+        self.connection.commit()
+
+    # Returns a dict from relay name to the slot ranges confirmed with it.
+    def get_coverage(self):
+        return {
+            relay: json.loads(ranges)
+            for relay, ranges in self.connection.execute(
+                "SELECT relay, ranges FROM coverage"
+            )
+        }
+
+    def set_coverage(self, coverage):
+        self.connection.execute("DELETE FROM coverage")
+        self.connection.executemany(
+            "INSERT INTO coverage (relay, ranges) VALUES (?, ?)",
+            [(relay, json.dumps(ranges)) for relay, ranges in coverage.items()],
+        )
+        self.connection.commit()
+
+
+# Opens the relay store at path. A relays.json file written by earlier versions
+# has to be migrated by a writer with migrate_legacy_json first, readers open
+# the database read-only.
+def open_relay_store(path, writable=False):
+    if is_legacy_json(path):
+        raise ValueError(
+            f"{path} is a relays file of an earlier version, run fetch_relays.py to migrate it"
+        )
+    if writable:
+        return RelayStore(sqlite3.connect(path))
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"relay store {path} does not exist")
+    return RelayStore(connect_read_only(path), writable=False)
+
+
+# Reads the relays in the fetched range as a dict with fetched_from, fetched_to
+# and relays, a dict from slot to relay names. A relays.json file that hasn't
+# been migrated yet is read as is.
+def read_relays(path):
+    if is_legacy_json(path):
+        with open(path) as f:
+            return json.load(f)
+
+    store = open_relay_store(path)
+    try:
+        fetched_range = store.get_fetched_range()
+        if fetched_range is None:
+            raise ValueError(f"relay store {path} does not have a fetched range")
+        fetched_from, fetched_to = fetched_range
+        return {
+            "fetched_from": fetched_from,
+            "fetched_to": fetched_to,
+            "relays": store.get_relays(
+                time_to_slot_ceil(fetched_from), time_to_slot_floor(fetched_to)
+            ),
+        }
+    finally:
+        store.close()
+
+
+# Relays files written before coverage was tracked consider every slot in them
+# to be fetched for all relays.
+def get_legacy_coverage(legacy_relays, relay_names):
+    ranges = SlotRanges.from_slots(int(slot) for slot in legacy_relays).to_list()
+    return {name: ranges for name in relay_names}
+
+
+def migrate_legacy_json(path, relay_names):
+    with open(path) as f:
+        legacy_relays = json.load(f)
+    backup_path = path + ".bak"
+    os.replace(path, backup_path)
+    print(f"migrating relays from {backup_path} to relay store {path}")
+
+    coverage = legacy_relays.get("coverage")
+    if coverage is None:
+        coverage = get_legacy_coverage(legacy_relays["relays"], relay_names)
+    store = RelayStore(sqlite3.connect(path))
+    try:
+        store.upsert_relays(
+            {int(slot): rs for slot, rs in legacy_relays["relays"].items()}
+        )
+        store.set_coverage(coverage)
+        store.set_fetched_range(
+            legacy_relays["fetched_from"], legacy_relays["fetched_to"]
+        )
+    finally:
+        store.close()
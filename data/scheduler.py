@@ -0,0 +1,122 @@
+from dataclasses import dataclass, field
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import os
+import json
+
+from file_stats import stat_path, write_json_atomically
+
+
+# A step of the pipeline. inputs and outputs are the paths of the files or
+# directories the stage reads and writes, and params the config values it
+# depends on. A stage runs after all stages that output one of its inputs.
+#
+# Stages that fetch from an external source always run since there's no way to
+# tell if the source has changed. Other stages are skipped if their inputs and
+# params are the same as in their last successful run and their outputs still
+# exist.
+@dataclass
+class Stage:
+    name: str
+    run: object
+    inputs: list = field(default_factory=list)
+    outputs: list = field(default_factory=list)
+    params: dict = field(default_factory=dict)
+    external: bool = False
+
+
+# Runs the stages, each as soon as the stages it depends on are done and as many
+# at once as possible. If a stage fails, no further stages are started and the
+# error is raised once the running ones have finished. The fingerprints of the
+# last successful runs are kept in the JSON file at state_path. If it is None,
+# no stage is skipped.
+def run_stages(stages, state_path=None):
+    dependencies = get_dependencies(stages)
+    state = read_state(state_path)
+    pending = list(stages)
+    done = set()
+    running = {}
+    error = None
+    with ThreadPoolExecutor(max_workers=max(len(stages), 1)) as executor:
+        while len(pending) > 0 or len(running) > 0:
+            skipped = False
+            if error is None:
+                ready = [s for s in pending if dependencies[s.name] <= done]
+                for stage in ready:
+                    pending.remove(stage)
+                    fingerprint = get_fingerprint(stage)
+                    if state_path is not None and is_up_to_date(
+                        stage, fingerprint, state
+                    ):
+                        print(f"skipping {stage.name}, inputs unchanged")
+                        done.add(stage.name)
+                        skipped = True
+                        continue
+                    print(f"running {stage.name}...")
+                    state.pop(stage.name, None)
+                    running[executor.submit(stage.run)] = (stage, fingerprint)
+            if skipped:
+                # skipped stages may have made further stages ready
+                continue
+            if len(running) == 0:
+                if error is None:
+                    raise ValueError("stage dependencies are cyclic")
+                break
+
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                stage, fingerprint = running.pop(future)
+                try:
+                    future.result()
+                except Exception as e:
+                    print(f"{stage.name} failed: {e}")
+                    if error is None:
+                        error = e
+                    continue
+                done.add(stage.name)
+                state[stage.name] = fingerprint
+                if state_path is not None:
+                    write_json_atomically(state_path, state)
+    if error is not None:
+        raise error
+
+
+def is_up_to_date(stage, fingerprint, state):
+    return (
+        not stage.external
+        and state.get(stage.name) == fingerprint
+        and all(os.path.exists(path) for path in stage.outputs)
+    )
+
+
+# Maps each stage name to the names of the stages that output one of its inputs.
+def get_dependencies(stages):
+    producers = {}
+    for stage in stages:
+        for path in stage.outputs:
+            producers[os.path.abspath(path)] = stage.name
+    dependencies = {}
+    for stage in stages:
+        dependencies[stage.name] = {
+            producers[os.path.abspath(path)]
+            for path in stage.inputs
+            if os.path.abspath(path) in producers
+            and producers[os.path.abspath(path)] != stage.name
+        }
+    return dependencies
+
+
+def read_state(path):
+    if path is None:
+        return {}
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def get_fingerprint(stage):
+    return {
+        "params": stage.params,
+        "inputs": {path: stat_path(path) for path in stage.inputs},
+    }
@@ -0,0 +1,102 @@
+import os
+import json
+
+
+EVENTS_FILENAME = "events.jsonl"
+CHECKPOINTS_FILENAME = "checkpoints.jsonl"
+
+
+# Append-only log of decoded SigningKeyAdded events. Events are stored one per
+# line in block and log index order. Checkpoints record the block up to which
+# (exclusive) the log is complete, the hash of the block before it and the size
+# of the events file at that point. Rolling back to a checkpoint truncates the
+# events file, so a reorg only requires refetching the blocks after it.
+class SigningKeyLog:
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(self.path, exist_ok=True)
+        self.events_path = os.path.join(self.path, EVENTS_FILENAME)
+        self.checkpoints_path = os.path.join(self.path, CHECKPOINTS_FILENAME)
+        self.checkpoints = self._read_checkpoints()
+        # events written after the last checkpoint are incomplete
+        self._truncate_events(self._get_committed_size())
+
+    def _read_checkpoints(self):
+        try:
+            with open(self.checkpoints_path) as f:
+                return [json.loads(line) for line in f if line.strip() != ""]
+        except FileNotFoundError:
+            return []
+
+    def _get_committed_size(self):
+        if len(self.checkpoints) == 0:
+            return 0
+        return self.checkpoints[-1]["offset"]
+
+    def _truncate_events(self, size):
+        with open(self.events_path, "a") as f:
+            f.truncate(size)
+
+    def get_last_checkpoint(self):
+        if len(self.checkpoints) == 0:
+            return None
+        return self.checkpoints[-1]
+
+    # Appends events and checkpoints. Each checkpoint is written after all events
+    # in blocks before it.
+    def append(self, events, checkpoints):
+        events = sorted(events, key=lambda e: (e["block_number"], e["log_index"]))
+        i = 0
+        with open(self.events_path, "a") as events_file, open(
+            self.checkpoints_path, "a"
+        ) as checkpoints_file:
+            for checkpoint in sorted(checkpoints, key=lambda c: c["block_number"]):
+                while (
+                    i < len(events)
+                    and events[i]["block_number"] < checkpoint["block_number"]
+                ):
+                    events_file.write(json.dumps(events[i]) + "\n")
+                    i += 1
+                events_file.flush()
+                os.fsync(events_file.fileno())
+                checkpoint = {**checkpoint, "offset": events_file.tell()}
+                checkpoints_file.write(json.dumps(checkpoint) + "\n")
+                checkpoints_file.flush()
+                self.checkpoints.append(checkpoint)
+        if i < len(events):
+            raise ValueError("events after the last checkpoint")
+
+    # Drops all events and checkpoints after the given checkpoint. If it is
+    # None, the whole log is dropped.
+    def rollback(self, checkpoint):
+        if checkpoint is None:
+            self.checkpoints = []
+        else:
+            self.checkpoints = self.checkpoints[
+                : self.checkpoints.index(checkpoint) + 1
+            ]
+        self._write_checkpoints()
+        self._truncate_events(self._get_committed_size())
+
+    # Drops the checkpoints for which keep returns False, except for the last
+    # one, which marks the end of the log. Events are left as they are.
+    def compact(self, keep):
+        checkpoints = [c for c in self.checkpoints[:-1] if keep(c)]
+        checkpoints += self.checkpoints[-1:]
+        if len(checkpoints) == len(self.checkpoints):
+            return
+        self.checkpoints = checkpoints
+        self._write_checkpoints()
+
+    def _write_checkpoints(self):
+        tmp_path = self.checkpoints_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            for c in self.checkpoints:
+                f.write(json.dumps(c) + "\n")
+        os.replace(tmp_path, self.checkpoints_path)
+
+    def read_events(self):
+        with open(self.events_path) as f:
+            for line in f:
+                if line.strip() != "":
+                    yield json.loads(line)
@@ -0,0 +1,121 @@
+from bisect import bisect_left, bisect_right
+
+
+# A set of slots stored as sorted, disjoint and non-adjacent inclusive
+# [first, last] ranges. Ranges are located by binary search, so memory and time
+# scale with the number of gaps instead of the number of slots.
+class SlotRanges:
+    def __init__(self, ranges=()):
+        self.firsts = []
+        self.lasts = []
+        self.num_slots = 0
+        for first, last in ranges:
+            self.add(first, last)
+
+    # Builds the ranges in a single pass over the sorted slots, so that turning
+    # the slots of a whole window into ranges stays cheap.
+    @classmethod
+    def from_slots(cls, slots):
+        slot_ranges = cls()
+        for slot in sorted(set(slots)):
+            if slot_ranges.lasts and slot == slot_ranges.lasts[-1] + 1:
+                slot_ranges.lasts[-1] = slot
+            else:
+                slot_ranges.firsts.append(slot)
+                slot_ranges.lasts.append(slot)
+            slot_ranges.num_slots += 1
+        return slot_ranges
+
+    def copy(self):
+        slot_ranges = SlotRanges()
+        slot_ranges.firsts = list(self.firsts)
+        slot_ranges.lasts = list(self.lasts)
+        slot_ranges.num_slots = self.num_slots
+        return slot_ranges
+
+    def to_list(self):
+        return [[first, last] for first, last in zip(self.firsts, self.lasts)]
+
+    def __len__(self):
+        return self.num_slots
+
+    def __bool__(self):
+        return self.num_slots > 0
+
+    def __contains__(self, slot):
+        i = bisect_right(self.firsts, slot) - 1
+        return i >= 0 and self.lasts[i] >= slot
+
+    def __iter__(self):
+        for first, last in zip(self.firsts, self.lasts):
+            yield from range(first, last + 1)
+
+    def __eq__(self, other):
+        return self.firsts == other.firsts and self.lasts == other.lasts
+
+    def __repr__(self):
+        return f"SlotRanges({self.to_list()})"
+
+    def min(self):
+        return self.firsts[0]
+
+    def max(self):
+        return self.lasts[-1]
+
+    def add(self, first, last):
+        if first > last:
+            return
+        # ranges i to j - 1 overlap with or are adjacent to [first, last]
+        i = bisect_left(self.lasts, first - 1)
+        j = bisect_right(self.firsts, last + 1)
+        if i < j:
+            first = min(first, self.firsts[i])
+            last = max(last, self.lasts[j - 1])
+            self.num_slots -= self._count(i, j)
+        self.firsts[i:j] = [first]
+        self.lasts[i:j] = [last]
+        self.num_slots += last - first + 1
+
+    def remove(self, first, last):
+        if first > last:
+            return
+        # ranges i to j - 1 overlap with [first, last]
+        i = bisect_left(self.lasts, first)
+        j = bisect_right(self.firsts, last)
+        if i >= j:
+            return
+        new_firsts = []
+        new_lasts = []
+        if self.firsts[i] < first:
+            new_firsts.append(self.firsts[i])
+            new_lasts.append(first - 1)
+        if self.lasts[j - 1] > last:
+            new_firsts.append(last + 1)
+            new_lasts.append(self.lasts[j - 1])
+        self.num_slots -= self._count(i, j)
+        self.num_slots += sum(l - f + 1 for f, l in zip(new_firsts, new_lasts))
+        self.firsts[i:j] = new_firsts
+        self.lasts[i:j] = new_lasts
+
+    def union(self, other):
+        slot_ranges = self.copy()
+        for first, last in zip(other.firsts, other.lasts):
+            slot_ranges.add(first, last)
+        return slot_ranges
+
+    def difference(self, other):
+        slot_ranges = self.copy()
+        for first, last in zip(other.firsts, other.lasts):
+            slot_ranges.remove(first, last)
+        return slot_ranges
+
+    def clip(self, first, last):
+        slot_ranges = self.copy()
+        if slot_ranges:
+            slot_ranges.remove(slot_ranges.min(), first - 1)
+        if slot_ranges:
+            slot_ranges.remove(last + 1, slot_ranges.max())
+        return slot_ranges
+
+    def _count(self, i, j):
+        return sum(l - f + 1 for f, l in zip(self.firsts[i:j], self.lasts[i:j]))
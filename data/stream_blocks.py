@@ -0,0 +1,193 @@
+from dotenv import load_dotenv
+
+load_dotenv()
+
+from dataclasses import dataclass, fields, MISSING
+import os
+import json
+import time
+import urllib.parse
+import requests
+
+import http_client
+from block_store import open_block_store
+from fetch_blocks import fetch_block, fetch_block_by_slot, fetch_slots, missed_block
+
+
+EVENTS_PATH = "/eth/v1/events?topics=block,head,chain_reorg"
+HEAD_HEADER_PATH = "/eth/v1/beacon/headers/head"
+# the stream is considered dead if no event arrives for this long, there's at
+# least one head event per slot
+STREAM_READ_TIMEOUT = 60
+RECONNECT_DELAY = 5
+# slots up to this many before the last head seen are fetched again after a
+# disconnect, since they might have been reorged in the meantime
+NUM_BACKFILL_REORG_SLOTS = 32
+
+
+@dataclass
+class Config:
+    BLOCKS_PATH: str
+    CONSENSUS_API_URL: str
+    NUM_BLOCK_FETCH_WORKERS: int = 1
+    NUM_BLOCK_FETCH_RETRIES: int = 3
+    # see fetch_blocks.py
+    BLOCK_FETCH_MODE: str = "full"
+
+    @classmethod
+    def load(cls):
+        values = {}
+        for field in fields(cls):
+            value = os.getenv(field.name)
+            if value is None:
+                if field.default is not MISSING:
+                    continue
+                raise ValueError(f"environment variable {field.name} is not specified")
+            values[field.name] = field.type(value)
+        return cls(**values)
+
+
+# Follows the head of the beacon chain and records the block of each slot in
+# the block store as soon as it becomes head, so that fetch_blocks.py finds the
+# blocks cached by the time the misses are reported.
+#
+# Slots skipped by the head are recorded as missed. This is only valid as long
+# as each head descends from the previous one; if it doesn't, the node sends a
+# chain_reorg event and the affected slots are fetched again by slot. After a
+# disconnect, the slots since the last head are fetched by slot as well.
+def main():
+    config = Config.load()
+    store = open_block_store(config.BLOCKS_PATH, writable=True)
+    try:
+        follower = HeadFollower(config, store)
+        while True:
+            try:
+                follower.follow()
+            except (requests.RequestException, ValueError) as e:
+                print(f"event stream failed ({e}), reconnecting...")
+            time.sleep(RECONNECT_DELAY)
+    finally:
+        store.close()
+
+
+class HeadFollower:
+    def __init__(self, config, store):
+        self.config = config
+        self.store = store
+        self.head_slot = store.get_last_slot()
+        # blocks announced by block events by root, so that they are usually
+        # fetched already when they become head
+        self.blocks_by_root = {}
+
+    # Subscribes to the event stream, backfills the slots missed while not
+    # subscribed and then processes events until the stream ends.
+    def follow(self):
+        url = urllib.parse.urljoin(self.config.CONSENSUS_API_URL, EVENTS_PATH)
+        with http_client.get(
+            url,
+            headers={"Accept": "text/event-stream"},
+            stream=True,
+            timeout=STREAM_READ_TIMEOUT,
+        ) as res:
+            res.raise_for_status()
+            res.encoding = "utf-8"
+            # events arriving meanwhile are buffered by the connection
+            self.backfill()
+            for event, data in read_events(res):
+                if event == "block":
+                    self.on_block(data)
+                elif event == "head":
+                    self.on_head(data)
+                elif event == "chain_reorg":
+                    self.on_chain_reorg(data)
+
+    def backfill(self):
+        head_slot = fetch_head_slot(self.config)
+        if self.head_slot is None:
+            # blocks before the first head are left to fetch_blocks.py
+            self.head_slot = head_slot
+            return
+        from_slot = max(self.head_slot - NUM_BACKFILL_REORG_SLOTS + 1, 0)
+        print(f"backfilling slots {from_slot} to {head_slot}")
+        self.fetch_slots_to_head(from_slot, head_slot)
+
+    def on_block(self, data):
+        slot = int(data["slot"])
+        block = fetch_block(self.config, slot, data["block"])
+        if not block["missed"]:
+            self.blocks_by_root[data["block"]] = block
+
+    def on_head(self, data):
+        slot = int(data["slot"])
+        block = self.blocks_by_root.get(data["block"])
+        if block is None:
+            block = fetch_block(self.config, slot, data["block"])
+            if block["missed"]:
+                # the block is unknown by root already, so look it up by slot
+                block = fetch_block_by_slot(self.config, slot)
+        blocks = [block]
+        if slot > self.head_slot:
+            # skipped slots that are in the store already have been fetched
+            # after a reorg
+            skipped_slots = range(self.head_slot + 1, slot)
+            cached_slots = self.store.get_slots(self.head_slot + 1, slot - 1)
+            blocks += [missed_block(s) for s in skipped_slots if s not in cached_slots]
+            self.head_slot = slot
+        self.store.upsert_blocks(blocks)
+        print(f"recorded head block at slot {slot}")
+        self.blocks_by_root = {
+            root: block
+            for root, block in self.blocks_by_root.items()
+            if block["slot"] > slot
+        }
+
+    def on_chain_reorg(self, data):
+        slot = int(data["slot"])
+        depth = int(data["depth"])
+        print(f"reorg of depth {depth} at slot {slot}, fetching affected slots again")
+        self.store.delete_blocks(slot - depth + 1, max(self.head_slot, slot))
+        self.fetch_slots_to_head(slot - depth + 1, slot)
+
+    # Fetches the slots from from_slot to the new head at head_slot by slot. If
+    # the head moved back, the slots up to the previous head are fetched as
+    # well, so that blocks orphaned there are replaced by misses.
+    def fetch_slots_to_head(self, from_slot, head_slot):
+        to_slot = max(self.head_slot, head_slot)
+        fetch_slots(self.config, self.store, list(range(from_slot, to_slot + 1)))
+        self.head_slot = head_slot
+
+
+def fetch_head_slot(config):
+    url = urllib.parse.urljoin(config.CONSENSUS_API_URL, HEAD_HEADER_PATH)
+    res = http_client.get(url)
+    res.raise_for_status()
+    return int(res.json()["data"]["header"]["message"]["slot"])
+
+
+# Yields the (event, data) pairs of a server-sent events stream.
+def read_events(res):
+    event = None
+    data = []
+    # chunk_size=None hands on lines as they arrive instead of waiting for a
+    # full chunk
+    for line in res.iter_lines(chunk_size=None, decode_unicode=True):
+        if line == "":
+            if len(data) > 0:
+                yield event, json.loads("\n".join(data))
+            event = None
+            data = []
+        elif line.startswith(":"):
+            # comment, e.g. a keep-alive
+            continue
+        else:
+            name, _, value = line.partition(":")
+            if value.startswith(" "):
+                value = value[1:]
+            if name == "event":
+                event = value
+            elif name == "data":
+                data.append(value)
+
+
+if __name__ == "__main__":
+    main()
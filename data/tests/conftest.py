@@ -0,0 +1,73 @@
+import os
+import sys
+import json
+import threading
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+
+import pytest
+
+# the scripts import each other as top-level modules
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import http_client
+
+
+# Each test gets its own HTTP client that retries without waiting.
+@pytest.fixture(autouse=True)
+def client():
+    http_client.client = http_client.HttpClient(http_client.Config(HTTP_BACKOFF=0))
+    yield http_client.client
+    http_client.client = None
+
+
+# Returns a function that starts a local HTTP server and returns its URL. Each
+# request is answered with handle(request), where request has the method, path,
+# query (a dict of lists), headers and the decoded JSON body of the request.
+# handle returns a status code and a body, which is sent as is if it's bytes and
+# as JSON otherwise, and optionally a dict of response headers.
+@pytest.fixture
+def serve():
+    servers = []
+
+    def start(handle):
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                self.respond(None)
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                self.respond(json.loads(self.rfile.read(length)))
+
+            def respond(self, body):
+                url = urllib.parse.urlsplit(self.path)
+                request = SimpleNamespace(
+                    method=self.command,
+                    path=url.path,
+                    query=urllib.parse.parse_qs(url.query),
+                    headers=self.headers,
+                    json=body,
+                )
+                status, data, *headers = handle(request)
+                if not isinstance(data, bytes):
+                    data = json.dumps(data).encode()
+                self.send_response(status)
+                for name, value in (headers[0] if headers else {}).items():
+                    self.send_header(name, value)
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+        server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        threading.Thread(target=server.serve_forever, args=(0.01,), daemon=True).start()
+        servers.append(server)
+        return f"http://127.0.0.1:{server.server_address[1]}/"
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
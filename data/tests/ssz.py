@@ -0,0 +1,176 @@
+# A minimal SSZ serializer following the consensus specs, used to build beacon
+# blocks for tests independently of the fixed offsets fetch_blocks.py reads.
+# Types are described field by field, so offsets and sizes fall out of the
+# schema instead of being written down.
+
+
+class UInt:
+    def __init__(self, num_bits):
+        self.size = num_bits // 8
+
+    def is_fixed_size(self):
+        return True
+
+    def serialize(self, value):
+        return value.to_bytes(self.size, "little")
+
+
+class ByteVector:
+    def __init__(self, length):
+        self.length = length
+
+    def is_fixed_size(self):
+        return True
+
+    def serialize(self, value):
+        if isinstance(value, str):
+            value = bytes.fromhex(value[2:])
+        assert len(value) == self.length
+        return value
+
+
+# Also used for bitlists, whose values are passed with their delimiting bit.
+class ByteList:
+    def __init__(self, limit):
+        self.limit = limit
+
+    def is_fixed_size(self):
+        return False
+
+    def serialize(self, value):
+        assert len(value) <= self.limit
+        return value
+
+
+class List:
+    def __init__(self, element_type, limit):
+        self.element_type = element_type
+        self.limit = limit
+
+    def is_fixed_size(self):
+        return False
+
+    def serialize(self, value):
+        assert len(value) <= self.limit
+        return serialize_sequence([self.element_type] * len(value), value)
+
+
+class Container:
+    def __init__(self, *fields):
+        self.fields = fields
+
+    def is_fixed_size(self):
+        return all(t.is_fixed_size() for _, t in self.fields)
+
+    def serialize(self, value):
+        return serialize_sequence(
+            [t for _, t in self.fields], [value[name] for name, _ in self.fields]
+        )
+
+
+OFFSET_SIZE = 4
+
+
+# Serializes the values of a container or list: the fixed-size parts, with an
+# offset in place of each variable-size value, followed by the variable parts.
+def serialize_sequence(types, values):
+    parts = [t.serialize(v) for t, v in zip(types, values)]
+    fixed_size = sum(
+        len(p) if t.is_fixed_size() else OFFSET_SIZE for t, p in zip(types, parts)
+    )
+    fixed, variable = [], []
+    offset = fixed_size
+    for t, part in zip(types, parts):
+        if t.is_fixed_size():
+            fixed.append(part)
+        else:
+            fixed.append(offset.to_bytes(OFFSET_SIZE, "little"))
+            variable.append(part)
+            offset += len(part)
+    return b"".join(fixed + variable)
+
+
+uint64 = UInt(64)
+uint256 = UInt(256)
+Bytes20 = ByteVector(20)
+Bytes32 = ByteVector(32)
+Bytes96 = ByteVector(96)
+
+Checkpoint = Container(("epoch", uint64), ("root", Bytes32))
+AttestationData = Container(
+    ("slot", uint64),
+    ("index", uint64),
+    ("beacon_block_root", Bytes32),
+    ("source", Checkpoint),
+    ("target", Checkpoint),
+)
+Attestation = Container(
+    ("aggregation_bits", ByteList(2048 // 8 + 1)),
+    ("data", AttestationData),
+    ("signature", Bytes96),
+)
+Eth1Data = Container(
+    ("deposit_root", Bytes32), ("deposit_count", uint64), ("block_hash", Bytes32)
+)
+SyncAggregate = Container(
+    ("sync_committee_bits", ByteVector(512 // 8)),
+    ("sync_committee_signature", Bytes96),
+)
+SignedVoluntaryExit = Container(
+    ("message", Container(("epoch", uint64), ("validator_index", uint64))),
+    ("signature", Bytes96),
+)
+SignedBLSToExecutionChange = Container(
+    (
+        "message",
+        Container(
+            ("validator_index", uint64),
+            ("from_bls_pubkey", ByteVector(48)),
+            ("to_execution_address", Bytes20),
+        ),
+    ),
+    ("signature", Bytes96),
+)
+
+# Capella types. Slashings and deposits are never filled in, so their element
+# types are stand-ins; the list offsets are all that matter for an empty list.
+ExecutionPayloadHeader = Container(
+    ("parent_hash", Bytes32),
+    ("fee_recipient", Bytes20),
+    ("state_root", Bytes32),
+    ("receipts_root", Bytes32),
+    ("logs_bloom", ByteVector(256)),
+    ("prev_randao", Bytes32),
+    ("block_number", uint64),
+    ("gas_limit", uint64),
+    ("gas_used", uint64),
+    ("timestamp", uint64),
+    ("extra_data", ByteList(32)),
+    ("base_fee_per_gas", uint256),
+    ("block_hash", Bytes32),
+    ("transactions_root", Bytes32),
+    ("withdrawals_root", Bytes32),
+)
+BlindedBeaconBlockBody = Container(
+    ("randao_reveal", Bytes96),
+    ("eth1_data", Eth1Data),
+    ("graffiti", Bytes32),
+    ("proposer_slashings", List(Bytes32, 16)),
+    ("attester_slashings", List(Bytes32, 2)),
+    ("attestations", List(Attestation, 128)),
+    ("deposits", List(Bytes32, 16)),
+    ("voluntary_exits", List(SignedVoluntaryExit, 16)),
+    ("sync_aggregate", SyncAggregate),
+    ("execution_payload_header", ExecutionPayloadHeader),
+    ("bls_to_execution_changes", List(SignedBLSToExecutionChange, 16)),
+)
+BlindedBeaconBlock = Container(
+    ("slot", uint64),
+    ("proposer_index", uint64),
+    ("parent_root", Bytes32),
+    ("state_root", Bytes32),
+    ("body", BlindedBeaconBlockBody),
+)
+SignedBlindedBeaconBlock = Container(
+    ("message", BlindedBeaconBlock), ("signature", Bytes96)
+)
@@ -0,0 +1,245 @@
+import json
+
+import ssz
+from block_store import slot_to_time
+
+
+SLOTS_PER_EPOCH = 32
+
+
+# A simulated chain served over the beacon and execution APIs. Slots map to the
+# block records expected in the block store, or None if they are missed. Blocks
+# replaced by a reorg stay known by root, like on a real node. The head is the
+# last slot, unless it's set to an earlier one.
+class StubChain:
+    def __init__(self, first_slot, last_slot, missed_slots=()):
+        self.blocks = {}
+        self.head_slot = None
+        self.blocks_by_root = {}
+        self.finalized_slot = first_slot - 1
+        self.events = []
+        self.paths = []
+        self.fail_once = set()
+        self.num_forks = 0
+        for slot in range(first_slot, last_slot + 1):
+            self.set_block(slot, slot not in missed_slots)
+
+    # Sets the block at slot to a new block, or to a miss if not proposed.
+    def set_block(self, slot, proposed=True):
+        self.head_slot = max(self.head_slot or slot, slot)
+        if not proposed:
+            self.blocks[slot] = None
+            return
+        previous_numbers = [
+            b["block_number"]
+            for s, b in self.blocks.items()
+            if s < slot and b is not None
+        ]
+        root = f"0x{self.num_forks:032x}{slot:032x}"
+        self.blocks[slot] = {
+            "slot": slot,
+            "missed": False,
+            "block_number": max(previous_numbers, default=999) + 1,
+            "block_hash": f"0x{self.num_forks + 1:032x}{slot:032x}",
+            "fee_recipient": f"0x{(slot + self.num_forks) % 5:040x}",
+            "proposer_index": slot * 3 % 1000,
+        }
+        self.blocks_by_root[root] = self.blocks[slot]
+
+    # Replaces the blocks from slot on with a new fork, proposed in new_slots.
+    def reorg(self, slot, new_slots):
+        self.num_forks += 1
+        for s in [s for s in self.blocks if s >= slot]:
+            del self.blocks[s]
+        self.head_slot = max(self.blocks)
+        for s in range(slot, max(new_slots, default=slot - 1) + 1):
+            self.set_block(s, s in new_slots)
+
+    def root(self, slot):
+        block = self.blocks[slot]
+        return next(r for r, b in self.blocks_by_root.items() if b is block)
+
+    # Returns the records expected in the block store for slots s0 to s1.
+    def expected_blocks(self, s0, s1):
+        return [
+            self.blocks.get(slot) or missed_block(slot) for slot in range(s0, s1 + 1)
+        ]
+
+    def add_event(self, event, data):
+        self.events.append(f"event: {event}\ndata: {json.dumps(data)}\n\n")
+
+    def handle(self, request):
+        self.paths.append(request.path)
+        if request.path in self.fail_once:
+            self.fail_once.discard(request.path)
+            return 503, {}
+        if request.method == "POST":
+            return self.handle_rpc(request.json)
+
+        parts = request.path.split("/")
+        if request.path == "/eth/v1/events":
+            return 200, "".join(self.events).encode()
+        if request.path == "/eth/v1/beacon/headers/head":
+            return 200, header(self.head_slot)
+        if request.path == "/eth/v1/beacon/headers/finalized":
+            return 200, header(self.finalized_slot)
+        if request.path.startswith("/eth/v1/validator/duties/proposer/"):
+            epoch = int(parts[-1])
+            slots = range(epoch * SLOTS_PER_EPOCH, (epoch + 1) * SLOTS_PER_EPOCH)
+            duties = [
+                {"slot": str(slot), "validator_index": str(slot * 3 % 1000)}
+                for slot in slots
+            ]
+            return 200, {"data": duties}
+        if request.path.startswith("/eth/v2/beacon/blocks/"):
+            blinded = False
+        elif request.path.startswith("/eth/v1/beacon/blinded_blocks/"):
+            blinded = True
+        else:
+            return 404, {}
+
+        block_id = parts[-1]
+        if block_id.startswith("0x"):
+            block = self.blocks_by_root.get(block_id)
+        else:
+            block = self.blocks.get(int(block_id))
+            if int(block_id) > self.head_slot:
+                block = None
+        if block is None:
+            return 404, {}
+        if request.headers.get("Accept") == "application/octet-stream":
+            return 200, encode_ssz_block(block)
+        return 200, encode_json_block(block, blinded)
+
+    def handle_rpc(self, body):
+        if isinstance(body, list):
+            return 200, [self.call(request) for request in body]
+        return 200, self.call(body)
+
+    def call(self, request):
+        assert request["method"] == "eth_getBlockByNumber"
+        number = request["params"][0]
+        if number == "latest":
+            slot = self.head_slot
+        elif number == "finalized":
+            slot = self.finalized_slot
+        else:
+            slot = None
+            number = int(number, 16)
+        result = None
+        for s, block in sorted(self.blocks.items()):
+            if block is None:
+                continue
+            if (slot is None and block["block_number"] == number) or (
+                slot is not None and s <= slot
+            ):
+                result = {
+                    "number": hex(block["block_number"]),
+                    "hash": block["block_hash"],
+                    "miner": block["fee_recipient"],
+                    "timestamp": hex(slot_to_time(s)),
+                }
+        return {"jsonrpc": "2.0", "id": request["id"], "result": result}
+
+
+def missed_block(slot):
+    return {
+        "slot": slot,
+        "missed": True,
+        "block_number": None,
+        "block_hash": None,
+        "fee_recipient": None,
+        "proposer_index": None,
+    }
+
+
+def header(slot):
+    return {"data": {"header": {"message": {"slot": str(slot)}}}}
+
+
+def encode_json_block(block, blinded):
+    payload = {
+        "block_number": str(block["block_number"]),
+        "block_hash": block["block_hash"],
+        "fee_recipient": block["fee_recipient"],
+    }
+    if blinded:
+        body = {"execution_payload_header": payload}
+    else:
+        body = {"execution_payload": dict(payload, transactions=["0x00"] * 10)}
+    return {
+        "data": {
+            "message": {
+                "slot": str(block["slot"]),
+                "proposer_index": str(block["proposer_index"]),
+                "body": body,
+            }
+        }
+    }
+
+
+# Encodes a signed blinded beacon block as SSZ. Fields that aren't read are
+# filled with junk, with a few attestations and exits so that the execution
+# payload header doesn't come right after the fixed part of the body.
+def encode_ssz_block(block):
+    checkpoint = {"epoch": block["slot"] // SLOTS_PER_EPOCH, "root": b"\x11" * 32}
+    attestation = {
+        "aggregation_bits": b"\xff" * 8 + b"\x01",
+        "data": {
+            "slot": block["slot"] - 1,
+            "index": 0,
+            "beacon_block_root": b"\x22" * 32,
+            "source": checkpoint,
+            "target": checkpoint,
+        },
+        "signature": b"\x33" * 96,
+    }
+    payload_header = {
+        "parent_hash": b"\x44" * 32,
+        "fee_recipient": block["fee_recipient"],
+        "state_root": b"\x55" * 32,
+        "receipts_root": b"\x66" * 32,
+        "logs_bloom": b"\x00" * 256,
+        "prev_randao": b"\x77" * 32,
+        "block_number": block["block_number"],
+        "gas_limit": 30000000,
+        "gas_used": 12345678,
+        "timestamp": slot_to_time(block["slot"]),
+        "extra_data": b"stub builder",
+        "base_fee_per_gas": 10**10,
+        "block_hash": block["block_hash"],
+        "transactions_root": b"\x88" * 32,
+        "withdrawals_root": b"\x99" * 32,
+    }
+    body = {
+        "randao_reveal": b"\xaa" * 96,
+        "eth1_data": {
+            "deposit_root": b"\xbb" * 32,
+            "deposit_count": 1000,
+            "block_hash": b"\xcc" * 32,
+        },
+        "graffiti": b"\x00" * 32,
+        "proposer_slashings": [],
+        "attester_slashings": [],
+        "attestations": [attestation] * 3,
+        "deposits": [],
+        "voluntary_exits": [
+            {"message": {"epoch": 1, "validator_index": 7}, "signature": b"\xdd" * 96}
+        ],
+        "sync_aggregate": {
+            "sync_committee_bits": b"\xff" * 64,
+            "sync_committee_signature": b"\xee" * 96,
+        },
+        "execution_payload_header": payload_header,
+        "bls_to_execution_changes": [],
+    }
+    message = {
+        "slot": block["slot"],
+        "proposer_index": block["proposer_index"],
+        "parent_root": b"\x12" * 32,
+        "state_root": b"\x34" * 32,
+        "body": body,
+    }
+    return ssz.SignedBlindedBeaconBlock.serialize(
+        {"message": message, "signature": b"\x56" * 96}
+    )
@@ -0,0 +1,363 @@
+import random
+from types import SimpleNamespace
+
+import pytest
+
+import aggregate
+import create_builder_leaderboard
+import create_depositor_leaderboard
+import create_lido_leaderboard
+import create_relay_leaderboard
+import dataset
+from block_store import open_block_store, slot_to_time, time_to_slot_ceil
+from relay_store import open_relay_store
+from test_block_store import make_block
+from tx_store import TxStore
+
+
+FIRST_SLOT = 1000
+LAST_SLOT = 1199
+RELAYS = ["a", "b", "c", "d"]
+
+
+# The counting functions of the leaderboard scripts before misses were
+# aggregated on columns, which work on the inputs as they were read from JSON.
+
+
+def count_misses_by_fee_recipient(txs, blocks):
+    fee_recipient_by_block_hash = {
+        block["block_hash"]: block["fee_recipient"] for block in blocks
+    }
+
+    counts = {}
+    for tx in txs:
+        for block in tx["misses"]:
+            block_hash = block["block_hash"]
+            if block_hash not in fee_recipient_by_block_hash:
+                continue
+            fee_recipient = fee_recipient_by_block_hash[block["block_hash"]]
+            counts[fee_recipient] = counts.get(fee_recipient, 0) + 1
+    return counts
+
+
+def compute_builder_market_share(blocks, builders):
+    fee_recipient_to_builder = {}
+    for builder in builders:
+        for fee_recipient in builder["fee_recipients"]:
+            fee_recipient_to_builder[fee_recipient.lower()] = builder["name"]
+
+    blocks_by_builder = {}
+    for block in blocks:
+        fee_recipient = block["fee_recipient"]
+        builder = fee_recipient_to_builder.get(fee_recipient, fee_recipient)
+        blocks_by_builder[builder] = blocks_by_builder.get(builder, 0) + 1
+
+    shares = {
+        builder: num_blocks / len(blocks)
+        for builder, num_blocks in blocks_by_builder.items()
+    }
+    return shares
+
+
+def count_misses_by_validator_index(txs, blocks):
+    validator_index_by_block_hash = {
+        block["block_hash"]: block["proposer_index"] for block in blocks
+    }
+
+    counts = {}
+    for tx in txs:
+        for block in tx["misses"]:
+            block_hash = block["block_hash"]
+            if block_hash not in validator_index_by_block_hash:
+                continue
+            validator_index = validator_index_by_block_hash[block["block_hash"]]
+            counts[validator_index] = counts.get(validator_index, 0) + 1
+    return counts
+
+
+def compute_depositor_market_shares(blocks, validator_pubkeys, depositors):
+    blocks_by_depositor = {}
+    num_missed = 0
+    for block in blocks:
+        if block["missed"]:
+            num_missed += 1
+            continue
+        proposer_index = int(block["proposer_index"])
+        if str(proposer_index) not in validator_pubkeys:
+            continue
+        proposer_pubkey = validator_pubkeys[str(proposer_index)]
+        if proposer_pubkey not in depositors:
+            continue
+        depositor = depositors[proposer_pubkey]
+        blocks_by_depositor[depositor] = blocks_by_depositor.get(depositor, 0) + 1
+
+    shares = {
+        depositor: num_blocks / (len(blocks) - num_missed)
+        for depositor, num_blocks in blocks_by_depositor.items()
+    }
+    return shares
+
+
+def compute_operator_market_shares(blocks, operator_names, operators):
+    blocks_by_operator = {}
+    num_missed = 0
+    for block in blocks:
+        if block["missed"]:
+            num_missed += 1
+            continue
+        proposer_index = int(block["proposer_index"])
+        if proposer_index not in operators:
+            continue
+        operator = operators[proposer_index]
+        blocks_by_operator[operator] = blocks_by_operator.get(operator, 0) + 1
+
+    for operator_name in operator_names.values():
+        if operator_name not in blocks_by_operator:
+            blocks_by_operator[operator_name] = 0
+
+    shares = {
+        operator: num_blocks / (len(blocks) - num_missed)
+        for operator, num_blocks in blocks_by_operator.items()
+    }
+    return shares
+
+
+def count_misses_by_relay(txs, relays):
+    counts = {}
+    for tx in txs:
+        for block in tx["misses"]:
+            try:
+                rs = relays[str(block["slot"])]
+                for relay in rs:
+                    counts[relay] = counts.get(relay, 0) + 1 / len(rs)
+            except KeyError:
+                pass
+    return counts
+
+
+def compute_relay_market_shares(relays):
+    counts = {}
+    for _, rs in relays.items():
+        for relay in rs:
+            counts[relay] = counts.get(relay, 0) + 1 / len(rs)
+    return {relay: count / len(relays) for relay, count in counts.items()}
+
+
+# Blocks with a few fee recipients and proposers, so that many of them tie, and
+# relay data for most slots, some relayed by several relays. Txs are missed by
+# one to three blocks, some also by a block after the last slot of the range.
+@pytest.fixture
+def inputs(tmp_path):
+    rng = random.Random(1)
+    config = dataset.Config(
+        TXS_SEGMENTS_PATH=str(tmp_path / "segments"),
+        BLOCKS_PATH=str(tmp_path / "blocks.db"),
+        RELAYS_PATH=str(tmp_path / "relays.db"),
+        VALIDATOR_PUBKEYS_PATH="",
+        LIDO_OPERATOR_PUBKEYS_PATH="",
+    )
+    fetched_range = (slot_to_time(FIRST_SLOT), slot_to_time(LAST_SLOT))
+    blocks = []
+    for slot in range(FIRST_SLOT, LAST_SLOT + 1):
+        block = make_block(slot, missed=rng.random() < 0.1)
+        if not block["missed"]:
+            block["fee_recipient"] = f"0x{rng.randrange(6):040x}"
+            block["proposer_index"] = rng.randrange(12)
+        blocks.append(block)
+    relays = {}
+    for block in blocks:
+        if rng.random() < 0.8:
+            relays[block["slot"]] = rng.sample(RELAYS, rng.choice([1, 1, 2, 3]))
+    proposed_slots = [block["slot"] for block in blocks if not block["missed"]]
+    txs = []
+    for i in range(150):
+        slots = sorted(rng.sample(proposed_slots, rng.randrange(1, 4)))
+        if i % 10 == 0:
+            slots.append(LAST_SLOT + 1 + rng.randrange(10))
+        misses = [
+            {
+                "slot": slot,
+                "block_hash": make_block(slot)["block_hash"],
+                "proposal_time": slot_to_time(slot),
+            }
+            for slot in slots
+        ]
+        txs.append({"tx_hash": f"0x{i:064x}", "misses": misses})
+    txs.sort(key=lambda tx: tx["misses"][0]["slot"])
+
+    TxStore(config.TXS_SEGMENTS_PATH).add_txs(
+        txs, lambda new_txs, old_txs: new_txs + old_txs
+    )
+    TxStore(config.TXS_SEGMENTS_PATH).write_meta(
+        {"fetched_from": fetched_range[0], "fetched_to": fetched_range[1]}
+    )
+    block_store = open_block_store(config.BLOCKS_PATH, writable=True)
+    relay_store = open_relay_store(config.RELAYS_PATH, writable=True)
+    try:
+        block_store.upsert_blocks(blocks)
+        block_store.set_fetched_range(*fetched_range)
+        relay_store.upsert_relays(relays)
+        relay_store.set_fetched_range(*fetched_range)
+    finally:
+        block_store.close()
+        relay_store.close()
+    return config
+
+
+# Returns the txs, blocks and relays of the dataset that are part of the window
+# starting at window_from, in the form the scripts read them before.
+def get_window_inputs(dataset, window_from):
+    window_slot = time_to_slot_ceil(window_from)
+    txs = [
+        tx
+        for tx in dataset.txs["txs"]
+        if tx["misses"][0]["proposal_time"] >= window_from
+    ]
+    blocks = [
+        block for block in dataset.blocks["blocks"] if block["slot"] >= window_slot
+    ]
+    relays = {
+        str(slot): rs
+        for slot, rs in dataset.relays_by_slot.items()
+        if slot >= window_slot
+    }
+    return txs, blocks, relays
+
+
+def test_leaderboards_match_the_original_scripts(inputs):
+    builders = [
+        {"name": "x", "fee_recipients": [f"0x{0:040x}", f"0x{1:040x}"]},
+        {"name": "y", "fee_recipients": [f"0x{2:040x}"]},
+    ]
+    pubkeys = {index: f"0x{index:096x}" for index in range(12)}
+    depositors = {pubkeys[index]: f"depositor {index % 4}" for index in range(10)}
+    operator_pubkeys = {"0": [pubkeys[0], pubkeys[5]], "1": [pubkeys[1]]}
+    operator_names = {"0": "zero", "1": "one", "2": "two"}
+    config = SimpleNamespace(
+        MIN_BUILDER_MARKET_SHARE=0,
+        MIN_DEPOSITOR_MARKET_SHARE=0,
+        MIN_RELAY_MARKET_SHARE=0,
+    )
+    window_duration = 120 * 12
+    with dataset.Dataset(inputs, windows=[("window", window_duration)]) as d:
+        windows = d.get_windows()
+        assert len(d.txs["txs"]) == 150
+        for window in windows:
+            tallies = window.tallies
+            txs, blocks, relays = get_window_inputs(d, window.fetched_from)
+
+            # misses are listed in the order in which they are first seen
+            misses = count_misses_by_fee_recipient(txs, blocks)
+            assert list(tallies[aggregate.FEE_RECIPIENT].misses.items()) == list(
+                misses.items()
+            )
+            misses = count_misses_by_validator_index(txs, blocks)
+            assert list(tallies[aggregate.PROPOSER_INDEX].misses.items()) == list(
+                misses.items()
+            )
+            misses = count_misses_by_relay(txs, relays)
+            relay_misses = tallies[aggregate.RELAY].misses
+            assert list(relay_misses) == list(misses)
+            assert relay_misses == pytest.approx(misses)
+
+            tally = tallies[aggregate.FEE_RECIPIENT]
+            leaderboard = create_builder_leaderboard.create_builder_leaderboard(
+                config,
+                create_builder_leaderboard.aggregate_misses_by_builder(
+                    tally.misses, builders
+                ),
+                create_builder_leaderboard.compute_builder_market_share(
+                    tally, builders
+                ),
+                window.fetched_from,
+                window.fetched_to,
+            )
+            expected = create_builder_leaderboard.create_builder_leaderboard(
+                config,
+                create_builder_leaderboard.aggregate_misses_by_builder(
+                    count_misses_by_fee_recipient(txs, blocks), builders
+                ),
+                compute_builder_market_share(blocks, builders),
+                window.fetched_from,
+                window.fetched_to,
+            )
+            assert leaderboard == expected
+
+            tally = tallies[aggregate.PROPOSER_INDEX]
+            leaderboard = create_depositor_leaderboard.create_depositor_leaderboard(
+                config,
+                create_depositor_leaderboard.aggregate_misses_by_depositor(
+                    tally.misses, pubkeys, depositors
+                ),
+                create_depositor_leaderboard.compute_depositor_market_shares(
+                    tally, pubkeys, depositors
+                ),
+                window.fetched_from,
+                window.fetched_to,
+            )
+            expected = create_depositor_leaderboard.create_depositor_leaderboard(
+                config,
+                create_depositor_leaderboard.aggregate_misses_by_depositor(
+                    count_misses_by_validator_index(txs, blocks), pubkeys, depositors
+                ),
+                compute_depositor_market_shares(
+                    blocks,
+                    {str(index): pubkey for index, pubkey in pubkeys.items()},
+                    depositors,
+                ),
+                window.fetched_from,
+                window.fetched_to,
+            )
+            assert leaderboard == expected
+
+            operators = create_lido_leaderboard.join_validator_index_with_operator(
+                pubkeys, operator_pubkeys, operator_names, pubkeys.keys()
+            )
+            leaderboard = create_lido_leaderboard.create_operator_leaderboard(
+                config,
+                create_lido_leaderboard.aggregate_misses_by_operator(
+                    tally.misses, pubkeys, operator_names, operators
+                ),
+                create_lido_leaderboard.compute_operator_market_shares(
+                    tally, pubkeys, operator_names, operators
+                ),
+                window.fetched_from,
+                window.fetched_to,
+            )
+            expected = create_lido_leaderboard.create_operator_leaderboard(
+                config,
+                create_lido_leaderboard.aggregate_misses_by_operator(
+                    count_misses_by_validator_index(txs, blocks),
+                    pubkeys,
+                    operator_names,
+                    operators,
+                ),
+                compute_operator_market_shares(blocks, operator_names, operators),
+                window.fetched_from,
+                window.fetched_to,
+            )
+            assert leaderboard == expected
+
+            tally = tallies[aggregate.RELAY]
+            leaderboard = create_relay_leaderboard.create_relay_leaderboard(
+                config,
+                tally.misses,
+                create_relay_leaderboard.compute_relay_market_shares(tally),
+                window.fetched_from,
+                window.fetched_to,
+            )
+            expected = create_relay_leaderboard.create_relay_leaderboard(
+                config,
+                count_misses_by_relay(txs, relays),
+                compute_relay_market_shares(relays),
+                window.fetched_from,
+                window.fetched_to,
+            )
+            rows = leaderboard.pop("relay_leaderboard")
+            expected_rows = expected.pop("relay_leaderboard")
+            assert leaderboard == expected
+            assert [row["relay"] for row in rows] == [
+                row["relay"] for row in expected_rows
+            ]
+            for row, expected_row in zip(rows, expected_rows):
+                assert row == pytest.approx(expected_row)
@@ -0,0 +1,168 @@
+import os
+import json
+import sqlite3
+
+import pytest
+
+import block_store
+from block_store import open_block_store, slot_to_time
+
+
+def make_block(slot, missed=False):
+    if missed:
+        return {
+            "slot": slot,
+            "missed": True,
+            "block_number": None,
+            "block_hash": None,
+            "fee_recipient": None,
+            "proposer_index": None,
+        }
+    return {
+        "slot": slot,
+        "missed": False,
+        "block_number": slot + 1000,
+        "block_hash": f"0x{slot:064x}",
+        "fee_recipient": f"0x{slot % 3:040x}",
+        "proposer_index": slot * 7,
+    }
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = open_block_store(str(tmp_path / "blocks.db"), writable=True)
+    yield store
+    store.close()
+
+
+def test_upsert_and_range_reads(store):
+    blocks = [make_block(slot, missed=slot % 5 == 0) for slot in range(100, 120)]
+    # insertion order doesn't matter
+    store.upsert_blocks(list(reversed(blocks)))
+
+    assert store.get_blocks(100, 119) == blocks
+    assert store.get_blocks(105, 107) == blocks[5:8]
+    assert store.get_blocks(200, 300) == []
+    assert store.get_slots(95, 104) == {100, 101, 102, 103, 104}
+    assert store.get_last_slot() == 119
+    assert store.get_proposer_indices(100, 104) == {
+        slot * 7 for slot in range(101, 105)
+    }
+
+
+def test_upsert_replaces_blocks(store):
+    store.upsert_blocks([make_block(10), make_block(11)])
+    store.upsert_blocks([make_block(11, missed=True)])
+    assert store.get_blocks(10, 11) == [make_block(10), make_block(11, missed=True)]
+
+
+def test_changed_blocks(tmp_path, store):
+    store.upsert_blocks([make_block(slot) for slot in range(10, 20)])
+    version = store.get_version()
+    store.upsert_blocks([make_block(12, missed=True), make_block(15)])
+    assert store.get_version() == version + 1
+    assert store.get_changed_blocks(version, 10, 19) == [
+        make_block(12, missed=True),
+        make_block(15),
+    ]
+    assert store.get_changed_blocks(version, 13, 19) == [make_block(15)]
+    assert store.get_changed_blocks(version + 1, 10, 19) == []
+    assert store.count_slots(10, 14) == 5
+
+    # stores written before blocks were versioned get the column added
+    path = str(tmp_path / "old.db")
+    connection = sqlite3.connect(path)
+    connection.execute(
+        "CREATE TABLE blocks (slot INTEGER PRIMARY KEY, missed INTEGER NOT NULL, block_number INTEGER, block_hash TEXT, fee_recipient TEXT, proposer_index INTEGER)"
+    )
+    connection.execute(
+        "INSERT INTO blocks VALUES (?, ?, ?, ?, ?, ?)",
+        block_store.block_to_row(make_block(10)),
+    )
+    connection.commit()
+    connection.close()
+    old_store = open_block_store(path, writable=True)
+    try:
+        old_store.upsert_blocks([make_block(11)])
+        assert old_store.get_changed_blocks(0, 0, 100) == [make_block(11)]
+        assert old_store.get_blocks(0, 100) == [make_block(10), make_block(11)]
+    finally:
+        old_store.close()
+
+
+def test_delete(store):
+    store.upsert_blocks([make_block(slot) for slot in range(10, 20)])
+    store.delete_blocks(12, 14)
+    assert store.get_slots(10, 19) == {10, 11, 15, 16, 17, 18, 19}
+    store.delete_blocks_before(16)
+    assert store.get_slots(10, 19) == {16, 17, 18, 19}
+    store.delete_blocks(0, 100)
+    assert store.get_last_slot() is None
+
+
+def test_time_range(store):
+    store.upsert_blocks([make_block(slot) for slot in range(10, 20)])
+    # slots are included if their start is within the range
+    t0 = slot_to_time(12) - 1
+    t1 = slot_to_time(15) + 11
+    assert [b["slot"] for b in store.get_blocks_in_time_range(t0, t1)] == [
+        12,
+        13,
+        14,
+        15,
+    ]
+
+
+def test_read_blocks(tmp_path, store):
+    path = str(tmp_path / "blocks.db")
+    store.upsert_blocks([make_block(slot) for slot in range(10, 20)])
+    with pytest.raises(ValueError):
+        block_store.read_blocks(path)
+    store.set_fetched_range(slot_to_time(12), slot_to_time(14))
+
+    assert block_store.read_blocks(path) == {
+        "fetched_from": slot_to_time(12),
+        "fetched_to": slot_to_time(14),
+        "blocks": [make_block(12), make_block(13), make_block(14)],
+    }
+    assert block_store.read_proposer_indices(path) == {12 * 7, 13 * 7, 14 * 7}
+
+
+def test_read_only(tmp_path, store):
+    path = str(tmp_path / "blocks.db")
+    store.upsert_blocks([make_block(10)])
+    reader = open_block_store(path)
+    try:
+        assert reader.get_blocks(10, 10) == [make_block(10)]
+        with pytest.raises(sqlite3.OperationalError):
+            reader.upsert_blocks([make_block(11)])
+    finally:
+        reader.close()
+    with pytest.raises(FileNotFoundError):
+        open_block_store(str(tmp_path / "missing.db"))
+
+
+def test_legacy_json(tmp_path):
+    path = str(tmp_path / "blocks.json")
+    legacy = {
+        "fetched_from": slot_to_time(10),
+        "fetched_to": slot_to_time(11),
+        "blocks": [make_block(10), make_block(11, missed=True)],
+    }
+    with open(path, "w") as f:
+        json.dump(legacy, f)
+
+    # readers read the file as is or refuse to open it, but don't migrate it
+    assert block_store.read_blocks(path) == legacy
+    with pytest.raises(ValueError):
+        open_block_store(path)
+    assert os.listdir(tmp_path) == ["blocks.json"]
+
+    store = open_block_store(path, writable=True)
+    try:
+        assert store.get_blocks(10, 11) == legacy["blocks"]
+        assert store.get_fetched_range() == (slot_to_time(10), slot_to_time(11))
+    finally:
+        store.close()
+    assert sorted(os.listdir(tmp_path)) == ["blocks.json", "blocks.json.bak"]
+    assert block_store.read_blocks(path) == legacy
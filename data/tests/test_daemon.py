@@ -0,0 +1,55 @@
+import pytest
+
+import daemon
+import fetch_validator_pubkeys
+from pubkey_table import create_pubkey_table, open_pubkey_table
+from scheduler import Stage
+from stub_chain import StubChain
+
+
+def test_ticks_without_new_head_are_skipped(serve):
+    chain = StubChain(100, 110)
+    config = daemon.Config(CONSENSUS_API_URL=serve(chain.handle))
+    runs = []
+    fail = []
+
+    def run():
+        runs.append(chain.head_slot)
+        if fail:
+            raise ValueError("stage failed")
+
+    stages = [Stage(name="stage", run=run)]
+
+    assert daemon.run_tick(config, stages, None) == 110
+    # slot 111 is missed
+    assert daemon.run_tick(config, stages, 110) == 110
+    assert runs == [110]
+
+    chain.set_block(112)
+    fail.append(True)
+    assert daemon.run_tick(config, stages, 110) == 110
+    # failed runs are retried in the next tick even if the head didn't move
+    fail.clear()
+    assert daemon.run_tick(config, stages, 110) == 112
+    assert runs == [110, 112, 112]
+
+
+def test_pubkeys_are_not_fetched_twice_at_the_same_head(serve, tmp_path):
+    chain = StubChain(100, 110)
+    config = fetch_validator_pubkeys.Config(
+        CONSENSUS_API_URL=serve(chain.handle),
+        VALIDATOR_PUBKEYS_PATH=str(tmp_path / "pubkeys"),
+        NUM_VALIDATORS_PER_REQUEST=100,
+    )
+    create_pubkey_table(config.VALIDATOR_PUBKEYS_PATH, fetched_at_slot=110)
+    table = open_pubkey_table(config.VALIDATOR_PUBKEYS_PATH, writable=True)
+    try:
+        fetch_validator_pubkeys.fetch_pubkeys(config, table)
+        assert not any("/validators" in path for path in chain.paths)
+        assert table.fetched_at_slot == 110
+
+        chain.head_slot = 109
+        with pytest.raises(ValueError):
+            fetch_validator_pubkeys.fetch_pubkeys(config, table)
+    finally:
+        table.close()
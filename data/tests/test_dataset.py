@@ -0,0 +1,149 @@
+import os
+import json
+
+import pytest
+
+import aggregate
+import dataset
+from block_store import open_block_store, slot_to_time
+from pubkey_table import open_pubkey_table
+from relay_store import open_relay_store
+from test_block_store import make_block
+from tx_store import TxStore
+
+
+FIRST_SLOT = 1000
+LAST_SLOT = 1099
+
+
+# Returns a config of inputs with a miss of one tx in each slot, relayed by one
+# of two relays.
+@pytest.fixture
+def config(tmp_path):
+    config = dataset.Config(
+        TXS_SEGMENTS_PATH=str(tmp_path / "segments"),
+        BLOCKS_PATH=str(tmp_path / "blocks.db"),
+        RELAYS_PATH=str(tmp_path / "relays.db"),
+        VALIDATOR_PUBKEYS_PATH=str(tmp_path / "pubkeys"),
+        LIDO_OPERATOR_PUBKEYS_PATH=str(tmp_path / "operators.json"),
+    )
+    fetched_range = (slot_to_time(FIRST_SLOT), slot_to_time(LAST_SLOT))
+    slots = range(FIRST_SLOT, LAST_SLOT + 1)
+    txs = [
+        {
+            "tx_hash": f"0x{slot:064x}",
+            "misses": [
+                {
+                    "slot": slot,
+                    "block_hash": make_block(slot)["block_hash"],
+                    "proposal_time": slot_to_time(slot),
+                }
+            ],
+        }
+        for slot in slots
+    ]
+    TxStore(config.TXS_SEGMENTS_PATH).add_txs(
+        txs, lambda new_txs, old_txs: new_txs + old_txs
+    )
+    TxStore(config.TXS_SEGMENTS_PATH).write_meta(
+        {"fetched_from": fetched_range[0], "fetched_to": fetched_range[1]}
+    )
+    block_store = open_block_store(config.BLOCKS_PATH, writable=True)
+    relay_store = open_relay_store(config.RELAYS_PATH, writable=True)
+    try:
+        block_store.upsert_blocks([make_block(slot) for slot in slots])
+        block_store.set_fetched_range(*fetched_range)
+        relay_store.upsert_relays({slot: [f"relay{slot % 2}"] for slot in slots})
+        relay_store.set_fetched_range(*fetched_range)
+    finally:
+        block_store.close()
+        relay_store.close()
+    table = open_pubkey_table(config.VALIDATOR_PUBKEYS_PATH, writable=True)
+    table.put({0: "0x" + "11" * 48})
+    table.close()
+    write_operator_pubkeys(config, {"0": ["0x" + "11" * 48]})
+    return config
+
+
+def write_operator_pubkeys(config, operator_pubkeys):
+    with open(config.LIDO_OPERATOR_PUBKEYS_PATH, "w") as f:
+        json.dump(operator_pubkeys, f)
+    touch(config.LIDO_OPERATOR_PUBKEYS_PATH)
+
+
+def set_relays(config, relays):
+    store = open_relay_store(config.RELAYS_PATH, writable=True)
+    try:
+        store.upsert_relays(relays)
+    finally:
+        store.close()
+    touch(config.RELAYS_PATH)
+
+
+# Moves the modification time of the file forward, since a write right after
+# the file has been read may not change it on file systems with coarse
+# timestamps.
+def touch(path):
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+
+
+# Returns the names of the cached properties that have been computed.
+def get_cached(d):
+    return {
+        name
+        for name in d.__dict__
+        if isinstance(getattr(type(d), name, None), dataset.locked_cached_property)
+    }
+
+
+def get_relay_misses(d):
+    return dict(d.tallies[aggregate.RELAY].misses)
+
+
+def test_refresh_drops_only_dependent_properties(config):
+    with dataset.Dataset(config) as d:
+        assert get_relay_misses(d) == {"relay0": 50, "relay1": 50}
+        assert d.validator_pubkeys.get(0) is not None
+        assert d.operator_pubkeys == {"0": ["0x" + "11" * 48]}
+        loaded = get_cached(d)
+        txs = d.txs
+
+        assert d.refresh() == []
+        assert get_cached(d) == loaded
+
+        write_operator_pubkeys(config, {"0": [], "1": []})
+        assert d.refresh() == ["LIDO_OPERATOR_PUBKEYS_PATH"]
+        assert get_cached(d) == loaded - {"operator_pubkeys"}
+        assert d.operator_pubkeys == {"0": [], "1": []}
+
+        set_relays(config, {FIRST_SLOT: ["relay1"]})
+        assert d.refresh() == ["RELAYS_PATH"]
+        assert get_cached(d) == loaded - set(
+            dataset.DEPENDENT_PROPERTIES["RELAYS_PATH"]
+        )
+        assert {"txs", "blocks", "block_columns", "validator_pubkeys"} <= get_cached(d)
+        assert get_relay_misses(d) == {"relay0": 49, "relay1": 51}
+        # the other inputs aren't read again
+        assert d.txs is txs
+        assert d.refresh() == []
+
+
+def test_refresh_ignores_inputs_that_were_not_loaded(config):
+    with dataset.Dataset(config) as d:
+        assert d.operator_pubkeys == {"0": ["0x" + "11" * 48]}
+        set_relays(config, {FIRST_SLOT: ["relay1"]})
+        assert d.refresh() == []
+        assert get_cached(d) == {"operator_pubkeys"}
+
+
+def test_refresh_drops_state_tallies_of_changed_stores(config, tmp_path):
+    state_path = str(tmp_path / "state.db")
+    with dataset.Dataset(config, state_path=state_path) as d:
+        assert get_relay_misses(d) == {"relay0": 50, "relay1": 50}
+        # the state reads the stores itself, but they're still watched
+        assert "relays" not in get_cached(d)
+        set_relays(config, {FIRST_SLOT: ["relay1"]})
+        assert d.refresh() == ["RELAYS_PATH"]
+        assert "window_tallies" not in get_cached(d)
+        assert get_relay_misses(d) == {"relay0": 49, "relay1": 51}
@@ -0,0 +1,40 @@
+import pytest
+
+from execution_client import ExecutionClient, JsonRpcError
+
+
+# Answers each call with its params, or with an error if the method is "fail".
+# Batch responses are returned in reverse order.
+def handle(request):
+    def respond(call):
+        if call["method"] == "fail":
+            return {"jsonrpc": "2.0", "id": call["id"], "error": {"code": -32000}}
+        return {"jsonrpc": "2.0", "id": call["id"], "result": call["params"]}
+
+    if isinstance(request.json, list):
+        if len(request.json) > 3:
+            return 200, {"jsonrpc": "2.0", "error": {"message": "batch too large"}}
+        return 200, [respond(call) for call in reversed(request.json)]
+    return 200, respond(request.json)
+
+
+def test_call(serve):
+    client = ExecutionClient(serve(handle))
+    assert client.call("echo", [1, 2]) == [1, 2]
+    with pytest.raises(JsonRpcError):
+        client.call("fail", [])
+
+
+def test_batch(serve):
+    client = ExecutionClient(serve(handle))
+    assert client.batch([]) == []
+    results = client.batch([("echo", [0]), ("fail", [1]), ("echo", [2])])
+    assert results[0] == [0]
+    assert isinstance(results[1], JsonRpcError)
+    assert results[1].params == [1]
+    assert results[2] == [2]
+
+    # a rejected batch fails each of its calls
+    results = client.batch([("echo", [i]) for i in range(4)])
+    assert len(results) == 4
+    assert all(isinstance(result, JsonRpcError) for result in results)
@@ -0,0 +1,128 @@
+import os
+
+import pytest
+
+import fetch_blocks
+import http_client
+from block_store import open_block_store, slot_to_time
+from stub_chain import StubChain, encode_ssz_block
+from tx_store import TxStore
+
+
+FIRST_SLOT = 1000
+LAST_SLOT = 1100
+MISSED_SLOTS = {1000, 1001, 1037, 1050, 1051, 1052, 1099}
+
+
+@pytest.fixture
+def chain():
+    return StubChain(FIRST_SLOT - 64, LAST_SLOT + 64, MISSED_SLOTS)
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = open_block_store(str(tmp_path / "blocks.db"), writable=True)
+    yield store
+    store.close()
+
+
+def make_config(tmp_path, url, mode):
+    return fetch_blocks.Config(
+        TXS_SEGMENTS_PATH=str(tmp_path / "segments"),
+        BLOCKS_PATH=str(tmp_path / "blocks.db"),
+        CONSENSUS_API_URL=url,
+        EXECUTION_API_URL=url,
+        NUM_BLOCK_FETCH_WORKERS=4,
+        BLOCK_FETCH_MODE=mode,
+    )
+
+
+def test_parse_ssz_block(chain):
+    block = chain.blocks[1002]
+    data = encode_ssz_block(block)
+    assert fetch_blocks.parse_ssz_block(1002, data) == block
+    with pytest.raises(ValueError):
+        fetch_blocks.parse_ssz_block(1003, data)
+    with pytest.raises(ValueError):
+        fetch_blocks.parse_ssz_block(1002, data[:-100])
+
+
+@pytest.mark.parametrize("mode", ["full", "blinded", "ssz", "duties"])
+def test_fetch_blocks(tmp_path, serve, chain, store, mode):
+    config = make_config(tmp_path, serve(chain.handle), mode)
+    # slots outside of the window are expired, slots in it aren't fetched again
+    store.upsert_blocks(chain.expected_blocks(990, 1010))
+    # a failed request is retried
+    chain.fail_once.add("/eth/v2/beacon/blocks/1020")
+    chain.fail_once.add("/eth/v1/beacon/blinded_blocks/1020")
+
+    t0 = slot_to_time(FIRST_SLOT) - 5
+    t1 = slot_to_time(LAST_SLOT) + 5
+    fetch_blocks.fetch_blocks(config, store, t0, t1)
+
+    assert store.get_blocks(0, 10**9) == chain.expected_blocks(FIRST_SLOT, LAST_SLOT)
+    fetched_slots = {
+        int(path.split("/")[-1]) for path in chain.paths if "blocks/" in path
+    }
+    if mode == "duties":
+        assert fetched_slots == set()
+    else:
+        assert sorted(fetched_slots) == list(range(1011, LAST_SLOT + 1))
+
+
+def test_finalized_blocks_are_cached(tmp_path, serve, chain):
+    http_client.client = http_client.HttpClient(
+        http_client.Config(HTTP_BACKOFF=0, HTTP_CACHE_PATH=str(tmp_path / "cache"))
+    )
+    chain.finalized_slot = 1050
+    config = make_config(tmp_path, serve(chain.handle), "full")
+    t0 = slot_to_time(FIRST_SLOT) - 5
+    t1 = slot_to_time(LAST_SLOT) + 5
+
+    # the second run starts with an empty store
+    for path in ["blocks1.db", "blocks2.db"]:
+        chain.paths = []
+        store = open_block_store(str(tmp_path / path), writable=True)
+        try:
+            fetch_blocks.fetch_blocks(config, store, t0, t1)
+            assert store.get_blocks(0, 10**9) == chain.expected_blocks(
+                FIRST_SLOT, LAST_SLOT
+            )
+        finally:
+            store.close()
+
+    # missed slots are fetched again, since a node returns 404 for pruned
+    # blocks as well
+    fetched_slots = {
+        int(path.split("/")[-1]) for path in chain.paths if "blocks/" in path
+    }
+    missed_finalized_slots = {slot for slot in MISSED_SLOTS if slot <= 1050}
+    assert sorted(fetched_slots) == sorted(
+        missed_finalized_slots | set(range(1051, LAST_SLOT + 1))
+    )
+
+
+def test_main_reads_the_range_from_the_tx_segments(tmp_path, serve, monkeypatch):
+    chain = StubChain(FIRST_SLOT - 64, LAST_SLOT + 64, MISSED_SLOTS)
+    monkeypatch.setenv("TXS_SEGMENTS_PATH", str(tmp_path / "segments"))
+    monkeypatch.setenv("BLOCKS_PATH", str(tmp_path / "blocks.db"))
+    monkeypatch.setenv("CONSENSUS_API_URL", serve(chain.handle))
+
+    # nothing to do before txs have been fetched
+    fetch_blocks.main()
+    assert not os.path.exists(tmp_path / "blocks.db")
+
+    t0 = slot_to_time(FIRST_SLOT) - 5
+    t1 = slot_to_time(LAST_SLOT) + 5
+    TxStore(str(tmp_path / "segments")).write_meta(
+        {"fetched_from": t0, "fetched_to": t1}
+    )
+    fetch_blocks.main()
+    store = open_block_store(str(tmp_path / "blocks.db"))
+    try:
+        assert store.get_fetched_range() == (t0, t1)
+        assert store.get_blocks(0, 10**9) == chain.expected_blocks(
+            FIRST_SLOT, LAST_SLOT
+        )
+    finally:
+        store.close()
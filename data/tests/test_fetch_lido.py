@@ -0,0 +1,254 @@
+import json
+import random
+
+import pytest
+import requests
+
+import fetch_lido
+from execution_client import JsonRpcError
+from signing_key_log import SigningKeyLog
+
+
+DEPLOY_BLOCK = fetch_lido.NODE_OPERATORS_REGISTRY_DEPLOY_BLOCK
+MAX_RANGE = 50000
+MAX_RESULTS = 20
+
+
+# Execution node with SigningKeyAdded logs. eth_getLogs rejects ranges of more
+# than MAX_RANGE blocks or with more than MAX_RESULTS logs, like public nodes
+# do. Blocks from fork_block on have a different hash after a reorg. A pending
+# reorg happens at the first eth_getLogs request.
+class StubExecutionNode:
+    def __init__(self, head, logs):
+        self.head = head
+        self.logs = logs
+        self.fork = 0
+        self.fork_block = 0
+        self.log_ranges = []
+        self.pending_reorg = None
+
+    def reorg(self, fork_block, logs):
+        self.fork += 1
+        self.fork_block = fork_block
+        self.logs = [log for log in self.logs if log[0] < fork_block] + logs
+
+    def block_hash(self, block_number):
+        fork = self.fork if block_number >= self.fork_block else 0
+        return f"0x{fork:032x}{block_number:032x}"
+
+    def handle(self, request):
+        if isinstance(request.json, list):
+            return 200, [self.call(call) for call in request.json]
+        return 200, self.call(request.json)
+
+    def call(self, call):
+        method = call["method"]
+        params = call["params"]
+        if method == "eth_blockNumber":
+            result = hex(self.head)
+        elif method == "eth_getBlockByNumber":
+            block_number = int(params[0], 16)
+            result = None
+            if block_number <= self.head:
+                result = {
+                    "number": params[0],
+                    "hash": self.block_hash(block_number),
+                }
+        elif method == "eth_getLogs":
+            if self.pending_reorg is not None:
+                self.reorg(*self.pending_reorg)
+                self.pending_reorg = None
+            from_block = int(params[0]["fromBlock"], 16)
+            to_block = int(params[0]["toBlock"], 16)
+            logs = [
+                make_log(*log, self.block_hash(log[0]))
+                for log in self.logs
+                if from_block <= log[0] <= to_block
+            ]
+            if to_block - from_block + 1 > MAX_RANGE:
+                return error(call, "block range too large")
+            if len(logs) > MAX_RESULTS:
+                return error(call, "too many results")
+            self.log_ranges.append((from_block, to_block + 1))
+            result = logs
+        else:
+            return error(call, "unknown method")
+        return {"jsonrpc": "2.0", "id": call["id"], "result": result}
+
+
+def error(call, message):
+    return {"jsonrpc": "2.0", "id": call["id"], "error": {"message": message}}
+
+
+def make_log(block_number, log_index, operator_id, pubkey, block_hash):
+    pubkey_bytes = bytes.fromhex(pubkey[2:])
+    data = (
+        (32).to_bytes(32, "big")
+        + len(pubkey_bytes).to_bytes(32, "big")
+        + pubkey_bytes
+        + b"\x00" * 16
+    )
+    return {
+        "blockNumber": hex(block_number),
+        "logIndex": hex(log_index),
+        "blockHash": block_hash,
+        "topics": [
+            fetch_lido.SIGNING_KEY_ADDED_TOPIC,
+            "0x" + operator_id.to_bytes(32, "big").hex(),
+        ],
+        "data": "0x" + data.hex(),
+    }
+
+
+# Returns (block number, log index, operator id, pubkey) tuples, with a dense
+# stretch that has more logs than a single request may return.
+def make_logs(from_block, to_block, num_logs, seed):
+    rng = random.Random(seed)
+    block_numbers = [rng.randrange(from_block, to_block) for _ in range(num_logs)]
+    block_numbers += [from_block + 1000 + i // 3 for i in range(MAX_RESULTS * 3)]
+    logs = []
+    for i, block_number in enumerate(sorted(block_numbers)):
+        pubkey = "0x" + rng.randbytes(48).hex()
+        logs.append((block_number, i, rng.randrange(5), pubkey))
+    return logs
+
+
+def get_operator_pubkeys(logs):
+    operator_pubkeys = {}
+    for _, _, operator_id, pubkey in logs:
+        operator_pubkeys.setdefault(str(operator_id), []).append(pubkey)
+    return {
+        operator_id: sorted(pubkeys)
+        for operator_id, pubkeys in operator_pubkeys.items()
+    }
+
+
+def make_config(url, **kwargs):
+    return fetch_lido.Config(
+        LIDO_OPERATOR_PUBKEYS_PATH="",
+        LIDO_SIGNING_KEY_LOG_PATH="",
+        EXECUTION_API_URL=url,
+        NUM_BLOCKS_PER_LOGS_REQUEST=200000,
+        **kwargs,
+    )
+
+
+@pytest.mark.parametrize("num_workers,num_requests_per_batch", [(1, 1), (4, 1), (2, 8)])
+def test_fetch_logs_bisects_rejected_ranges(serve, num_workers, num_requests_per_batch):
+    logs = make_logs(DEPLOY_BLOCK, DEPLOY_BLOCK + 500000, 200, seed=1)
+    node = StubExecutionNode(DEPLOY_BLOCK + 500000, logs)
+    config = make_config(
+        serve(node.handle),
+        NUM_LOGS_REQUEST_WORKERS=num_workers,
+        NUM_LOGS_REQUESTS_PER_BATCH=num_requests_per_batch,
+    )
+    fetch_range = (DEPLOY_BLOCK, DEPLOY_BLOCK + 500000)
+
+    result = fetch_lido.fetch_signing_key_added_logs(config, fetch_range)
+
+    assert [fetch_lido.parse_log(log) for log in result] == [
+        (operator_id, pubkey) for _, _, operator_id, pubkey in logs
+    ]
+    # the successful ranges partition the fetch range
+    ranges = sorted(node.log_ranges)
+    assert ranges[0][0] == fetch_range[0]
+    assert ranges[-1][1] == fetch_range[1]
+    assert all(r1[1] == r2[0] for r1, r2 in zip(ranges, ranges[1:]))
+
+
+@pytest.mark.parametrize(
+    "status,body,error_type",
+    [
+        (401, {}, requests.HTTPError),
+        (503, {}, requests.HTTPError),
+        (200, b"<html>", ValueError),
+        (
+            200,
+            {"jsonrpc": "2.0", "id": 0, "error": {"message": "unauthorized"}},
+            JsonRpcError,
+        ),
+    ],
+)
+def test_fetch_logs_raises_other_errors(serve, status, body, error_type):
+    num_requests = []
+
+    def handle(request):
+        num_requests.append(1)
+        return status, body
+
+    config = make_config(serve(handle))
+    fetch_range = (DEPLOY_BLOCK, DEPLOY_BLOCK + 500000)
+    with pytest.raises(error_type):
+        fetch_lido.fetch_signing_key_added_logs(config, fetch_range)
+    # the range isn't split, only retried by the HTTP client for a 503
+    assert len(num_requests) == (4 if status == 503 else 1)
+
+
+def test_main_rolls_back_reorged_blocks(tmp_path, serve, monkeypatch):
+    head = DEPLOY_BLOCK + 350000
+    logs = make_logs(DEPLOY_BLOCK, head, 100, seed=2)
+    node = StubExecutionNode(head, logs)
+    pubkeys_path = str(tmp_path / "operators.json")
+    log_path = str(tmp_path / "signing_key_log")
+    monkeypatch.setenv("LIDO_OPERATOR_PUBKEYS_PATH", pubkeys_path)
+    monkeypatch.setenv("LIDO_SIGNING_KEY_LOG_PATH", log_path)
+    monkeypatch.setenv("EXECUTION_API_URL", serve(node.handle))
+    monkeypatch.setenv("NUM_BLOCKS_PER_LOGS_REQUEST", "100000")
+
+    def read_operator_pubkeys():
+        with open(pubkeys_path) as f:
+            return json.load(f)["operator_pubkeys"]
+
+    # logs in the last REORG_DELAY blocks aren't fetched yet
+    fetch_lido.main()
+    fetched_logs = [log for log in logs if log[0] < head + 1 - fetch_lido.REORG_DELAY]
+    assert read_operator_pubkeys() == get_operator_pubkeys(fetched_logs)
+
+    # replace the last 50 blocks by a fork with other logs and move on
+    fork_block = head - 50
+    new_logs = make_logs(fork_block, fork_block + 100, 5, seed=3)
+    new_logs = [(b, i + 1000, o, p) for b, i, o, p in new_logs if b < fork_block + 100]
+    node.reorg(fork_block, new_logs)
+    node.head += 200
+    node.log_ranges = []
+    fetch_lido.main()
+
+    assert read_operator_pubkeys() == get_operator_pubkeys(node.logs)
+    # only blocks after the last canonical checkpoint are fetched again
+    checkpoint = fork_block - fork_block % fetch_lido.NUM_BLOCKS_PER_CHECKPOINT
+    assert min(r[0] for r in node.log_ranges) == checkpoint
+    log = SigningKeyLog(log_path)
+    assert [
+        (e["block_number"], e["log_index"], e["operator_id"], e["pubkey"])
+        for e in log.read_events()
+    ] == node.logs
+    # checkpoints of earlier runs are only kept at boundaries
+    end = node.head + 1 - fetch_lido.REORG_DELAY
+    boundaries = list(range(11500000, end, fetch_lido.NUM_BLOCKS_PER_CHECKPOINT))
+    assert [c["block_number"] for c in log.checkpoints] == boundaries + [end]
+
+
+def test_main_fails_on_reorg_while_fetching(tmp_path, serve, monkeypatch):
+    head = DEPLOY_BLOCK + 150000
+    logs = make_logs(DEPLOY_BLOCK, head, 50, seed=4)
+    node = StubExecutionNode(head, logs)
+    pubkeys_path = str(tmp_path / "operators.json")
+    log_path = str(tmp_path / "signing_key_log")
+    monkeypatch.setenv("LIDO_OPERATOR_PUBKEYS_PATH", pubkeys_path)
+    monkeypatch.setenv("LIDO_SIGNING_KEY_LOG_PATH", log_path)
+    monkeypatch.setenv("EXECUTION_API_URL", serve(node.handle))
+    monkeypatch.setenv("NUM_BLOCKS_PER_LOGS_REQUEST", "100000")
+
+    # the blocks at the end of the range are replaced after the checkpoints
+    # have been taken
+    fork_block = head - 50
+    node.pending_reorg = (fork_block, [(fork_block, 5000, 1, "0x" + "ab" * 48)])
+    with pytest.raises(ValueError):
+        fetch_lido.main()
+    assert not (tmp_path / "operators.json").exists()
+    assert SigningKeyLog(log_path).checkpoints == []
+
+    fetch_lido.main()
+    with open(pubkeys_path) as f:
+        operator_pubkeys = json.load(f)["operator_pubkeys"]
+    assert operator_pubkeys == get_operator_pubkeys(node.logs)
@@ -0,0 +1,112 @@
+import json
+
+import pytest
+
+import fetch_relays
+import relay_store
+
+
+PAGE_SIZE = 10
+
+
+# Serves the payloads delivered by a relay in pages of PAGE_SIZE slots, going
+# back from the cursor. After num_pages_before_failure pages, requests fail.
+class StubRelay:
+    def __init__(self, slots):
+        self.slots = sorted(slots, reverse=True)
+        self.cursors = []
+        self.num_pages_before_failure = None
+
+    def handle(self, request):
+        if len(self.cursors) == self.num_pages_before_failure:
+            return 500, {}
+        cursor = int(request.query["cursor"][0])
+        self.cursors.append(cursor)
+        page = [slot for slot in self.slots if slot <= cursor][:PAGE_SIZE]
+        return 200, [{"slot": str(slot)} for slot in page]
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = relay_store.open_relay_store(str(tmp_path / "relays.db"), writable=True)
+    yield store
+    store.close()
+
+
+def fetch(store, relay_apis):
+    fetch_relays.fetch_relays(store, range(100, 200), relay_apis)
+    return store.get_relays(0, 1000)
+
+
+def test_coverage_after_partial_failure(serve, store):
+    a = StubRelay(range(100, 200, 3))
+    b = StubRelay(range(100, 200, 2))
+    b.num_pages_before_failure = 2
+    relay_apis = [
+        {"name": "a", "url": serve(a.handle)},
+        {"name": "b", "url": serve(b.handle)},
+    ]
+
+    relays = fetch(store, relay_apis)
+    # the pages of b fetched before the failure are kept
+    assert store.get_coverage() == {"a": [[100, 199]], "b": [[160, 199]]}
+    for slot in range(100, 200):
+        expected = []
+        if slot % 3 == 1:
+            expected.append("a")
+        if slot % 2 == 0 and slot >= 160:
+            expected.append("b")
+        assert relays[slot] == expected
+
+    # the next run only fetches the slots b hasn't confirmed yet and only
+    # writes the slots b delivered
+    a.cursors = []
+    b.cursors = []
+    b.num_pages_before_failure = None
+    version = store.get_version()
+    relays = fetch(store, relay_apis)
+    assert a.cursors == []
+    assert b.cursors == [159, 139, 119]
+    assert store.get_coverage() == {"a": [[100, 199]], "b": [[100, 199]]}
+    changed_slots = store.get_changed_relays(version, 0, 1000).keys()
+    assert sorted(changed_slots) == list(range(100, 160, 2))
+    for slot in range(100, 200):
+        expected = []
+        if slot % 3 == 1:
+            expected.append("a")
+        if slot % 2 == 0:
+            expected.append("b")
+        assert relays[slot] == expected
+
+    # slots that expired or left the block store are dropped
+    fetch_relays.fetch_relays(store, [151, 152], relay_apis)
+    assert store.get_relays(0, 1000) == {151: ["a"], 152: ["b"]}
+
+
+def test_migrate_legacy_json(serve, tmp_path):
+    a = StubRelay(range(100, 200, 3))
+    relay_apis = [{"name": "a", "url": serve(a.handle)}]
+    path = str(tmp_path / "relays.json")
+    legacy_relays = {str(slot): ["a"] if slot == 91 else [] for slot in range(90, 150)}
+    with open(path, "w") as f:
+        json.dump(
+            {"fetched_from": 1000, "fetched_to": 2000, "relays": legacy_relays}, f
+        )
+    # readers read the legacy file as is
+    assert relay_store.read_relays(path)["relays"] == legacy_relays
+
+    relay_store.migrate_legacy_json(path, ["a"])
+    store = relay_store.open_relay_store(path, writable=True)
+    try:
+        # files without coverage are considered fetched for all relays
+        assert store.get_coverage() == {"a": [[90, 149]]}
+        assert store.get_fetched_range() == (1000, 2000)
+        relays = fetch(store, relay_apis)
+        assert a.cursors == [199, 171]
+        assert store.get_coverage() == {"a": [[100, 199]]}
+        # covered slots keep their relays, the others are fetched
+        assert relays[100] == []
+        assert relays[172] == ["a"]
+        assert 91 not in relays
+    finally:
+        store.close()
@@ -0,0 +1,121 @@
+import os
+import random
+
+import pytest
+
+import fetch_txs
+from tx_store import TxStore
+
+
+T0 = 1_700_000_000
+PAGE_SIZE = 50
+
+
+# Serves txs in pages of PAGE_SIZE, ordered by their first proposal time and
+# hash. Incomplete pages return a cursor of the last tx to continue from.
+class StubMonitor:
+    def __init__(self, txs):
+        self.txs = sorted(txs, key=get_key)
+        self.requests = []
+
+    def handle(self, request):
+        query = {name: values[0] for name, values in request.query.items()}
+        self.requests.append(query)
+        from_time, _, from_hash = query["from"].partition(",")
+        to_time = int(query["to"])
+        items = [
+            tx
+            for tx in self.txs
+            if get_key(tx) > (int(from_time), from_hash) and get_key(tx)[0] < to_time
+        ]
+        page = items[:PAGE_SIZE]
+        complete = len(items) <= PAGE_SIZE
+        if complete:
+            to = query["to"]
+        else:
+            to = f"{get_key(page[-1])[0]},{get_key(page[-1])[1]}"
+        return 200, {"items": page, "complete": complete, "to": to}
+
+
+def get_key(tx):
+    return (tx["misses"][0]["proposal_time"], tx["tx_hash"])
+
+
+def make_txs(num_txs):
+    rng = random.Random(1)
+    txs = []
+    for i in range(num_txs):
+        t = T0 + rng.randrange(0, 24 * 60 * 60)
+        txs.append({"tx_hash": f"0x{i:064x}", "misses": [{"proposal_time": t}]})
+    # txs at the boundaries of the shards
+    for i, t in enumerate([T0 + 6 * 60 * 60, T0 + 12 * 60 * 60, T0 + 12 * 60 * 60]):
+        txs.append(
+            {"tx_hash": f"0x{num_txs + i:064x}", "misses": [{"proposal_time": t}]}
+        )
+    return txs
+
+
+@pytest.mark.parametrize("num_shards", [1, 4, 7])
+def test_sharded_fetch(serve, num_shards):
+    monitor = StubMonitor(make_txs(500))
+    config = fetch_txs.Config(
+        ECM_API_URL=serve(monitor.handle),
+        DELAY=0,
+        MIN_NUM_MISSES=2,
+        PROPAGATION_TIME=60,
+        TXS_SEGMENTS_PATH="",
+        INTERVAL=0,
+        NUM_TX_FETCH_SHARDS=num_shards,
+    )
+    txs = fetch_txs.fetch_txs(config, T0, T0 + 24 * 60 * 60)
+    assert sorted(txs, key=get_key) == monitor.txs
+    # each shard starts paging at its own bound
+    shards = fetch_txs.split_fetch_range(T0, T0 + 24 * 60 * 60, num_shards)
+    assert len(shards) == num_shards
+    first_froms = [r["from"] for r in monitor.requests if "," not in r["from"]]
+    assert sorted(first_froms) == sorted(str(shard[0]) for shard in shards)
+
+
+def test_main(tmp_path, serve, monkeypatch):
+    monitor = StubMonitor(make_txs(500))
+    segments_path = tmp_path / "segments"
+    monkeypatch.setenv("ECM_API_URL", serve(monitor.handle))
+    monkeypatch.setenv("DELAY", "0")
+    monkeypatch.setenv("MIN_NUM_MISSES", "2")
+    monkeypatch.setenv("PROPAGATION_TIME", "60")
+    monkeypatch.setenv("TXS_SEGMENTS_PATH", str(segments_path))
+    monkeypatch.setenv("INTERVAL", str(12 * 60 * 60))
+    monkeypatch.setattr(fetch_txs, "now", lambda: T0 + 18 * 60 * 60)
+
+    fetch_txs.main()
+    store = TxStore(str(segments_path))
+    assert store.read_meta() == {
+        "fetched_from": T0 + 6 * 60 * 60,
+        "fetched_to": T0 + 18 * 60 * 60,
+        "propagation_time": 60,
+        "min_num_misses": 2,
+    }
+    expected_txs = [
+        tx
+        for tx in monitor.txs
+        if T0 + 6 * 60 * 60 <= tx["misses"][0]["proposal_time"] < T0 + 18 * 60 * 60
+    ]
+    assert sorted(store.read_txs(T0 + 6 * 60 * 60), key=get_key) == expected_txs
+
+    # the next run only fetches the new part of the interval and only writes
+    # the segments it falls into
+    monkeypatch.setattr(fetch_txs, "now", lambda: T0 + 20 * 60 * 60)
+    mtimes = {
+        start: os.stat(store.get_segment_path(start)).st_mtime_ns
+        for start in store.get_segment_starts()
+    }
+    monitor.requests = []
+    fetch_txs.main()
+    assert monitor.requests[0]["from"] == str(T0 + 18 * 60 * 60)
+    changed_starts = [
+        start
+        for start in store.get_segment_starts()
+        if os.stat(store.get_segment_path(start)).st_mtime_ns != mtimes.get(start)
+    ]
+    assert all(start >= T0 + 18 * 60 * 60 - 60 * 60 for start in changed_starts)
+    assert os.listdir(tmp_path) == ["segments"]
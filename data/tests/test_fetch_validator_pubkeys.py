@@ -0,0 +1,148 @@
+import threading
+
+import pytest
+
+import fetch_validator_pubkeys
+from block_store import open_block_store, slot_to_time
+from pubkey_table import PUBKEY_SIZE, open_pubkey_table
+from stub_chain import StubChain
+
+
+def make_pubkey(index):
+    return "0x" + (index + 1).to_bytes(PUBKEY_SIZE, "big").hex()
+
+
+# Serves the validator set of a stub chain, which has num_validators validators.
+# Ids are passed in the query string for GET requests and in the body for POST
+# requests. If a barrier is set, each request waits for the others of the same
+# round, so requests that aren't made concurrently fail.
+class StubValidators:
+    def __init__(self, chain, num_validators):
+        self.chain = chain
+        self.num_validators = num_validators
+        self.requests = []
+        self.barrier = None
+        self.lock = threading.Lock()
+
+    def handle(self, request):
+        if not request.path.endswith("/validators"):
+            return self.chain.handle(request)
+        if request.method == "POST":
+            ids = request.json["ids"]
+        else:
+            ids = request.query["id"]
+        indices = [int(i) for i in ids]
+        with self.lock:
+            self.requests.append((request.method, request.path, indices))
+        if self.barrier is not None:
+            self.barrier.wait(timeout=5)
+        validators = [
+            {"index": str(i), "validator": {"pubkey": make_pubkey(i)}}
+            for i in indices
+            if i < self.num_validators
+        ]
+        return 200, {"data": validators}
+
+
+def make_config(tmp_path, url, **kwargs):
+    return fetch_validator_pubkeys.Config(
+        CONSENSUS_API_URL=url,
+        VALIDATOR_PUBKEYS_PATH=str(tmp_path / "pubkeys"),
+        NUM_VALIDATORS_PER_REQUEST=10,
+        **kwargs,
+    )
+
+
+@pytest.mark.parametrize("method", ["get", "post"])
+def test_fetch_pubkeys(tmp_path, serve, method):
+    validators = StubValidators(StubChain(100, 110), 95)
+    config = make_config(
+        tmp_path,
+        serve(validators.handle),
+        VALIDATOR_FETCH_METHOD=method,
+        NUM_VALIDATOR_FETCH_WORKERS=3,
+    )
+    validators.barrier = threading.Barrier(3)
+
+    table = open_pubkey_table(config.VALIDATOR_PUBKEYS_PATH, writable=True)
+    try:
+        fetch_validator_pubkeys.fetch_pubkeys(config, table)
+        assert list(table.items()) == [(i, make_pubkey(i)) for i in range(95)]
+        assert table.fetched_at_slot == 110
+        # batches are requested in rounds of three until one is incomplete
+        assert {r[0] for r in validators.requests} == {method.upper()}
+        assert {r[1] for r in validators.requests} == {
+            "/eth/v1/beacon/states/110/validators"
+        }
+        assert sorted(r[2] for r in validators.requests) == [
+            list(range(start, start + 10)) for start in range(0, 120, 10)
+        ]
+
+        # only new validators are fetched at a later head
+        validators.chain.set_block(111)
+        validators.num_validators = 101
+        validators.requests = []
+        fetch_validator_pubkeys.fetch_pubkeys(config, table)
+        assert list(table.items()) == [(i, make_pubkey(i)) for i in range(101)]
+        assert table.fetched_at_slot == 111
+        assert sorted(r[2] for r in validators.requests) == [
+            list(range(start, start + 10)) for start in range(95, 125, 10)
+        ]
+    finally:
+        table.close()
+
+
+def test_fetch_validator_batch_rejects_unknown_methods(tmp_path, serve):
+    validators = StubValidators(StubChain(100, 110), 10)
+    config = make_config(
+        tmp_path, serve(validators.handle), VALIDATOR_FETCH_METHOD="put"
+    )
+    with pytest.raises(ValueError):
+        fetch_validator_pubkeys.fetch_validator_batch(
+            config, config.CONSENSUS_API_URL, [0]
+        )
+    assert validators.requests == []
+
+
+def test_fetch_proposer_pubkeys(tmp_path, serve):
+    chain = StubChain(100, 130, missed_slots={105})
+    validators = StubValidators(chain, 400)
+    config = make_config(
+        tmp_path,
+        serve(validators.handle),
+        VALIDATOR_FETCH_METHOD="post",
+        NUM_VALIDATOR_FETCH_WORKERS=2,
+        BLOCKS_PATH=str(tmp_path / "blocks.db"),
+    )
+    store = open_block_store(config.BLOCKS_PATH, writable=True)
+    try:
+        store.upsert_blocks(chain.expected_blocks(100, 130))
+        store.set_fetched_range(slot_to_time(100) - 5, slot_to_time(130) + 5)
+    finally:
+        store.close()
+    proposers = [block["proposer_index"] for block in chain.expected_blocks(100, 130)]
+    proposers = sorted(i for i in proposers if i is not None)
+
+    table = open_pubkey_table(config.VALIDATOR_PUBKEYS_PATH, writable=True)
+    try:
+        # known pubkeys aren't fetched again
+        table.put({proposers[0]: make_pubkey(proposers[0])})
+        fetch_validator_pubkeys.fetch_proposer_pubkeys(config, table)
+        assert list(table.items()) == [(i, make_pubkey(i)) for i in proposers]
+        assert sorted(r[2] for r in validators.requests) == [
+            proposers[1:11],
+            proposers[11:21],
+            proposers[21:],
+        ]
+        validators.requests = []
+        fetch_validator_pubkeys.fetch_proposer_pubkeys(config, table)
+        assert validators.requests == []
+
+        # the table is sparse, so the whole set is still fetched in the "all"
+        # mode at the same head
+        assert table.fetched_at_slot == 0
+        fetch_validator_pubkeys.fetch_pubkeys(config, table)
+        assert list(table.items()) == [(i, make_pubkey(i)) for i in range(400)]
+        assert table.fetched_at_slot == 130
+    finally:
+        table.close()
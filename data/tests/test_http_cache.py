@@ -0,0 +1,123 @@
+import os
+import itertools
+import zlib
+
+import pytest
+
+import http_cache
+from http_cache import ResponseCache, get_key, make_response
+from http_client import Config, HttpClient
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    ticks = itertools.count(1000)
+    monkeypatch.setattr(http_cache.time, "time", lambda: next(ticks))
+
+
+def test_keys_are_normalized():
+    url = "https://Node.Example.com/eth/v1/validators?b=2&a=1"
+    key = get_key("GET", url)
+    assert get_key("GET", "https://node.example.com/eth/v1/validators?a=1&b=2") == key
+    assert (
+        get_key(
+            "GET", "https://node.example.com/eth/v1/validators", params={"b": 2, "a": 1}
+        )
+        == key
+    )
+    assert get_key("GET", url, headers={"User-Agent": "x"}) == key
+    assert get_key("GET", url + "#fragment") == key
+
+    assert get_key("POST", url) != key
+    assert get_key("GET", url.replace("a=1", "a=3")) != key
+    assert get_key("GET", url.replace("validators", "Validators")) != key
+    assert get_key("GET", url, headers={"Accept": "application/octet-stream"}) != key
+    assert get_key(
+        "GET", url, headers={"accept": "application/octet-stream"}
+    ) == get_key("GET", url, headers={"Accept": "application/octet-stream"})
+
+    # JSON bodies are compared by value, other bodies as they are
+    body_key = get_key("POST", url, json={"ids": ["1", "2"], "method": "m"})
+    assert get_key("POST", url, json={"method": "m", "ids": ["1", "2"]}) == body_key
+    assert get_key("POST", url, json={"ids": ["2", "1"], "method": "m"}) != body_key
+    assert get_key("POST", url, data=b"\x00\x01") != get_key("POST", url, data=b"\x01")
+    assert get_key("POST", url, data="a=1") == get_key("POST", url, data={"a": "1"})
+
+
+def test_responses_round_trip(tmp_path):
+    path = str(tmp_path / "cache.db")
+    cache = ResponseCache(path, 10**6)
+    content = b'{"data": [' + b'"0x00", ' * 1000 + b'"0x01"]}'
+    res = make_response("http://node/a", 200, "application/json", content)
+    cache.put("a", res)
+    cache.put("b", make_response("http://node/b", 404, None, b""))
+    cache.close()
+
+    cache = ResponseCache(path, 10**6)
+    try:
+        cached = cache.get("a", "http://node/a")
+        assert cached.status_code == 200
+        assert cached.url == "http://node/a"
+        assert cached.headers["Content-Type"] == "application/json"
+        assert cached.content == content
+        assert cached.json()["data"][-1] == "0x01"
+        cached = cache.get("b", "http://node/b")
+        assert cached.status_code == 404
+        assert cached.content == b""
+        assert "Content-Type" not in cached.headers
+        assert cache.get("c", "http://node/c") is None
+        # responses are stored compressed
+        assert cache.size == len(zlib.compress(content)) + len(zlib.compress(b""))
+        assert cache.size < len(content) / 10
+    finally:
+        cache.close()
+
+
+def test_least_recently_used_responses_are_evicted(tmp_path, clock):
+    contents = {key: os.urandom(100) for key in "abcdef"}
+    size = len(zlib.compress(contents["a"]))
+    cache = ResponseCache(str(tmp_path / "cache.db"), 4 * size)
+    try:
+
+        def put(key):
+            cache.put(key, make_response("http://node", 200, None, contents[key]))
+
+        def get_cached_keys():
+            return [key for key in "abcdef" if cache.get(key, "http://node")]
+
+        for key in "abcd":
+            put(key)
+        # replacing a response doesn't count twice
+        put("a")
+        assert cache.size == 4 * size
+        cache.get("b", "http://node")
+        put("e")
+        # the cache is shrunk to 90%, i.e., 3 responses
+        assert cache.size == 3 * size
+        assert get_cached_keys() == ["a", "b", "e"]
+    finally:
+        cache.close()
+
+
+def test_client_caches_final_responses(tmp_path, serve):
+    calls = []
+
+    def handle(request):
+        calls.append(request.path)
+        if request.path == "/missing":
+            return 404, {}
+        return 200, {"path": request.path}
+
+    url = serve(handle)
+    client = HttpClient(
+        Config(HTTP_BACKOFF=0, HTTP_CACHE_PATH=str(tmp_path / "cache.db"))
+    )
+    for _ in range(2):
+        assert client.get(url + "final", cache=True).json() == {"path": "/final"}
+        assert client.get(url + "head").json() == {"path": "/head"}
+        assert client.get(url + "missing", cache=True).status_code == 404
+        res = client.get(url + "checked", cache=lambda res: res.json()["path"] == "")
+        assert res.json() == {"path": "/checked"}
+    # only responses that cache accepts are served from the cache later on
+    assert calls[:4] == ["/final", "/head", "/missing", "/checked"]
+    assert calls[4:] == ["/head", "/missing", "/checked"]
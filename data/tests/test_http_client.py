@@ -0,0 +1,170 @@
+import time
+import socket
+import threading
+from email.utils import format_datetime
+from datetime import datetime, timedelta, timezone
+
+import pytest
+import requests
+
+import http_client
+from http_client import HttpClient, TokenBucket
+
+
+def make_client(**kwargs):
+    return HttpClient(http_client.Config(**{"HTTP_BACKOFF": 0, **kwargs}))
+
+
+# Returns a handler that answers with the given responses in turn, and the list
+# of the times it was called at.
+def respond_with(*responses):
+    responses = list(responses)
+    calls = []
+
+    def handle(request):
+        calls.append(time.monotonic())
+        response = responses.pop(0) if len(responses) > 1 else responses[0]
+        if callable(response):
+            return response()
+        return response
+
+    return handle, calls
+
+
+def test_transient_errors_are_retried(serve):
+    handle, calls = respond_with((503, {}), (502, {}), (200, {"ok": True}))
+    res = make_client().get(serve(handle))
+    assert res.status_code == 200
+    assert res.json() == {"ok": True}
+    assert len(calls) == 3
+
+
+def test_last_failed_response_is_returned(serve):
+    handle, calls = respond_with((500, {}))
+    res = make_client(HTTP_NUM_RETRIES=2).get(serve(handle))
+    assert res.status_code == 500
+    assert len(calls) == 3
+
+    # retries can be set per request
+    calls.clear()
+    res = make_client().get(serve(handle), num_retries=0)
+    assert len(calls) == 1
+
+
+def test_other_errors_are_not_retried(serve):
+    handle, calls = respond_with((404, {}), (200, {}))
+    res = make_client().post(serve(handle), json={"id": 1})
+    assert res.status_code == 404
+    assert len(calls) == 1
+
+
+def test_timeouts_are_retried(serve):
+    def hang():
+        time.sleep(0.5)
+        return 200, {"late": True}
+
+    handle, calls = respond_with(hang, (200, {"late": False}))
+    res = make_client(HTTP_TIMEOUT=0.2).get(serve(handle))
+    assert res.json() == {"late": False}
+    assert len(calls) == 2
+
+    handle, calls = respond_with(hang)
+    with pytest.raises(requests.Timeout):
+        make_client(HTTP_TIMEOUT=0.2, HTTP_NUM_RETRIES=1).get(serve(handle))
+    assert len(calls) == 2
+
+
+def test_connection_errors_are_raised_after_retrying():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    with pytest.raises(requests.ConnectionError):
+        make_client(HTTP_NUM_RETRIES=1).get(f"http://127.0.0.1:{port}/")
+
+
+def test_retry_after_pauses_the_host(serve):
+    handle, calls = respond_with((429, {}, {"Retry-After": "0.3"}), (200, {}))
+    url = serve(handle)
+    client = make_client()
+    results = []
+
+    def get():
+        results.append(client.get(url).status_code)
+
+    start = time.monotonic()
+    first = threading.Thread(target=get)
+    first.start()
+    while len(calls) == 0:
+        time.sleep(0.01)
+    # a request to the same host waits for the pause as well
+    time.sleep(0.05)
+    get()
+    first.join()
+
+    assert results == [200, 200]
+    assert len(calls) == 3
+    assert calls[0] - start < 0.2
+    assert calls[1] - calls[0] >= 0.29
+    assert calls[2] - calls[0] >= 0.29
+
+
+def test_long_retry_after_is_not_waited_for(serve):
+    handle, calls = respond_with((503, {}, {"Retry-After": "120"}), (200, {}))
+    res = make_client(HTTP_MAX_BACKOFF=60).get(serve(handle))
+    assert res.status_code == 503
+    assert len(calls) == 1
+
+
+def test_get_retry_after():
+    def make_response(value):
+        res = requests.Response()
+        if value is not None:
+            res.headers["Retry-After"] = value
+        return res
+
+    assert http_client.get_retry_after(make_response(None)) is None
+    assert http_client.get_retry_after(make_response("2.5")) == 2.5
+    assert http_client.get_retry_after(make_response("-1")) == 0
+    assert http_client.get_retry_after(make_response("soon")) is None
+    retry_at = datetime.now(timezone.utc) + timedelta(seconds=30)
+    delay = http_client.get_retry_after(make_response(format_datetime(retry_at)))
+    assert 25 < delay <= 30
+    retry_at = datetime.now(timezone.utc) - timedelta(seconds=30)
+    assert http_client.get_retry_after(make_response(format_datetime(retry_at))) == 0
+
+
+def test_token_bucket_limits_the_rate():
+    bucket = TokenBucket(rate=20)
+    start = time.monotonic()
+    # a full bucket allows a burst of one second's worth of requests
+    for _ in range(20):
+        bucket.acquire()
+    assert time.monotonic() - start < 0.1
+    for _ in range(10):
+        bucket.acquire()
+    assert 0.45 < time.monotonic() - start < 0.8
+
+    # a bucket without a rate only waits for pauses
+    bucket = TokenBucket()
+    start = time.monotonic()
+    for _ in range(100):
+        bucket.acquire()
+    bucket.pause(0.2)
+    bucket.acquire()
+    assert 0.2 <= time.monotonic() - start < 0.4
+
+
+def test_rate_limits_apply_per_host(serve):
+    handle, calls = respond_with((200, {}))
+    url = serve(handle)
+    client = make_client(HTTP_RATE_LIMITS="127.0.0.1=10, example.com=0.5")
+    assert client.buckets["example.com"].rate == 0.5
+    start = time.monotonic()
+    for _ in range(15):
+        client.get(url)
+    assert 0.45 < time.monotonic() - start < 0.9
+    # requests to other hosts aren't limited
+    start = time.monotonic()
+    for _ in range(15):
+        client.get(url.replace("127.0.0.1", "localhost"))
+    assert time.monotonic() - start < 0.4
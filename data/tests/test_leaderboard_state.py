@@ -0,0 +1,125 @@
+import pytest
+
+import aggregate
+import dataset
+import leaderboard_state
+from block_store import open_block_store, slot_to_time
+from relay_store import open_relay_store
+from test_block_store import make_block
+from tx_store import TxStore
+
+
+def make_relays(slot):
+    return [["a"], ["a", "b"], [], ["b"]][slot % 4]
+
+
+# Txs each missed by two consecutive blocks.
+def make_txs(first_slot, last_slot):
+    txs = []
+    for slot in range(first_slot, last_slot, 3):
+        misses = [
+            {
+                "slot": s,
+                "block_hash": make_block(s)["block_hash"],
+                "proposal_time": slot_to_time(s),
+            }
+            for s in (slot, slot + 1)
+        ]
+        txs.append({"tx_hash": f"0x{slot:064x}", "misses": misses})
+    return txs
+
+
+def test_changed_slots_are_accounted_again(tmp_path):
+    config = dataset.Config(
+        TXS_SEGMENTS_PATH=str(tmp_path / "segments"),
+        BLOCKS_PATH=str(tmp_path / "blocks.db"),
+        RELAYS_PATH=str(tmp_path / "relays.db"),
+        VALIDATOR_PUBKEYS_PATH="",
+        LIDO_OPERATOR_PUBKEYS_PATH="",
+    )
+    tx_store = TxStore(config.TXS_SEGMENTS_PATH)
+    tx_store.add_txs(make_txs(1000, 1210), lambda new_txs, old_txs: new_txs + old_txs)
+    block_store = open_block_store(config.BLOCKS_PATH, writable=True)
+    relay_store = open_relay_store(config.RELAYS_PATH, writable=True)
+
+    # moves the window to the given slots, writing only the new ones
+    def move_window(first_slot, first_new_slot, last_slot):
+        fetched_range = (slot_to_time(first_slot), slot_to_time(last_slot))
+        slots = range(first_new_slot, last_slot + 1)
+        block_store.delete_blocks_before(first_slot)
+        block_store.upsert_blocks([make_block(s, missed=s % 10 == 0) for s in slots])
+        block_store.set_fetched_range(*fetched_range)
+        relay_store.delete_relays(
+            [s for s in relay_store.get_slots() if s < first_slot]
+        )
+        relay_store.upsert_relays({s: make_relays(s) for s in slots})
+        relay_store.set_fetched_range(*fetched_range)
+        tx_store.write_meta(
+            {"fetched_from": fetched_range[0], "fetched_to": fetched_range[1]}
+        )
+        return fetched_range
+
+    def get_window_froms(fetched_range):
+        return [fetched_range[1] - 60 * 12, fetched_range[1] - 150 * 12]
+
+    def update_tallies(fetched_range):
+        tallies = leaderboard_state.update_tallies(
+            str(tmp_path / "state.db"),
+            config,
+            fetched_range,
+            get_window_froms(fetched_range),
+        )
+        # the windows are kept up to date like the whole range, and they count
+        # the same as when they are aggregated from scratch
+        with dataset.Dataset(config) as d:
+            expected_tallies = aggregate.aggregate_windows(
+                d, aggregate.DIMENSIONS, [None] + get_window_froms(fetched_range)
+            )
+        for window_tallies, expected_window_tallies in zip(tallies, expected_tallies):
+            for dimension in aggregate.DIMENSIONS:
+                tally = window_tallies[dimension]
+                expected_tally = expected_window_tallies[dimension]
+                assert list(tally.misses) == list(expected_tally.misses)
+                assert tally.misses == pytest.approx(expected_tally.misses)
+                assert tally.blocks == pytest.approx(expected_tally.blocks)
+                assert tally.num_blocks == expected_tally.num_blocks
+        return tallies
+
+    # computes the tallies with a new state
+    def recompute_tallies(fetched_range):
+        path = tmp_path / "recomputed.db"
+        path.unlink(missing_ok=True)
+        return leaderboard_state.update_tallies(
+            str(path), config, fetched_range, get_window_froms(fetched_range)
+        )
+
+    try:
+        fetched_range = move_window(1000, 1000, 1199)
+        assert update_tallies(fetched_range) == recompute_tallies(fetched_range)
+
+        # a reorg replaces a block, a relay is backfilled for an earlier slot,
+        # and a slot is dropped from both stores, all within the window
+        block = make_block(1051)
+        block["block_hash"] = "0x" + "ff" * 32
+        block["fee_recipient"] = "0x" + "ee" * 20
+        block_store.upsert_blocks([block])
+        relay_store.upsert_relays({1060: ["a", "b", "c"]})
+        block_store.delete_blocks(1072, 1072)
+        relay_store.delete_relays([1072])
+        tallies = update_tallies(fetched_range)
+        assert tallies == recompute_tallies(fetched_range)
+        assert "0x" + "ee" * 20 in tallies[0][aggregate.FEE_RECIPIENT].blocks
+        assert "c" in tallies[0][aggregate.RELAY].blocks
+
+        # the same while the window moves on and new txs are added in front of
+        # the stored ones of their segment
+        block_store.upsert_blocks([make_block(1051)])
+        relay_store.upsert_relays({1061: ["c"]})
+        tx_store.add_txs(
+            make_txs(1190, 1209), lambda new_txs, old_txs: new_txs + old_txs
+        )
+        fetched_range = move_window(1010, 1200, 1209)
+        assert update_tallies(fetched_range) == recompute_tallies(fetched_range)
+    finally:
+        block_store.close()
+        relay_store.close()
@@ -0,0 +1,134 @@
+import os
+import json
+
+import pytest
+
+from pubkey_table import PUBKEY_SIZE, create_pubkey_table, open_pubkey_table
+
+
+def make_pubkey(index):
+    return "0x" + (index + 1).to_bytes(PUBKEY_SIZE, "big").hex()
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / "pubkeys")
+
+
+def test_put_and_get(path):
+    table = open_pubkey_table(path, writable=True)
+    try:
+        assert len(table) == 0
+        table.put({i: make_pubkey(i) for i in [0, 1, 2, 5, 9]})
+        # records up to the highest index are allocated, the gaps are unknown
+        assert len(table) == 10
+        assert [table.get(i) for i in range(-1, 11)] == [
+            None,
+            make_pubkey(0),
+            make_pubkey(1),
+            make_pubkey(2),
+            None,
+            None,
+            make_pubkey(5),
+            None,
+            None,
+            None,
+            make_pubkey(9),
+            None,
+        ]
+        table.put({3: make_pubkey(3), 4: make_pubkey(4)})
+        assert list(table.items()) == [
+            (i, make_pubkey(i)) for i in [0, 1, 2, 3, 4, 5, 9]
+        ]
+        with pytest.raises(ValueError):
+            table.put({10: "0x1234"})
+    finally:
+        table.close()
+
+    table = open_pubkey_table(path)
+    try:
+        assert len(table) == 10
+        assert table.get(4) == make_pubkey(4)
+        with pytest.raises(ValueError):
+            table.put({10: make_pubkey(10)})
+    finally:
+        table.close()
+
+
+def test_first_missing_index(path):
+    table = open_pubkey_table(path, writable=True)
+    try:
+        assert table.first_missing_index() == 0
+        table.put({i: make_pubkey(i) for i in range(5)})
+        assert table.first_missing_index() == 5
+        table.put({7: make_pubkey(7)})
+        assert table.first_missing_index() == 5
+        table.put({5: make_pubkey(5), 6: make_pubkey(6)})
+        assert table.first_missing_index() == 8
+        # a run of zero bytes across two records isn't an unknown pubkey
+        half = PUBKEY_SIZE // 2
+        table.put(
+            {
+                8: "0x" + ("ff" * half + "00" * half),
+                9: "0x" + ("00" * half + "ff" * half),
+            }
+        )
+        assert table.first_missing_index() == 10
+    finally:
+        table.close()
+
+
+def test_fetched_at_slot_is_persisted(path):
+    create_pubkey_table(path, fetched_at_slot=1234)
+    table = open_pubkey_table(path, writable=True)
+    try:
+        assert table.fetched_at_slot == 1234
+        table.put({0: make_pubkey(0)})
+        table.set_fetched_at_slot(5678)
+        assert table.get(0) == make_pubkey(0)
+    finally:
+        table.close()
+
+    table = open_pubkey_table(path)
+    try:
+        assert table.fetched_at_slot == 5678
+        assert table.get(0) == make_pubkey(0)
+    finally:
+        table.close()
+
+
+def test_only_writers_create_tables(path, tmp_path):
+    with pytest.raises(FileNotFoundError):
+        open_pubkey_table(path)
+    assert not os.path.exists(path)
+
+    other_path = tmp_path / "other"
+    other_path.write_bytes(b"something else")
+    with pytest.raises(ValueError):
+        open_pubkey_table(str(other_path))
+
+
+def test_legacy_json_is_migrated(path):
+    legacy_pubkeys = {
+        "fetched_at_slot": 4321,
+        "pubkeys": {str(i): make_pubkey(i) for i in [0, 1, 3]},
+    }
+    with open(path, "w") as f:
+        json.dump(legacy_pubkeys, f)
+
+    # readers leave the file alone
+    with pytest.raises(ValueError):
+        open_pubkey_table(path)
+    with open(path) as f:
+        assert json.load(f) == legacy_pubkeys
+
+    table = open_pubkey_table(path, writable=True)
+    table.close()
+    with open(path + ".bak") as f:
+        assert json.load(f) == legacy_pubkeys
+    table = open_pubkey_table(path)
+    try:
+        assert table.fetched_at_slot == 4321
+        assert list(table.items()) == [(i, make_pubkey(i)) for i in [0, 1, 3]]
+    finally:
+        table.close()
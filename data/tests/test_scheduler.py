@@ -0,0 +1,114 @@
+import os
+
+import pytest
+
+from scheduler import Stage, run_stages
+
+
+# Returns a pipeline of three stages: fetch writes txs from an external source,
+# blocks is derived from txs and a param, and leaderboard from both. Each run
+# appends the stage name to runs and writes its output, except for fetch if
+# fetch_changes is False.
+def make_stages(tmp_path, runs, window=10, fail=(), fetch_changes=True):
+    def make_run(name, path):
+        def run():
+            runs.append(name)
+            if name in fail:
+                raise ValueError(f"{name} failed")
+            if name == "fetch" and not fetch_changes:
+                return
+            with open(path, "a") as f:
+                f.write(name)
+
+        return run
+
+    txs = str(tmp_path / "txs")
+    blocks = str(tmp_path / "blocks")
+    config = str(tmp_path / "config")
+    leaderboard = str(tmp_path / "leaderboard")
+    return [
+        Stage(
+            name="leaderboard",
+            run=make_run("leaderboard", leaderboard),
+            inputs=[txs, blocks, config],
+            outputs=[leaderboard],
+        ),
+        Stage(
+            name="blocks",
+            run=make_run("blocks", blocks),
+            inputs=[txs],
+            outputs=[blocks],
+            params={"window": window},
+        ),
+        Stage(name="fetch", run=make_run("fetch", txs), outputs=[txs], external=True),
+    ]
+
+
+def test_stages_run_in_dependency_order(tmp_path):
+    runs = []
+    run_stages(make_stages(tmp_path, runs))
+    assert runs == ["fetch", "blocks", "leaderboard"]
+    # without state, nothing is skipped
+    run_stages(make_stages(tmp_path, runs))
+    assert runs == ["fetch", "blocks", "leaderboard"] * 2
+
+
+def test_unchanged_stages_are_skipped(tmp_path):
+    state_path = str(tmp_path / "state.json")
+    config_path = tmp_path / "config"
+    config_path.write_text("a")
+    runs = []
+    run_stages(make_stages(tmp_path, runs), state_path)
+    assert runs == ["fetch", "blocks", "leaderboard"]
+
+    # external stages always run and change the inputs of the others
+    runs.clear()
+    run_stages(make_stages(tmp_path, runs), state_path)
+    assert runs == ["fetch", "blocks", "leaderboard"]
+
+    # the stages after an external stage that didn't change anything are skipped
+    runs.clear()
+    run_stages(make_stages(tmp_path, runs, fetch_changes=False), state_path)
+    assert runs == ["fetch"]
+
+    # a changed input only invalidates the stages reading it
+    config_path.write_text("ab")
+    runs.clear()
+    run_stages(make_stages(tmp_path, runs, fetch_changes=False), state_path)
+    assert runs == ["fetch", "leaderboard"]
+
+    # a changed param invalidates its stage, whose new output invalidates the
+    # next one
+    runs.clear()
+    run_stages(make_stages(tmp_path, runs, window=20, fetch_changes=False), state_path)
+    assert runs == ["fetch", "blocks", "leaderboard"]
+
+    # a missing output is written again
+    os.remove(tmp_path / "leaderboard")
+    runs.clear()
+    run_stages(make_stages(tmp_path, runs, window=20, fetch_changes=False), state_path)
+    assert runs == ["fetch", "leaderboard"]
+
+
+def test_failed_stages_are_run_again(tmp_path):
+    state_path = str(tmp_path / "state.json")
+    runs = []
+    with pytest.raises(ValueError, match="blocks failed"):
+        run_stages(make_stages(tmp_path, runs, fail={"blocks"}), state_path)
+    # stages after a failed one aren't started
+    assert runs == ["fetch", "blocks"]
+
+    runs.clear()
+    run_stages(make_stages(tmp_path, runs, fetch_changes=False), state_path)
+    assert runs == ["fetch", "blocks", "leaderboard"]
+
+
+def test_cyclic_stages_are_rejected(tmp_path):
+    a = str(tmp_path / "a")
+    b = str(tmp_path / "b")
+    stages = [
+        Stage(name="a", run=lambda: None, inputs=[b], outputs=[a]),
+        Stage(name="b", run=lambda: None, inputs=[a], outputs=[b]),
+    ]
+    with pytest.raises(ValueError, match="cyclic"):
+        run_stages(stages)
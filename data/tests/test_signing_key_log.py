@@ -0,0 +1,77 @@
+import pytest
+
+from signing_key_log import SigningKeyLog
+
+
+def make_event(block_number, log_index=0):
+    return {
+        "block_number": block_number,
+        "log_index": log_index,
+        "block_hash": f"0x{block_number:064x}",
+        "operator_id": block_number % 3,
+        "pubkey": f"0x{block_number:096x}",
+    }
+
+
+def make_checkpoint(block_number):
+    return {"block_number": block_number, "block_hash": f"0x{block_number - 1:064x}"}
+
+
+def test_append_and_rollback(tmp_path):
+    path = str(tmp_path / "log")
+    log = SigningKeyLog(path)
+    assert log.get_last_checkpoint() is None
+    log.append(
+        [make_event(15), make_event(5, 1), make_event(5, 0)],
+        [make_checkpoint(10), make_checkpoint(20)],
+    )
+    log.append([make_event(25)], [make_checkpoint(30)])
+    assert list(log.read_events()) == [
+        make_event(5, 0),
+        make_event(5, 1),
+        make_event(15),
+        make_event(25),
+    ]
+    assert [c["block_number"] for c in log.checkpoints] == [10, 20, 30]
+
+    log.rollback(log.checkpoints[0])
+    assert list(log.read_events()) == [make_event(5, 0), make_event(5, 1)]
+    # the rollback persists
+    log = SigningKeyLog(path)
+    assert [c["block_number"] for c in log.checkpoints] == [10]
+    assert list(log.read_events()) == [make_event(5, 0), make_event(5, 1)]
+
+    log.rollback(None)
+    assert log.get_last_checkpoint() is None
+    assert list(log.read_events()) == []
+
+
+def test_uncommitted_events_are_dropped(tmp_path):
+    path = str(tmp_path / "log")
+    log = SigningKeyLog(path)
+    log.append([make_event(5)], [make_checkpoint(10)])
+    with pytest.raises(ValueError):
+        log.append([make_event(15), make_event(25)], [make_checkpoint(20)])
+    # events written before a crash, but not covered by a checkpoint
+    with open(log.events_path, "a") as f:
+        f.write('{"block_number": 25')
+
+    log = SigningKeyLog(path)
+    assert [c["block_number"] for c in log.checkpoints] == [10, 20]
+    assert list(log.read_events()) == [make_event(5), make_event(15)]
+
+
+def test_compact(tmp_path):
+    path = str(tmp_path / "log")
+    log = SigningKeyLog(path)
+    for block_number in [10, 20, 25, 30, 33]:
+        log.append([make_event(block_number - 1)], [make_checkpoint(block_number)])
+    log.compact(lambda c: c["block_number"] % 10 == 0)
+    assert [c["block_number"] for c in log.checkpoints] == [10, 20, 30, 33]
+
+    # the events are unchanged and rolling back still truncates them
+    log = SigningKeyLog(path)
+    assert [c["block_number"] for c in log.checkpoints] == [10, 20, 30, 33]
+    assert len(list(log.read_events())) == 5
+    log.rollback(log.checkpoints[1])
+    assert list(log.read_events()) == [make_event(9), make_event(19)]
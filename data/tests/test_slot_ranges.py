@@ -0,0 +1,73 @@
+import random
+
+from slot_ranges import SlotRanges
+
+
+def test_add_merges_overlapping_and_adjacent_ranges():
+    slot_ranges = SlotRanges([[10, 20], [30, 40]])
+    slot_ranges.add(21, 22)
+    assert slot_ranges.to_list() == [[10, 22], [30, 40]]
+    slot_ranges.add(25, 25)
+    assert slot_ranges.to_list() == [[10, 22], [25, 25], [30, 40]]
+    slot_ranges.add(15, 35)
+    assert slot_ranges.to_list() == [[10, 40]]
+    slot_ranges.add(5, 9)
+    slot_ranges.add(41, 41)
+    assert slot_ranges.to_list() == [[5, 41]]
+    assert len(slot_ranges) == 37
+    # empty ranges are ignored
+    slot_ranges.add(50, 49)
+    assert slot_ranges.to_list() == [[5, 41]]
+
+
+def test_remove_splits_ranges():
+    slot_ranges = SlotRanges([[10, 20], [30, 40]])
+    slot_ranges.remove(15, 15)
+    assert slot_ranges.to_list() == [[10, 14], [16, 20], [30, 40]]
+    slot_ranges.remove(18, 35)
+    assert slot_ranges.to_list() == [[10, 14], [16, 17], [36, 40]]
+    slot_ranges.remove(0, 9)
+    slot_ranges.remove(41, 100)
+    assert slot_ranges.to_list() == [[10, 14], [16, 17], [36, 40]]
+    slot_ranges.remove(0, 100)
+    assert not slot_ranges
+    assert len(slot_ranges) == 0
+
+
+def test_set_operations():
+    a = SlotRanges([[0, 9], [20, 29]])
+    b = SlotRanges([[5, 24]])
+    assert a.union(b).to_list() == [[0, 29]]
+    assert a.difference(b).to_list() == [[0, 4], [25, 29]]
+    assert b.difference(a).to_list() == [[10, 19]]
+    assert a.clip(5, 24).to_list() == [[5, 9], [20, 24]]
+    assert a.clip(10, 19).to_list() == []
+    # the operands are left as they are
+    assert a.to_list() == [[0, 9], [20, 29]]
+    assert b.to_list() == [[5, 24]]
+
+
+def test_matches_sets():
+    rng = random.Random(1)
+    for _ in range(100):
+        slot_ranges = SlotRanges()
+        slots = set()
+        for _ in range(20):
+            first = rng.randrange(100)
+            last = first + rng.randrange(-2, 10)
+            if rng.random() < 0.6:
+                slot_ranges.add(first, last)
+                slots.update(range(first, last + 1))
+            else:
+                slot_ranges.remove(first, last)
+                slots.difference_update(range(first, last + 1))
+            assert list(slot_ranges) == sorted(slots)
+            assert len(slot_ranges) == len(slots)
+            assert all(
+                (slot in slot_ranges) == (slot in slots) for slot in range(-1, 120)
+            )
+            assert slot_ranges == SlotRanges.from_slots(slots)
+            for (_, last), (first, _) in zip(
+                slot_ranges.to_list(), slot_ranges.to_list()[1:]
+            ):
+                assert first > last + 1
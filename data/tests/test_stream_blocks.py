@@ -0,0 +1,94 @@
+import pytest
+
+import stream_blocks
+from block_store import open_block_store
+from stub_chain import StubChain
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = open_block_store(str(tmp_path / "blocks.db"), writable=True)
+    yield store
+    store.close()
+
+
+def make_config(url, mode="full"):
+    return stream_blocks.Config(
+        BLOCKS_PATH="",
+        CONSENSUS_API_URL=url,
+        BLOCK_FETCH_MODE=mode,
+    )
+
+
+@pytest.mark.parametrize("mode", ["full", "blinded", "ssz", "duties"])
+def test_on_head(serve, store, mode):
+    chain = StubChain(100, 110, missed_slots={104, 105})
+    follower = stream_blocks.HeadFollower(make_config(serve(chain.handle), mode), store)
+    follower.head_slot = 100
+
+    follower.on_block({"slot": "103", "block": chain.root(103)})
+    for slot in [101, 102, 103, 106]:
+        follower.on_head({"slot": str(slot), "block": chain.root(slot)})
+
+    assert store.get_blocks(101, 106) == chain.expected_blocks(101, 106)
+    assert follower.head_slot == 106
+    # the block announced by the block event isn't fetched again
+    assert len([path for path in chain.paths if path.endswith(chain.root(103))]) == 1
+
+
+def test_on_chain_reorg(serve, store):
+    chain = StubChain(100, 106)
+    follower = stream_blocks.HeadFollower(make_config(serve(chain.handle)), store)
+    follower.head_slot = 100
+    old_roots = {slot: chain.root(slot) for slot in range(101, 107)}
+    # the new head is at slot 104, before the old one
+    chain.reorg(103, {103, 104})
+    chain.set_block(107)
+
+    for slot in range(101, 107):
+        follower.on_head({"slot": str(slot), "block": old_roots[slot]})
+    follower.on_chain_reorg({"slot": "104", "depth": "2"})
+    assert store.get_blocks(101, 106) == chain.expected_blocks(101, 106)
+    assert follower.head_slot == 104
+
+    # the slots orphaned by the reorg are already known to be missed
+    follower.on_head({"slot": "107", "block": chain.root(107)})
+    assert store.get_blocks(101, 107) == chain.expected_blocks(101, 107)
+    assert follower.head_slot == 107
+
+
+def test_backfill_after_reconnect(serve, store):
+    chain = StubChain(100, 110, missed_slots={105})
+    store.upsert_blocks(chain.expected_blocks(100, 110))
+    # while disconnected, the chain reorgs before the last head seen and moves on
+    chain.reorg(108, {109, 111, 112})
+    follower = stream_blocks.HeadFollower(make_config(serve(chain.handle)), store)
+    assert follower.head_slot == 110
+
+    follower.follow()
+    assert store.get_blocks(100, 112) == chain.expected_blocks(100, 112)
+    assert follower.head_slot == 112
+
+    # the head moves back behind the last head seen
+    chain.reorg(111, {111})
+    follower.follow()
+    assert store.get_blocks(100, 112) == chain.expected_blocks(100, 112)
+    assert store.get_blocks(112, 112)[0]["missed"]
+    assert follower.head_slot == 111
+
+
+def test_follow(serve, store):
+    chain = StubChain(100, 104, missed_slots={103})
+    store.upsert_blocks(chain.expected_blocks(100, 100))
+    follower = stream_blocks.HeadFollower(make_config(serve(chain.handle)), store)
+    for slot in [105, 107]:
+        chain.set_block(slot)
+        chain.add_event("block", {"slot": str(slot), "block": chain.root(slot)})
+        chain.add_event("head", {"slot": str(slot), "block": chain.root(slot)})
+    chain.head_slot = 104
+
+    follower.follow()
+    # slots up to the head at connection time are backfilled, the rest comes
+    # from the events
+    assert store.get_blocks(100, 107) == chain.expected_blocks(100, 107)
+    assert follower.head_slot == 107
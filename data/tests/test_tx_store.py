@@ -0,0 +1,52 @@
+import os
+
+from tx_store import TxStore, SEGMENT_DURATION
+
+
+def make_tx(i, t):
+    return {"tx_hash": f"0x{i:064x}", "misses": [{"proposal_time": t}]}
+
+
+def read_sorted(store, low_cutoff):
+    return sorted(store.read_txs(low_cutoff), key=lambda tx: tx["tx_hash"])
+
+
+def merge(txs1, txs2):
+    hashes = set(tx["tx_hash"] for tx in txs1)
+    return txs1 + [tx for tx in txs2 if tx["tx_hash"] not in hashes]
+
+
+def test_add_expire_and_read(tmp_path):
+    store = TxStore(str(tmp_path / "segments"))
+    t0 = 100 * SEGMENT_DURATION
+    txs = [make_tx(i, t0 + i * SEGMENT_DURATION // 2) for i in range(6)]
+    store.add_txs(txs[:4], merge)
+    store.add_txs(txs[3:], merge)
+    assert store.get_segment_starts() == [
+        t0,
+        t0 + SEGMENT_DURATION,
+        t0 + 2 * SEGMENT_DURATION,
+    ]
+    assert read_sorted(store, t0) == txs
+
+    # txs before the cutoff are skipped, segments are only deleted once all of
+    # their txs are expired
+    cutoff = t0 + SEGMENT_DURATION + 1
+    assert read_sorted(store, cutoff) == txs[3:]
+    store.expire(cutoff)
+    assert store.get_segment_starts() == [
+        t0 + SEGMENT_DURATION,
+        t0 + 2 * SEGMENT_DURATION,
+    ]
+    assert read_sorted(store, cutoff) == txs[3:]
+
+
+def test_readers_dont_create_the_store(tmp_path):
+    path = str(tmp_path / "segments")
+    assert TxStore(path, writable=False).read_meta() is None
+    assert not os.path.exists(path)
+    TxStore(path).write_meta({"fetched_from": 1, "fetched_to": 2})
+    assert TxStore(path, writable=False).read_meta() == {
+        "fetched_from": 1,
+        "fetched_to": 2,
+    }
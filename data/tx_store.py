@@ -0,0 +1,97 @@
+import os
+import json
+
+from file_stats import write_json_atomically
+
+
+SEGMENT_DURATION = 60 * 60
+META_FILENAME = "meta.json"
+SEGMENT_SUFFIX = ".json"
+
+
+# Store of censored txs, partitioned into segments by the proposal time of their
+# first miss. Each segment is a JSON list of txs in a file named after the start
+# of its time bucket. Since the first miss of a tx never changes, a tx always ends
+# up in the same segment, so appending new txs only touches the newest segments
+# and expiring old txs means deleting whole segment files.
+#
+# The store is read directly by the scripts that need the txs, only writers
+# create its directory.
+class TxStore:
+    def __init__(self, path, writable=True):
+        self.path = path
+        if writable:
+            os.makedirs(self.path, exist_ok=True)
+
+    def read_meta(self):
+        try:
+            with open(os.path.join(self.path, META_FILENAME)) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def write_meta(self, meta):
+        write_json_atomically(os.path.join(self.path, META_FILENAME), meta)
+
+    def get_segment_starts(self):
+        starts = []
+        for filename in os.listdir(self.path):
+            if filename == META_FILENAME or not filename.endswith(SEGMENT_SUFFIX):
+                continue
+            starts.append(int(filename[: -len(SEGMENT_SUFFIX)]))
+        return sorted(starts)
+
+    def get_segment_path(self, segment_start):
+        return os.path.join(self.path, f"{segment_start}{SEGMENT_SUFFIX}")
+
+    def read_segment(self, segment_start):
+        try:
+            with open(self.get_segment_path(segment_start)) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return []
+
+    def read_segment_text(self, segment_start):
+        with open(self.get_segment_path(segment_start)) as f:
+            return f.read()
+
+    # Returns the txs first missed at or after the cutoff in the order of their
+    # segments. Only the oldest segments may contain earlier txs, which haven't
+    # been expired yet.
+    def read_txs(self, low_cutoff):
+        txs = []
+        for segment_start in self.get_segment_starts():
+            segment_txs = self.read_segment(segment_start)
+            if segment_start < low_cutoff:
+                segment_txs = [
+                    tx
+                    for tx in segment_txs
+                    if tx["misses"][0]["proposal_time"] >= low_cutoff
+                ]
+            txs.extend(segment_txs)
+        return txs
+
+    def write_segment(self, segment_start, txs):
+        write_json_atomically(self.get_segment_path(segment_start), txs)
+
+    # Adds txs to their segments. If a tx is already stored, it is replaced by
+    # the new version.
+    def add_txs(self, txs, merge):
+        txs_by_segment = {}
+        for tx in txs:
+            segment_start = get_segment_start(tx)
+            txs_by_segment.setdefault(segment_start, []).append(tx)
+        for segment_start, new_txs in sorted(txs_by_segment.items()):
+            old_txs = self.read_segment(segment_start)
+            self.write_segment(segment_start, merge(new_txs, old_txs))
+
+    # Deletes all segments that only contain txs first missed before the cutoff.
+    def expire(self, low_cutoff):
+        for segment_start in self.get_segment_starts():
+            if segment_start + SEGMENT_DURATION <= low_cutoff:
+                os.remove(self.get_segment_path(segment_start))
+
+
+def get_segment_start(tx):
+    t = tx["misses"][0]["proposal_time"]
+    return t - t % SEGMENT_DURATION
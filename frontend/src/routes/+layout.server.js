@@ -24,8 +24,48 @@ async function loadJsonAtPath(path) {
   return data;
 }
 
+// Loads the txs from the segments written by fetch_txs.py, see data/tx_store.py.
+// The meta file has the fetched range, segments are named after their start time
+// and may contain txs from before the range that haven't been expired yet.
+async function loadTxsAtPath(path) {
+  if (!path) {
+    return null;
+  }
+
+  const meta = await loadJsonAtPath(path + '/meta.json');
+  if (meta === null) {
+    return null;
+  }
+
+  let filenames;
+  try {
+    filenames = await fs.promises.readdir(path);
+  } catch (e) {
+    console.error('failed to list txs segments at ' + path + ': ' + e.toString());
+    return null;
+  }
+  const segmentStarts = filenames
+    .filter((filename) => /^\d+\.json$/.test(filename))
+    .map((filename) => parseInt(filename))
+    .sort((a, b) => a - b);
+
+  const txs = [];
+  for (const segmentStart of segmentStarts) {
+    const segment = await loadJsonAtPath(path + '/' + segmentStart + '.json');
+    if (segment === null) {
+      continue;
+    }
+    for (const tx of segment) {
+      if (tx.misses[0].proposal_time >= meta.fetched_from) {
+        txs.push(tx);
+      }
+    }
+  }
+  return { ...meta, txs: txs };
+}
+
 export async function load({ params }) {
-  const txs = await loadJsonAtPath(env.TXS_PATH);
+  const txs = await loadTxsAtPath(env.TXS_SEGMENTS_PATH);
   const depositorLeaderboard = await loadJsonAtPath(env.DEPOSITOR_LEADERBOARD_PATH);
   const builderLeaderboard = await loadJsonAtPath(env.BUILDER_LEADERBOARD_PATH);
   const relayLeaderboard = await loadJsonAtPath(env.RELAY_LEADERBOARD_PATH);